@@ -24,14 +24,25 @@
 #  @Description: Python binding for CISCO UCS XML API
 
 
+import collections
+import contextlib
+import hashlib
 import httplib
+import json
 import logging
-import os
+import mmap
+import Queue
+import re
 import socket
+import tempfile
+import time
 from xml.dom import minidom
 import xml.dom as dom
+import xml.etree.cElementTree as ElementTree
 import threading
 from threading import Timer
+import weakref
+import zlib
 from decorator import decorator
 
 DEBUG = False
@@ -53,6 +64,223 @@ def _iterable(possibly_iterable):
     return True
 
 
+def _split_dn(dn):
+    """Splits dn to list of rns. Slashes inside brackets, like in
+'ip-[10.0.0.1/24]', are not treated as separators."""
+    rns = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(dn):
+        if c == '[':
+            depth += 1
+        elif c == ']' and depth:
+            depth -= 1
+        elif c == '/' and not depth:
+            rns.append(dn[start:i])
+            start = i + 1
+    rns.append(dn[start:])
+    return [rn for rn in rns if rn]
+
+
+class Dn(str):
+    """Distinguished name of managed object. Dn is a string, so it can be used
+everywhere plain dn was used. Instances are interned, their rns and parent are
+computed once and shared.
+    """
+    _interned = {}
+    # interning table is dropped when grows over this size
+    MAX_INTERNED = 1 << 20
+
+    def __new__(cls, value=''):
+        if type(value) is Dn:
+            return value
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        dn = cls._interned.get(value)
+        if dn is None:
+            normalized = value
+            if value.startswith('/') or value.endswith('/') \
+                    or '//' in value:
+                normalized = '/'.join(_split_dn(value))
+            dn = str.__new__(cls, normalized)
+            dn._rns = None
+            dn._parent = None
+            if len(cls._interned) >= cls.MAX_INTERNED:
+                cls._interned.clear()
+            cls._interned[value] = dn
+        return dn
+
+    def __reduce__(self):
+        return Dn, (str(self),)
+
+    @property
+    def rns(self):
+        """Tuple of relative names."""
+        if self._rns is None:
+            self._rns = tuple(_split_dn(self))
+        return self._rns
+
+    @property
+    def rn(self):
+        rns = self.rns
+        return rns and rns[-1] or ''
+
+    @property
+    def depth(self):
+        return len(self.rns)
+
+    @property
+    def parent(self):
+        """Dn of parent object or None for top level dn."""
+        if self._parent is None and len(self.rns) > 1:
+            self._parent = Dn(self[:-len(self.rn) - 1])
+            if self._parent._rns is None:
+                self._parent._rns = self._rns[:-1]
+        return self._parent
+
+    def ancestors(self):
+        """Returns list of ancestor dns, nearest first."""
+        res = []
+        dn = self.parent
+        while dn is not None:
+            res.append(dn)
+            dn = dn.parent
+        return res
+
+    def child(self, rn):
+        """Returns dn of child object with given rn."""
+        if not self:
+            return Dn(rn)
+        dn = Dn('%s/%s' % (self, rn))
+        if dn._parent is None:
+            dn._parent = self
+        return dn
+
+    def is_ancestor_of(self, other):
+        return len(other) > len(self) and other.startswith(self) \
+            and other[len(self)] == '/' and bool(self)
+
+    def in_subtree(self, root):
+        """True if dn equals root or is its descendant."""
+        return self == root or Dn(root).is_ancestor_of(self)
+
+
+def _run_in_threads(func, items, parallelism):
+    """Calls func for every item using at most parallelism threads. Returns
+list of (result, exception) pairs in order of items."""
+    items = list(items)
+    results = [None] * len(items)
+    lock = threading.Lock()
+    indexes = iter(range(len(items)))
+
+    def worker():
+        while True:
+            with lock:
+                try:
+                    i = indexes.next()
+                except StopIteration:
+                    return
+            try:
+                results[i] = (func(items[i]), None)
+            except Exception, e:
+                results[i] = (None, e)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(parallelism, len(items))) - 1)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    worker()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _iter_in_threads(func, items, parallelism):
+    """Calls func for items, taken lazily, using at most parallelism threads.
+Yields results in order of items, computing at most parallelism of them ahead
+of consumer. Exception raised by func is reraised when its result is due."""
+    items = iter(items)
+    cond = threading.Condition()
+    results = {}
+    state = {'next': 0, 'taken': 0, 'exhausted': False, 'stop': False}
+
+    def worker():
+        while True:
+            with cond:
+                while not state['stop'] and \
+                        state['taken'] >= state['next'] + parallelism:
+                    cond.wait()
+                if state['stop'] or state['exhausted']:
+                    return
+                i = state['taken']
+                try:
+                    item = next(items)
+                except StopIteration:
+                    state['exhausted'] = True
+                    cond.notify_all()
+                    return
+                state['taken'] += 1
+            try:
+                res = (func(item), None)
+            except Exception, e:
+                res = (None, e)
+            with cond:
+                results[i] = res
+                cond.notify_all()
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, parallelism))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            with cond:
+                while state['next'] not in results and \
+                        not (state['exhausted'] and
+                             state['next'] >= state['taken']):
+                    cond.wait()
+                if state['next'] not in results:
+                    break
+                res, exc = results.pop(state['next'])
+                state['next'] += 1
+                cond.notify_all()
+            if exc is not None:
+                raise exc
+            yield res
+        # all items are done, workers are exiting
+        for thread in threads:
+            thread.join()
+    finally:
+        with cond:
+            state['stop'] = True
+            cond.notify_all()
+
+
+def _regex_escape(value):
+    return re.sub(r'([.^$*+?()\[\]{}|\\])', r'\\\1', value)
+
+
+class _PartitionSize(object):
+    """Number of units (dns or ids) per partition, adapted to keep replies
+under max_bytes."""
+
+    def __init__(self, size, max_bytes):
+        self.size = size
+        self.max_bytes = max_bytes
+
+    def observe(self, units, reply_size):
+        if not self.max_bytes or not reply_size:
+            return
+        if reply_size > self.max_bytes:
+            LOG.warning('Reply of %d bytes exceeds budget of %d bytes',
+                        reply_size, self.max_bytes)
+        if units:
+            unit_bytes = float(reply_size) / units
+            self.size = max(1, int(self.max_bytes * 0.9 / unit_bytes))
+
+
 class UcsmError(Exception):
     """Any error during UCSM session.
     """""
@@ -81,6 +309,75 @@ class UcsmResponseError(UcsmError):
         super(UcsmResponseError, self).__init__(text)
 
 
+class UcsmTimeoutError(UcsmFatalError):
+    """Request deadline has passed.
+    """
+    pass
+
+
+class UcsmCancelledError(UcsmError):
+    """Request was cancelled with UcsmCancellationToken.
+    """
+    pass
+
+
+class UcsmCancellationToken(object):
+    """Cancels requests made under it from any thread, aborting those in
+progress.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            connections = list(self._connections)
+        for conn in connections:
+            _abort_connection(conn)
+
+    def check(self):
+        if self.cancelled:
+            raise UcsmCancelledError('Request was cancelled')
+
+    def _register(self, conn):
+        with self._lock:
+            self._connections.add(conn)
+            cancelled = self.cancelled
+        if cancelled:
+            _abort_connection(conn)
+
+    def _unregister(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+
+
+class UcsmRetryPolicy(object):
+    """Retries read requests failed with transport or timeout errors, with
+exponentially growing delay, while deadline allows. Writes are never
+retried.
+    """
+
+    def __init__(self, retries=2, backoff=0.2, max_backoff=5):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delays(self):
+        delay = self.backoff
+        for _ in xrange(self.retries):
+            yield delay
+            delay = min(self.max_backoff, delay * 2)
+
+
+class UcsmQueueTimeoutError(UcsmError):
+    """Request was not admitted by scheduler in time.
+    """
+    pass
+
+
 class ReadlineAdapter(object):
     """Wrapper, implements readline function for any file object.
     """
@@ -95,11 +392,131 @@ class ReadlineAdapter(object):
         buffer = ''
         while True:
             c = self.__io.read(1)
-            if c is not None and c == '\n':
+            if not c:
+                raise EOFError()
+            if c == '\n':
                 return buffer
             buffer += c
 
 
+class UcsmBulkResult(object):
+    """Result of bulk configuration. Contains dictionary of dn:changed_config
+for applied configs and dictionary of dn:exception for failed ones.
+    """
+
+    def __init__(self):
+        self.changed = {}
+        self.failed = {}
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __repr__(self):
+        return '<UcsmBulkResult: %d changed, %d failed>' % (len(self.changed),
+                                                           len(self.failed))
+
+
+class UcsmScheduler(object):
+    """Admission control for requests of connections sharing it: token bucket
+of rate requests per second with burst capacity, limit of concurrent requests
+and strict priority classes, first come first served within class. Request
+which waits longer than queue timeout of its priority is rejected with
+UcsmQueueTimeoutError. Wait times and rejections are counted in stats.
+    """
+    INTERACTIVE = 'interactive'
+    BACKGROUND = 'background'
+    BULK = 'bulk'
+    PRIORITIES = (INTERACTIVE, BACKGROUND, BULK)
+
+    def __init__(self, rate=None, burst=None, max_concurrent=None,
+                 queue_timeout=None):
+        self.rate = rate
+        self.burst = burst or (rate and max(1, rate)) or 1
+        self.max_concurrent = max_concurrent
+        if not isinstance(queue_timeout, dict):
+            queue_timeout = dict.fromkeys(self.PRIORITIES, queue_timeout)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._running = 0
+        self._queues = dict((priority, collections.deque())
+                            for priority in self.PRIORITIES)
+        self._stats = dict((priority, {'admitted': 0, 'rejected': 0,
+                                       'wait': 0.0, 'max_wait': 0.0})
+                           for priority in self.PRIORITIES)
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _head(self):
+        for priority in self.PRIORITIES:
+            if self._queues[priority]:
+                return self._queues[priority][0]
+        return None
+
+    def acquire(self, priority=INTERACTIVE, deadline=None):
+        """Waits until request of given priority may be sent, but not after
+deadline."""
+        ticket = object()
+        started = time.time()
+        timeout = self.queue_timeout.get(priority)
+        if timeout is not None:
+            deadline = min(deadline or started + timeout, started + timeout)
+        with self._cond:
+            queue = self._queues[priority]
+            queue.append(ticket)
+            while True:
+                now = time.time()
+                self._refill(now)
+                wait = None
+                if self._head() is ticket and (
+                        self.max_concurrent is None or
+                        self._running < self.max_concurrent):
+                    if not self.rate or self._tokens >= 1:
+                        break
+                    wait = (1 - self._tokens) / self.rate
+                if deadline is not None:
+                    if now >= deadline:
+                        queue.remove(ticket)
+                        self._stats[priority]['rejected'] += 1
+                        self._cond.notify_all()
+                        raise UcsmQueueTimeoutError(
+                            'Request of %s priority was not admitted in %.3f '
+                            'seconds' % (priority, now - started))
+                    wait = min(wait or deadline - now, deadline - now)
+                self._cond.wait(wait)
+            queue.popleft()
+            if self.rate:
+                self._tokens -= 1
+            self._running += 1
+            waited = now - started
+            stats = self._stats[priority]
+            stats['admitted'] += 1
+            stats['wait'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """Returns dictionary of priority: counters of admitted and rejected
+requests, total and maximal wait time, and current queue length."""
+        with self._cond:
+            res = {}
+            for priority, stats in self._stats.iteritems():
+                res[priority] = dict(stats,
+                                     queued=len(self._queues[priority]))
+            return res
+
+
 class UcsmFilterOp(object):
     def xml(self):
         return self.xml_node().toxml()
@@ -124,6 +541,382 @@ class UcsmFilterOp(object):
     def visit(self, visitor):
         return visitor.visit_op(self)
 
+    def matches(self, obj):
+        """Evaluates filter for object on client side."""
+        return self.visit(MatchVisitor(obj))
+
+
+class UcsmWatch(object):
+    """Watcher registered with UcsmConnection.watch.
+    """
+
+    def __init__(self, dispatcher, class_ids, dn_prefix, filter, callback,
+                 on_subscribe=None, on_lost=None):
+        self._dispatcher = dispatcher
+        self.class_ids = class_ids
+        self.dn_prefix = dn_prefix
+        self.filter = filter
+        self.callback = callback
+        self.on_subscribe = on_subscribe
+        self.on_lost = on_lost
+        self.active = True
+
+    def matches(self, obj):
+        if self.class_ids is not None and obj.ucs_class not in self.class_ids:
+            return False
+        if self.dn_prefix is not None and \
+                not Dn(obj.attributes.get('dn', '')).in_subtree(
+                    self.dn_prefix):
+            return False
+        if self.filter is None:
+            return True
+        if isinstance(self.filter, UcsmFilterOp):
+            return self.filter.matches(obj)
+        return self.filter(obj)
+
+    def cancel(self):
+        """Stops watching. Subscription is closed with last watcher."""
+        if self.active:
+            self.active = False
+            self._dispatcher.remove(self)
+
+
+class _UcsmWatchDispatcher(object):
+    """Single event subscription which dispatches events to watchers using
+index by class and trie of dn prefixes.
+    """
+    retry_delay = 5
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.stopped = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._by_class = {}
+        self._trie = {}
+        self._all = set()
+        self._watches = set()
+        self._conn = None
+        self._thread = threading.Thread(target=self._run,
+                                        name='pyucsm-watch-%s' %
+                                             connection.host)
+        self._thread.daemon = True
+
+    def add(self, class_ids, dn_prefix, filter, callback, on_subscribe=None,
+            on_lost=None):
+        """Returns new UcsmWatch, or None if dispatcher is already stopped."""
+        if isinstance(class_ids, basestring):
+            class_ids = [class_ids]
+        if class_ids is not None:
+            class_ids = frozenset(class_ids)
+        if dn_prefix is not None:
+            dn_prefix = Dn(dn_prefix)
+        watch = UcsmWatch(self, class_ids, dn_prefix, filter, callback,
+                          on_subscribe, on_lost)
+        with self._lock:
+            if self.stopped:
+                return None
+            for bucket in self._buckets(watch, create=True):
+                bucket.add(watch)
+            self._watches.add(watch)
+            if len(self._watches) == 1:
+                self._thread.start()
+        return watch
+
+    def remove(self, watch):
+        with self._lock:
+            for bucket in self._buckets(watch):
+                bucket.discard(watch)
+            self._watches.discard(watch)
+            if not self._watches:
+                self.stop()
+
+    def _buckets(self, watch, create=False):
+        if watch.class_ids is not None:
+            return [self._by_class.setdefault(class_id, set())
+                    for class_id in watch.class_ids]
+        if watch.dn_prefix is not None:
+            node = self._trie
+            for rn in watch.dn_prefix.rns:
+                if rn not in node:
+                    if not create:
+                        return []
+                    node[rn] = {}
+                node = node[rn]
+            return [node.setdefault(None, set())]
+        return [self._all]
+
+    def _candidates(self, obj):
+        with self._lock:
+            res = set(self._all)
+            res.update(self._by_class.get(obj.ucs_class, ()))
+            node = self._trie
+            for rn in Dn(obj.attributes.get('dn', '')).rns:
+                node = node.get(rn)
+                if node is None:
+                    break
+                res.update(node.get(None, ()))
+            return res
+
+    def dispatch(self, event_id, obj):
+        for watch in self._candidates(obj):
+            try:
+                if watch.active and watch.matches(obj):
+                    watch.callback(event_id, obj.copy())
+            except Exception:
+                LOG.exception('Exception in watch callback')
+
+    def _notify(self, hook):
+        """Calls on_subscribe or on_lost hooks of watchers."""
+        with self._lock:
+            watches = list(self._watches)
+        for watch in watches:
+            handler = getattr(watch, hook)
+            try:
+                if watch.active and handler is not None:
+                    handler()
+            except Exception:
+                LOG.exception('Exception in watch %s hook', hook)
+
+    def stop(self):
+        self.stopped = True
+        self._stop.set()
+        conn = self._conn
+        if conn is not None:
+            _abort_connection(conn)
+
+    def _run(self):
+        while not self._stop.is_set():
+            endpoint = self.connection.endpoint
+            try:
+                for root_xml, conn in self.connection._iter_xml_events(
+                        subscribed=lambda: self._notify('on_subscribe')):
+                    self._conn = conn
+                    if self._stop.is_set():
+                        _abort_connection(conn)
+                        return
+                    for event_id, obj in \
+                            self.connection._get_events_from_xml(root_xml):
+                        self.dispatch(event_id, obj)
+            except Exception, e:
+                if self._stop.is_set():
+                    return
+                LOG.warning('Event subscription failed: %s', e)
+                delay = self.retry_delay
+                if _is_endpoint_failure(e) and \
+                        self.connection._failover(endpoint):
+                    delay = 0
+            else:
+                if self._stop.is_set():
+                    return
+                LOG.warning('Event subscription closed by server')
+                delay = self.retry_delay
+            self._notify('on_lost')
+            self._stop.wait(delay)
+
+
+_READ_METHODS = frozenset(['configResolveClass', 'configResolveClasses',
+                           'configResolveDn', 'configResolveDns',
+                           'configResolveChildren', 'configResolveParent',
+                           'configFindDnsByClassId', 'configScope',
+                           'orgResolveElements', 'faultResolveFault'])
+
+
+class _Flight(object):
+    """Request in progress, shared by callers of identical queries."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.reply_size = None
+        self.error = None
+
+
+class _ReplyBody(object):
+    """Decodes reply body as it arrives, moving it to temporary file once it
+grows over spill threshold."""
+
+    def __init__(self, encoding, spill_threshold):
+        encoding = (encoding or '').strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decoder = zlib.decompressobj()
+        elif encoding in ('', 'identity'):
+            self._decoder = None
+        else:
+            raise UcsmFatalError('Unsupported reply encoding: %s' % encoding)
+        self._threshold = spill_threshold
+        self._chunks = []
+        self._file = None
+        self.size = 0
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def write(self, data):
+        if self._decoder is not None:
+            data = self._decoder.decompress(data)
+        self._append(data)
+
+    def finish(self):
+        if self._decoder is not None:
+            self._append(self._decoder.flush())
+            self._decoder = None
+
+    def _append(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._chunks.append(data)
+        if self._threshold is not None and self.size > self._threshold:
+            self._file = tempfile.TemporaryFile(prefix='pyucsm-')
+            self._file.writelines(self._chunks)
+            self._chunks = []
+
+    def data(self):
+        # joined once, so logging and parsing share the same string
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    def read(self):
+        if self._file is None:
+            return self.data()
+        self._file.seek(0)
+        return self._file.read()
+
+    def parse(self):
+        if self._file is None:
+            return minidom.parseString(self.data())
+        self._file.flush()
+        buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return minidom.parse(buf)
+        finally:
+            buf.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._chunks = []
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return value
+
+
+def _compact_xml(data):
+    """Parses reply into tree of (tag, attributes, children) tuples, which is
+cheap to pickle. Runs in parse pool processes."""
+    def compact(element):
+        return (_utf8(element.tag),
+                dict((_utf8(name), _utf8(value))
+                     for name, value in element.attrib.iteritems()),
+                [compact(child) for child in element])
+    return compact(ElementTree.fromstring(data))
+
+
+class _CompactReply(object):
+    """Reply parsed by parse pool, UcsmObjects are built from it on demand."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def check_error(self):
+        attributes = self.root[1]
+        if 'errorCode' in attributes:
+            raise UcsmResponseError(int(attributes['errorCode']),
+                                    attributes.get('errorDescr', ''))
+
+    def objects(self, section, index=None, lazy=False):
+        """Returns list of objects of section. With lazy and no index they
+are built on first access to each of them, in read-only sequence."""
+        self.check_error()
+        for tag, attributes, children in self.root[2]:
+            if tag == section:
+                if lazy and index is None:
+                    return _CompactObjects(children)
+                return [_object_from_compact(child, None, index)
+                        for child in children]
+        raise UcsmFatalError('No %s section in server response!' % section)
+
+
+class _CompactObjects(collections.Sequence):
+    """Read-only list of UcsmObjects building each of them from compact node
+when it is first accessed."""
+
+    def __init__(self, nodes):
+        self._nodes = list(nodes)
+        self._objects = [None] * len(self._nodes)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        obj = self._objects[i]
+        if obj is None:
+            with self._lock:
+                obj = self._objects[i]
+                if obj is None:
+                    obj = _object_from_compact(self._nodes[i])
+                    self._objects[i] = obj
+                    self._nodes[i] = None
+        return obj
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, _CompactObjects)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def _parse_endpoint(endpoint, default_port):
+    if isinstance(endpoint, basestring):
+        host, colon, port = endpoint.partition(':')
+        return host, port and int(port) or default_port
+    return tuple(endpoint)
+
+
+def _is_endpoint_failure(error):
+    """Tells if error means that endpoint is down. Timeouts are left to
+health probing, as they can be caused by short deadlines."""
+    return isinstance(error, UcsmFatalError) and \
+        not isinstance(error, UcsmTimeoutError)
+
+
+def _abort_connection(conn):
+    """Closes connection, waking up thread blocked on reading from it."""
+    sock = getattr(conn, 'event_socket', None) or conn.sock
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+    conn.close()
+
 
 class UcsmConnection(object):
     __ENDPOINT = '/nuova'
@@ -151,28 +944,88 @@ class UcsmConnection(object):
         self.version = None
         self.session_id = None
         self.secure = secure
+        # UcsmEventJournal or other object with append(frame, xml) method
+        # receiving all event frames
+        self.journal = kwargs.pop('journal', None)
+        self.__watch_lock = threading.Lock()
+        self.__watch_dispatcher = None
+        # concurrent identical read queries share one request
+        self.singleflight = kwargs.pop('singleflight', True)
+        self.__flights_lock = threading.Lock()
+        self.__flights = {}
+        # per-thread reply size and request priority
+        self._thread_state = threading.local()
+        # UcsmScheduler, may be shared by connections to one domain
+        self.scheduler = kwargs.pop('scheduler', None)
+        # seconds given to every call, see deadline()
+        self.call_timeout = kwargs.pop('call_timeout', None)
+        self.retry_policy = kwargs.pop('retry_policy', UcsmRetryPolicy())
+        # ask for gzip or deflate replies
+        self.compression = kwargs.pop('compression', True)
+        # replies bigger than this are kept in temporary file, None for never
+        self.spill_threshold = kwargs.pop('spill_threshold', 32 * 1024 * 1024)
+        # multiprocessing.Pool parsing replies of resolve_class,
+        # resolve_classes and resolve_children bigger than threshold
+        self.parse_pool = kwargs.pop('parse_pool', None)
+        self.parse_pool_threshold = kwargs.pop('parse_pool_threshold',
+                                               1024 * 1024)
+        # objects of pool parsed replies are built on first access, these
+        # replies are returned as read-only sequence instead of list
+        self.lazy_objects = kwargs.pop('lazy_objects', False)
+        # other management addresses of the same domain, like FI-A and FI-B
+        # next to cluster address, used when current one fails
+        self.endpoints = [(self.host, self.port)] + [
+            _parse_endpoint(endpoint, self.port)
+            for endpoint in kwargs.pop('endpoints', ())]
+        self.endpoint_health = dict.fromkeys(self.endpoints, True)
+        self.probe_interval = kwargs.pop('probe_interval', 10)
+        self.__failover_lock = threading.Lock()
+        self.__failover = None
+        self.__prober_stop = None
         if secure:
-            self._create_connection = lambda:\
-            httplib.HTTPSConnection(self.host, self.port, *args, **kwargs)
+            self._connect = lambda host, port:\
+            httplib.HTTPSConnection(host, port, *args, **kwargs)
         else:
-            self._create_connection = lambda:\
-            httplib.HTTPConnection(self.host, self.port, *args, **kwargs)
+            self._connect = lambda host, port:\
+            httplib.HTTPConnection(host, port, *args, **kwargs)
+        self._create_connection = lambda: self._connect(self.host, self.port)
 
     @decorator
     def _syncronized_request(f, self, *args, **kwargs):
+        with self.deadline(self.call_timeout):
+            scheduler = self.scheduler
+            if scheduler is not None:
+                scheduler.acquire(self.current_priority,
+                                  self.current_deadline)
+            try:
+                return self._run_request(f, self, *args, **kwargs)
+            finally:
+                if scheduler is not None:
+                    scheduler.release()
+
+    def _run_request(self, f, *args, **kwargs):
         try:
             try:
                 LOG.debug('Critical section for wait_refresh')
                 self.__wait_refresh_cond.acquire()
                 if self.refreshing:
                     LOG.debug('Waiting for refresh to end')
-                    self.__wait_refresh_cond.wait(self.refresh_period)
+                    limit = time.time() + self.refresh_period
+                    deadline = self.current_deadline
+                    if deadline is not None:
+                        limit = min(limit, deadline)
+                    while self.refreshing:
+                        remaining = limit - time.time()
+                        if remaining <= 0:
+                            raise UcsmTimeoutError(
+                                'Timed out waiting for session refresh')
+                        self.__wait_refresh_cond.wait(remaining)
                     LOG.debug('Ended waiting for refresh')
                 self.concurrent_requests += 1
             finally:
                 self.__wait_refresh_cond.release()
                 LOG.debug('End critical section for wait_refresh')
-            return f(self, *args, **kwargs)
+            return f(*args, **kwargs)
         finally:
             LOG.debug('Critical section for stop_cond')
             self.__wait_stop_cond.acquire()
@@ -185,6 +1038,82 @@ class UcsmConnection(object):
             self.__wait_stop_cond.release()
             LOG.debug('End critical section for stop_cond')
 
+    @property
+    def current_priority(self):
+        """Priority of requests of current thread for scheduler."""
+        return getattr(self._thread_state, 'priority',
+                       UcsmScheduler.INTERACTIVE)
+
+    @property
+    def current_deadline(self):
+        """Time when requests of current thread must be completed, or None."""
+        return getattr(self._thread_state, 'deadline', None)
+
+    @contextlib.contextmanager
+    def deadline(self, timeout=None, token=None):
+        """Context manager limiting time of requests made in current thread
+to timeout seconds, including connecting, sending and reading reply, and
+making them cancellable with token. Nested deadline can only shorten outer
+one."""
+        state = self._thread_state
+        previous = self.current_deadline, getattr(state, 'token', None)
+        if timeout is not None:
+            deadline = time.time() + timeout
+            if previous[0] is not None:
+                deadline = min(deadline, previous[0])
+            state.deadline = deadline
+        if token is not None:
+            state.token = token
+        try:
+            yield
+        finally:
+            state.deadline, state.token = previous
+
+    def _remaining(self):
+        """Returns seconds left to deadline or None, raises if it passed or
+request was cancelled."""
+        token = getattr(self._thread_state, 'token', None)
+        if token is not None:
+            token.check()
+        deadline = self.current_deadline
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise UcsmTimeoutError('Request deadline has passed')
+        return remaining
+
+    @contextlib.contextmanager
+    def priority(self, priority):
+        """Context manager setting priority of requests made in current
+thread, one of UcsmScheduler.PRIORITIES."""
+        if priority not in UcsmScheduler.PRIORITIES:
+            raise UcsmError('Unknown priority: %s' % priority)
+        previous = self.current_priority
+        self._thread_state.priority = priority
+        try:
+            yield
+        finally:
+            self._thread_state.priority = previous
+
+    def _bind(self, func):
+        """Returns wrapper of func running it with priority, deadline and
+cancellation token of current thread, for calls made from worker threads."""
+        priority = self.current_priority
+        deadline = self.current_deadline
+        token = getattr(self._thread_state, 'token', None)
+
+        def call(*args, **kwargs):
+            state = self._thread_state
+            previous = self.current_deadline, getattr(state, 'token', None)
+            state.deadline, state.token = deadline, token
+            try:
+                with self.priority(priority):
+                    return func(*args, **kwargs)
+            finally:
+                state.deadline, state.token = previous
+        return call
+
     def refresh(self):
         """Performs authorisation and retrieving cookie from server.
 Cookie refresh will be performed automatically."""
@@ -219,9 +1148,10 @@ Cookie refresh will be performed automatically."""
             self.__wait_refresh_cond.release()
             LOG.debug('End critical section for refresh')
 
-    def login(self, login, password, cookie_timeout=60 * 10):
+    def login(self, login, password, cookie_timeout=60 * 10,
+              autorefresh=True):
         """Performs authorisation and retrieving cookie from server.
-Cookie refresh will be performed automatically."""
+Cookie refresh will be performed automatically unless autorefresh is False."""
         self.__cookie = None
         self.__login = None
         self.__password = None
@@ -238,7 +1168,9 @@ Cookie refresh will be performed automatically."""
             self.__login = login
             self.__password = password
             self.cookie_timeout = cookie_timeout
-            self._start_autorefresh()
+            if autorefresh:
+                self._start_autorefresh()
+            self._start_probing()
             return self.__cookie
         except KeyError:
             raise UcsmFatalError("Wrong reply syntax.")
@@ -257,6 +1189,9 @@ Cookie refresh will be performed automatically."""
         try:
             if self.__refresh_timer:
                 self.__refresh_timer.cancel()
+            if self.__prober_stop is not None:
+                self.__prober_stop.set()
+                self.__prober_stop = None
             cookie = self.__cookie
             reply_xml, conn = self._perform_query('aaaLogout', inCookie=cookie)
             self._check_is_error(reply_xml.firstChild)
@@ -279,13 +1214,111 @@ Cookie refresh will be performed automatically."""
     def is_logged_in(self):
         return self.__cookie is not None
 
+    @property
+    def endpoint(self):
+        """Address of management endpoint currently used."""
+        return self.host, self.port
+
+    def _failover(self, failed):
+        """Switches to next endpoint, preferring healthy ones, after request
+to failed one has failed, and logs in there again. Concurrent callers wait
+for one switch. Returns False if no endpoint accepted login."""
+        if len(self.endpoints) < 2:
+            return False
+        with self.__failover_lock:
+            if self.endpoint != failed:
+                # other thread has already switched
+                return True
+            flight = self.__failover
+            leader = flight is None
+            if leader:
+                flight = self.__failover = _Flight()
+        if not leader:
+            flight.done.wait(self._remaining())
+            return bool(flight.result)
+        try:
+            flight.result = self._switch_endpoint(failed)
+            return flight.result
+        finally:
+            with self.__failover_lock:
+                self.__failover = None
+            flight.done.set()
+
+    def _switch_endpoint(self, failed):
+        self.endpoint_health[failed] = False
+        endpoint = self._candidates(failed)[0]
+        LOG.warning('Failing over from %s:%s to %s:%s', *(failed + endpoint))
+        self.host, self.port = endpoint
+        login, password = self.__login, self.__password
+        if login is None:
+            return True
+        autorefresh = self.__refresh_timer is not None
+        if autorefresh:
+            self.__refresh_timer.cancel()
+        try:
+            # tries other endpoints if this one fails too
+            self.login(login, password, self.cookie_timeout,
+                       autorefresh=autorefresh)
+            return True
+        except UcsmError, e:
+            LOG.warning('Failover from %s:%s failed: %s', *(failed + (e,)))
+            self.__login, self.__password = login, password
+            self.host, self.port = failed
+            return False
+
+    def _candidates(self, endpoint):
+        """Returns other endpoints in order after given one, healthy first."""
+        start = self.endpoints.index(endpoint)
+        candidates = self.endpoints[start + 1:] + self.endpoints[:start]
+        candidates.sort(key=lambda e: not self.endpoint_health[e])
+        return candidates
+
+    def _start_probing(self):
+        if len(self.endpoints) < 2 or not self.probe_interval \
+                or self.__prober_stop is not None:
+            return
+        stop = self.__prober_stop = threading.Event()
+
+        def run():
+            while not stop.wait(self.probe_interval):
+                self._probe_endpoints()
+        prober = threading.Thread(target=run, name='pyucsm-probe-%s' %
+                                                   self.host)
+        prober.daemon = True
+        prober.start()
+
+    def _probe_endpoints(self):
+        """Checks all endpoints, failing over if current one is down."""
+        for endpoint in self.endpoints:
+            self.endpoint_health[endpoint] = self._probe(endpoint)
+        current = self.endpoint
+        if not self.endpoint_health[current] and \
+                any(self.endpoint_health.itervalues()):
+            self._failover(current)
+
+    def _probe(self, endpoint):
+        conn = self._connect(*endpoint)
+        conn.timeout = min(5, self.probe_interval or 5)
+        try:
+            conn.request("POST", self.__ENDPOINT, '<aaaKeepAlive cookie=""/>')
+            minidom.parseString(conn.getresponse().read())
+            return True
+        except Exception:
+            return False
+        finally:
+            conn.close()
 
-    def _get_single_object_from_response(self, data):
+    @property
+    def cookie(self):
+        return self.__cookie
+
+
+    def _get_single_object_from_response(self, data, index=None):
         try:
             out_config = data.getElementsByTagName('outConfig')[0]
             xml_childs = [child for child in out_config.childNodes
                           if child.nodeType == dom.Node.ELEMENT_NODE]
-            childs = map(lambda c: UcsmObject(c), xml_childs)
+            childs = map(lambda c: UcsmObject(c, index=index), xml_childs)
             if len(childs):
                 return childs[0]
             else:
@@ -293,10 +1326,17 @@ Cookie refresh will be performed automatically."""
         except (KeyError, IndexError):
             raise UcsmFatalError('No outConfig section in server response!')
 
-    def _get_objects_from_response(self, data):
+    def _get_objects_from_reply(self, data, index=None):
+        """Returns objects of outConfigs section of DOM or compact reply."""
+        if isinstance(data, _CompactReply):
+            return data.objects('outConfigs', index, self.lazy_objects)
+        self._check_is_error(data.firstChild)
+        return self._get_objects_from_response(data, index)
+
+    def _get_objects_from_response(self, data, index=None):
         try:
             out_config = data.getElementsByTagName('outConfigs')[0]
-            return self._get_child_nodes_as_children(out_config)
+            return self._get_child_nodes_as_children(out_config, index)
         except (KeyError, IndexError):
             raise UcsmFatalError('No outConfig section in server response!')
 
@@ -318,10 +1358,10 @@ Cookie refresh will be performed automatically."""
             raise UcsmFatalError('Wrong reply: recieved pair'
                                  'does not have key')
 
-    def _get_child_nodes_as_children(self, root):
+    def _get_child_nodes_as_children(self, root, index=None):
         xml_childs = [child for child in root.childNodes\
                       if child.nodeType == dom.Node.ELEMENT_NODE]
-        return map(lambda c: UcsmObject(c), xml_childs)
+        return map(lambda c: UcsmObject(c, index=index), xml_childs)
 
     def _get_unresolved_from_response(self, data):
         try:
@@ -329,16 +1369,16 @@ Cookie refresh will be performed automatically."""
             xml_childs = [child for child in out_config.childNodes
                           if child.nodeType == dom.Node.ELEMENT_NODE
             and child.nodeName == 'dn']
-            return map(lambda c: c.attributes['value'].value.encode('utf8'),
-                       xml_childs)
+            return map(lambda c: Dn(c.attributes['value'].value), xml_childs)
         except (KeyError, IndentationError):
             raise UcsmFatalError('No outUnresolved section'
                                  'in server response!')
 
     @_syncronized_request
     def resolve_children(self, class_id='', dn='', hierarchy=False,
-                         filter=UcsmFilterOp()):
-        """Returns list of objects.
+                         filter=UcsmFilterOp(), index=None):
+        """Returns list of objects. If index is given, objects are also added
+to this UcsmIndex.
         """
         kwargs = {}
         if class_id:
@@ -349,9 +1389,9 @@ Cookie refresh will be performed automatically."""
                                          inDn=dn,
                                          inHierarchical=hierarchy and "yes"
                                          or "no",
+                                         compact=True,
                                          **kwargs)
-        self._check_is_error(data.firstChild)
-        return self._get_objects_from_response(data)
+        return self._get_objects_from_reply(data, index)
 
     # TODO: unexpected behavior with recursive option
     @_syncronized_request
@@ -370,18 +1410,144 @@ Cookie refresh will be performed automatically."""
         return self._get_objects_from_response(data)
 
     @_syncronized_request
-    def resolve_class(self, class_id, filter=UcsmFilterOp(), hierarchy=False):
+    def _forward_query(self, query):
+        """Sends query XML node made by other client with session of this
+connection. Returns reply DOM, errors are left in it."""
+        attributes = dict((_utf8(name), _utf8(value))
+                          for name, value in query.attributes.items()
+                          if name != 'cookie')
+        children = [child for child in query.childNodes
+                    if child.nodeType == dom.Node.ELEMENT_NODE]
+        data, conn = self._perform_query(query.tagName, data=children,
+                                         cookie=self.__cookie, **attributes)
+        return data
+
+    @_syncronized_request
+    def resolve_class(self, class_id, filter=UcsmFilterOp(), hierarchy=False,
+                      index=None):
         data, conn = self._perform_query('configResolveClass',
                                          filter=filter,
                                          cookie=self.__cookie,
                                          classId=class_id,
                                          inHierarchical=hierarchy and "yes"
-                                         or "no")
+                                         or "no",
+                                         compact=True)
+        return self._get_objects_from_reply(data, index)
+
+    @_syncronized_request
+    def resolve_class_values(self, class_id, attributes,
+                             filter=UcsmFilterOp()):
+        """Returns list of pairs of dn and list of given attributes values for
+objects of class. Values are read straight from reply, without creating
+UcsmObjects, missing attributes are None."""
+        data, conn = self._perform_query('configResolveClass',
+                                         filter=filter,
+                                         cookie=self.__cookie,
+                                         classId=class_id,
+                                         inHierarchical="no")
         self._check_is_error(data.firstChild)
-        return self._get_objects_from_response(data)
+        try:
+            out_config = data.getElementsByTagName('outConfigs')[0]
+        except IndexError:
+            raise UcsmFatalError('No outConfig section in server response!')
+        res = []
+        for node in out_config.childNodes:
+            if node.nodeType != dom.Node.ELEMENT_NODE:
+                continue
+            node_attributes = node.attributes
+            values = []
+            for name in attributes:
+                attr = node_attributes.get(name)
+                values.append(attr.value if attr is not None else None)
+            res.append((node.getAttribute('dn'), values))
+        return res
+
+    def iter_class_partitioned(self, class_id, filter=UcsmFilterOp(),
+                               strategy='dns', partitions=None,
+                               chunk_size=500, max_bytes=None, parallelism=4,
+                               id_attribute='id'):
+        """Resolves objects of class with several smaller requests, running
+parallelism of them at once and yielding objects in order of partitions.
+Strategies:
+'dns' - dns found with find_dns_by_class_id are resolved by chunks of
+chunk_size;
+'scope' - partitions is list of dn prefixes, objects at and under each of
+them are resolved with dn filter;
+'range' - partitions is (low, high) range of numeric id_attribute values, it is
+split to subranges of chunk_size values.
+With max_bytes chunk size is adapted after every reply, so that replies fit
+into this budget."""
+        if strategy in ('scope', 'range') and partitions is None:
+            raise UcsmError('Partitions are required for %s strategy.' %
+                            strategy)
+        size = _PartitionSize(chunk_size, max_bytes)
+        has_filter = type(filter) is not UcsmFilterOp
+
+        def restrict(extra):
+            if has_filter:
+                return UcsmComposeFilter(UcsmComposeFilter.AND, extra, filter)
+            return extra
+
+        if strategy == 'dns':
+            dns = self.find_dns_by_class_id(class_id,
+                                            filter=has_filter and filter
+                                            or None)
+
+            def chunks():
+                start = 0
+                while start < len(dns):
+                    end = start + size.size
+                    yield dns[start:end]
+                    start = end
+
+            def fetch(chunk):
+                resolved, unresolved = self.resolve_dns(chunk)
+                size.observe(len(chunk), self.last_reply_size)
+                return resolved
+        elif strategy == 'scope':
+            dn = UcsmAttribute(class_id, 'dn')
+            chunks = lambda: iter(partitions)
+
+            def fetch(prefix):
+                pattern = '^%s(/|$)' % _regex_escape(prefix)
+                res = self.resolve_class(class_id, filter=restrict(
+                    dn.wildcard_match(pattern)))
+                size.observe(None, self.last_reply_size)
+                return res
+        elif strategy == 'range':
+            try:
+                low, high = partitions
+            except (TypeError, ValueError):
+                raise UcsmError('Range partitions must be (low, high) pair.')
+            attribute = UcsmAttribute(class_id, id_attribute)
+
+            def chunks():
+                start = low
+                while start < high:
+                    end = min(high, start + size.size)
+                    yield start, end
+                    start = end
+
+            def fetch(bounds):
+                start, end = bounds
+                res = self.resolve_class(class_id, filter=restrict(
+                    (attribute >= start) & (attribute < end)))
+                size.observe(end - start, self.last_reply_size)
+                return res
+        else:
+            raise UcsmError('Unknown partitioning strategy: %s' % strategy)
+        for objects in _iter_in_threads(self._bind(fetch), chunks(),
+                                        parallelism):
+            for obj in objects:
+                yield obj
+
+    @property
+    def last_reply_size(self):
+        """Size in bytes of last reply received by current thread."""
+        return getattr(self._thread_state, 'reply_size', None)
 
     @_syncronized_request
-    def resolve_classes(self, classes, hierarchy=False):
+    def resolve_classes(self, classes, hierarchy=False, index=None):
         classes_node = minidom.Element('inIds')
         for cls in classes:
             childnode = minidom.Element('id')
@@ -392,32 +1558,32 @@ Cookie refresh will be performed automatically."""
                                                  cookie=self.__cookie,
                                                  inHierarchical=hierarchy
                                                                 and "yes"
-                                                 or "no")
-        self._check_is_error(data.firstChild)
-        return self._get_objects_from_response(data)
+                                                 or "no",
+                                                 compact=True)
+        return self._get_objects_from_reply(data, index)
 
     @_syncronized_request
-    def resolve_dn(self, dn, hierarchy=False):
+    def resolve_dn(self, dn, hierarchy=False, index=None):
         data, conn = self._perform_query('configResolveDn',
                                          cookie=self.__cookie,
                                          dn=dn,
                                          inHierarchical=hierarchy and "yes"
                                                                   or "no")
         self._check_is_error(data.firstChild)
-        res = self._get_single_object_from_response(data)
+        res = self._get_single_object_from_response(data, index)
         if res:
             return res
         else:
             return None
 
     @_syncronized_request
-    def resolve_dns(self, dns, hierarchy=False):
+    def resolve_dns(self, dns, hierarchy=False, index=None):
         """Returns tuple contains list of resolved objects and list
 of unresolved dns."""
         dns_node = minidom.Element('inDns')
         for dn in dns:
             childnode = minidom.Element('dn')
-            childnode.setAttribute('value', dn)
+            childnode.setAttribute('value', Dn(dn))
             dns_node.appendChild(childnode)
         data, conn = self._perform_query('configResolveDns',
                                                  data=dns_node,
@@ -426,7 +1592,7 @@ of unresolved dns."""
                                                                 and "yes"
                                                                 or "no")
         self._check_is_error(data.firstChild)
-        resolved = self._get_objects_from_response(data)
+        resolved = self._get_objects_from_response(data, index)
         unresolved = self._get_unresolved_from_response(data)
         return resolved, unresolved
 
@@ -439,7 +1605,7 @@ of unresolved dns."""
         self._check_is_error(data.firstChild)
         try:
             out_dns_node = data.getElementsByTagName('outDns')[0]
-            dns = [child.attributes['value'].value.encode('utf8') for child in
+            dns = [Dn(child.attributes['value'].value) for child in
                    out_dns_node.childNodes
                    if child.nodeType == dom.Node.ELEMENT_NODE]
             return dns
@@ -482,10 +1648,10 @@ of unresolved dns."""
             conf.dn = dn
         elif root is not None:
             if rn is not None:
-                conf.dn = os.path.join(root, rn)
+                conf.dn = Dn(root).child(rn)
                 conf.rn = rn
             elif 'rn' in conf.attributes:
-                conf.dn = os.path.join(root, conf.rn)
+                conf.dn = Dn(root).child(conf.rn)
         return self._conf_mo_status(conf, 'created', hierarchy=hierarchy)
 
     def delete_object(self, conf):
@@ -497,6 +1663,18 @@ of unresolved dns."""
     def update_object(self, conf, hierarchy=False):
         return self._conf_mo_status(conf, 'modified', hierarchy=hierarchy)
 
+    def reconcile(self, desired, current=None, delete_missing=False):
+        """Brings object tree on server to desired state sending only changed
+attributes. Current state is resolved from server hierarchically if not given.
+See diff_objects for details. Returns dictionary of dn:changed_config."""
+        if current is None:
+            current = self.resolve_dn(desired.dn, hierarchy=True)
+        changes = diff_objects(desired, current, delete_missing)
+        if not changes:
+            return {}
+        return self.conf_mos([(conf.dn, conf) for conf in changes],
+                             hierarchy=True)
+
     @_syncronized_request
     def conf_mo(self, config, dn="", hierarchy=False):
         """Modifies or creates config. Special config object attribute 'status'
@@ -536,6 +1714,85 @@ Possible values: ('created', 'deleted', 'modified')."""
         self._check_is_error(data.firstChild)
         return self._get_pairs_from_response(data)
 
+    def conf_mos_bulk(self, configs, hierarchy=False, batch_size=100,
+                      batch_bytes=256 * 1024, parallelism=4,
+                      isolate_failures=False):
+        """Applies lots of configs using several configConfMos requests.
+Configs are ordered parents first by dn and packed to batches of at most
+batch_size objects and batch_bytes bytes of XML. Batches of the same tree level
+are independent and are sent in parallel by at most parallelism threads.
+Children of failed configs are not sent. If isolate_failures is set, configs
+of failed batch are resent one by one to find out which of them failed.
+Returns UcsmBulkResult."""
+        if isinstance(configs, dict):
+            configs = configs.values()
+        by_dn = {}
+        for conf in configs:
+            if 'dn' not in conf.attributes:
+                raise UcsmError('Config %r has no dn.' % conf)
+            by_dn[Dn(conf.dn)] = conf
+
+        levels = {}
+        ancestors = {}
+        for dn in by_dn:
+            parents = [p for p in Dn(dn).ancestors() if p in by_dn]
+            ancestors[dn] = parents
+            levels.setdefault(len(parents), []).append(dn)
+
+        result = UcsmBulkResult()
+
+        def send(batch):
+            try:
+                return self.conf_mos([(dn, by_dn[dn]) for dn, _ in batch],
+                                     hierarchy), {}
+            except UcsmError, e:
+                if not isolate_failures or len(batch) == 1:
+                    return {}, dict((dn, e) for dn, _ in batch)
+            changed, failed = {}, {}
+            for dn, _ in batch:
+                try:
+                    changed.update(self.conf_mos([(dn, by_dn[dn])],
+                                                 hierarchy))
+                except UcsmError, e:
+                    failed[dn] = e
+            return changed, failed
+
+        for level in sorted(levels):
+            batches = []
+            batch = []
+            size = 0
+            for dn in sorted(levels[level]):
+                failed_parents = [p for p in ancestors[dn]
+                                  if p in result.failed]
+                if failed_parents:
+                    result.failed[dn] = UcsmError('Parent config %s failed.'
+                                                  % failed_parents[0])
+                    continue
+                conf_size = len(by_dn[dn].xml(hierarchy))
+                if batch and (len(batch) >= batch_size
+                              or size + conf_size > batch_bytes):
+                    batches.append(batch)
+                    batch = []
+                    size = 0
+                batch.append((dn, conf_size))
+                size += conf_size
+            if batch:
+                batches.append(batch)
+            LOG.debug('Bulk level %d: %d configs in %d batches', level,
+                      len(levels[level]), len(batches))
+            for batch, (res, exc) in zip(batches,
+                                         _run_in_threads(self._bind(send),
+                                                         batches,
+                                                         parallelism)):
+                if exc is not None:
+                    for dn, _ in batch:
+                        result.failed[dn] = exc
+                else:
+                    changed, failed = res
+                    result.changed.update(changed)
+                    result.failed.update(failed)
+        return result
+
     @_syncronized_request
     def estimate_impact(self, configs):
         """Calculates impact of changing config on server.
@@ -573,7 +1830,7 @@ configs."""
         dns_xml = minidom.Element('inDns')
         for dn in dns:
             dn_xml = minidom.Element('dn')
-            dn_xml.setAttribute('value', dn)
+            dn_xml.setAttribute('value', Dn(dn))
             dns_xml.appendChild(dn_xml)
         data, conn = self._perform_query('configConfMoGroup',
                                                  cookie=self.__cookie,
@@ -584,6 +1841,47 @@ configs."""
         self._check_is_error(data.firstChild)
         return self._get_objects_from_response(data)
 
+    @_syncronized_request
+    def ack_fault(self, fault_id):
+        """Acknowledges fault by its id. Returns fault object if server
+sends it."""
+        data, conn = self._perform_query('faultAckFault',
+                                         cookie=self.__cookie,
+                                         inId=fault_id,
+                                         inHierarchical="no")
+        self._check_is_error(data.firstChild)
+        return self._get_fault_from_response(data)
+
+    @_syncronized_request
+    def ack_faults(self, fault_ids):
+        """Acknowledges several faults by their ids in one request."""
+        ids_xml = minidom.Element('inIds')
+        for fault_id in fault_ids:
+            id_xml = minidom.Element('id')
+            id_xml.setAttribute('value', str(fault_id))
+            ids_xml.appendChild(id_xml)
+        data, conn = self._perform_query('faultAckFaults',
+                                         cookie=self.__cookie,
+                                         data=ids_xml)
+        self._check_is_error(data.firstChild)
+
+    @_syncronized_request
+    def resolve_fault(self, fault_id):
+        """Returns fault object by its id or None."""
+        data, conn = self._perform_query('faultResolveFault',
+                                         cookie=self.__cookie,
+                                         inId=fault_id)
+        self._check_is_error(data.firstChild)
+        return self._get_fault_from_response(data)
+
+    def _get_fault_from_response(self, data):
+        out_fault = data.getElementsByTagName('outFault')
+        if out_fault:
+            faults = self._get_child_nodes_as_children(out_fault[0])
+            if faults:
+                return faults[0]
+        return None
+
     @_syncronized_request
     def clone_profile(self, dn, name, target_org_dn='org-root',
                       hierarchy=True):
@@ -694,35 +1992,69 @@ configs."""
         """Starts listen events, iterating through them.
 Yields event id and configuraion."""
         for root_xml, conn in self._iter_xml_events(filter):
-            for event_xml in root_xml.getElementsByTagName(
-                'configMoChangeEvent'):
-                event_id = int(event_xml.getAttribute('inEid'))
-                configs = event_xml.getElementsByTagName('inConfig')
-                if configs:
-                    xml_childs = [child for child in configs[0].childNodes if
-                                  child.nodeType == dom.Node.ELEMENT_NODE]
-                    childs = map(lambda c: UcsmObject(c), xml_childs)
-                    for child in childs:
-                        yield event_id, child
-
-    def _iter_xml_events(self, filter=UcsmFilterOp()):
+            for event in self._get_events_from_xml(root_xml):
+                yield event
+
+    def _get_events_from_xml(self, root_xml):
+        for event_xml in root_xml.getElementsByTagName(
+            'configMoChangeEvent'):
+            event_id = int(event_xml.getAttribute('inEid'))
+            configs = event_xml.getElementsByTagName('inConfig')
+            if configs:
+                xml_childs = [child for child in configs[0].childNodes if
+                              child.nodeType == dom.Node.ELEMENT_NODE]
+                childs = map(lambda c: UcsmObject(c), xml_childs)
+                for child in childs:
+                    yield event_id, child
+
+    def watch(self, class_ids=None, dn_prefix=None, filter=None,
+              callback=None, on_subscribe=None, on_lost=None):
+        """Registers callback(event_id, config) for events of given classes,
+in subtree of dn_prefix and matching filter, which is UcsmFilterOp or
+predicate. All watchers of connection share one event subscription, which is
+started with first watcher and stopped when last one is cancelled. Callbacks
+are called from subscription thread. on_subscribe() is called every time
+subscription is established, before its first event, on_lost() when it fails
+or is closed, events may be missed until it is established again.
+Returns UcsmWatch."""
+        if callback is None:
+            raise UcsmError('Watch callback is required.')
+        with self.__watch_lock:
+            while True:
+                if self.__watch_dispatcher is None \
+                        or self.__watch_dispatcher.stopped:
+                    self.__watch_dispatcher = _UcsmWatchDispatcher(self)
+                # dispatcher may be stopped by its last watcher meanwhile
+                watch = self.__watch_dispatcher.add(class_ids, dn_prefix,
+                                                    filter, callback,
+                                                    on_subscribe, on_lost)
+                if watch is not None:
+                    return watch
+
+    def _iter_xml_events(self, filter=UcsmFilterOp(), subscribed=None):
         request_data = self._instantiate_query('eventSubscribe',
                            child_data=filter.final_xml_node(),
-                           cookie=self.__cookie).toxml()
+                           cookie=self.__cookie)
         conn = self._create_connection()
         body = request_data
         LOG.debug(">> %s", body)
         try:
             conn.request("POST", self.__ENDPOINT, body)
+            # keep socket to be able to abort stream from other thread
+            conn.event_socket = conn.sock
             reply = conn.getresponse()
+            if subscribed is not None:
+                subscribed()
             while True:
                 reply_data = self._read_event_from_reply(reply)
                 LOG.debug("<<e %s" % reply_data)
                 try:
                     reply_xml = minidom.parseString(reply_data)
-                    yield reply_xml, conn
                 except:
                     raise UcsmFatalError("Error during XML parsing.")
+                if self.journal is not None:
+                    self.journal.append(reply_data, reply_xml)
+                yield reply_xml, conn
         except socket.error, e:
             raise UcsmFatalError('Error during connecting: %s' % e)
         except EOFError:
@@ -745,10 +2077,12 @@ Yields event id and configuraion."""
         else:
             raise UcsmFatalError()
 
-    def _perform_query(self, method, data=None, filter=None, **kwargs):
+    def _perform_query(self, method, data=None, filter=None, compact=False,
+                       **kwargs):
         """Gets query method name and its parameters. Filter must be an
 instance of class, derived from UcsmFilterToken. Data is XML node or iterable
-of XML nodes."""
+of XML nodes. Compact allows big replies to be parsed by parse pool into
+_CompactReply."""
         def _iter(*args):
             for arg in args:
                 if _iterable(arg):
@@ -766,24 +2100,170 @@ of XML nodes."""
                                    'inPassword="<password>"'))
         else:
             LOG.debug(">> %s", body)
-        data, conn = self._submit_request(body)
-        return data, conn
+        if method == 'aaaLogin':
+            endpoints = [self.endpoint] + self._candidates(self.endpoint)
+            for endpoint in endpoints:
+                self.host, self.port = endpoint
+                try:
+                    return self._submit_request(body)
+                except UcsmFatalError, e:
+                    if not _is_endpoint_failure(e) or \
+                            endpoint == endpoints[-1]:
+                        self.host, self.port = endpoints[0]
+                        raise
+                    LOG.warning('Login to %s:%s failed, trying next '
+                                'endpoint: %s', *(endpoint + (e,)))
+                    self.endpoint_health[endpoint] = False
+        if method not in _READ_METHODS:
+            endpoint = self.endpoint
+            try:
+                return self._submit_request(body)
+            except UcsmFatalError, e:
+                if _is_endpoint_failure(e) and method != 'aaaLogout':
+                    self._failover(endpoint)
+                raise
+        if self.singleflight:
+            submit = self._submit_shared_request
+        else:
+            submit = self._submit_request
+        delays = self.retry_policy and self.retry_policy.delays() or iter(())
+        while True:
+            endpoint, cookie = self.endpoint, self.__cookie
+            try:
+                return submit(body, compact=compact)
+            except UcsmFatalError, e:
+                delay = next(delays, None)
+                remaining = self._remaining()
+                if delay is None or \
+                        remaining is not None and remaining <= delay:
+                    raise
+                if _is_endpoint_failure(e) and self._failover(endpoint):
+                    if cookie and self.__cookie != cookie:
+                        body = body.replace('cookie="%s"' % cookie,
+                                            'cookie="%s"' % self.__cookie)
+                    LOG.warning('%s failed, retrying on %s:%s: %s', method,
+                                self.host, self.port, e)
+                    continue
+                LOG.warning('%s failed, retrying in %s seconds: %s', method,
+                            delay, e)
+                time.sleep(delay)
+
+    def _submit_shared_request(self, body, compact=False):
+        """Submits request, or waits for result of identical request which
+is already in progress. Deadline or cancellation of that request does not
+fail waiting callers, they try again."""
+        key = body
+        if self.__cookie:
+            key = body.replace(self.__cookie, '')
+        key = key, compact
+        while True:
+            with self.__flights_lock:
+                flight = self.__flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.__flights[key] = _Flight()
+            if leader:
+                break
+            LOG.debug('Sharing result of identical request')
+            while not flight.done.is_set():
+                timeout = self._remaining()
+                if getattr(self._thread_state, 'token', None) is not None:
+                    # wake up to notice cancellation
+                    timeout = min(timeout or 0.1, 0.1)
+                flight.done.wait(timeout)
+            if isinstance(flight.error, (UcsmCancelledError,
+                                         UcsmTimeoutError)):
+                continue
+            if flight.error is not None:
+                raise flight.error
+            self._thread_state.reply_size = flight.reply_size
+            return flight.result
+        try:
+            flight.result = self._submit_request(body, compact=compact)
+            flight.reply_size = self.last_reply_size
+            return flight.result
+        except Exception, e:
+            flight.error = e
+            raise
+        finally:
+            with self.__flights_lock:
+                del self.__flights[key]
+            flight.done.set()
 
-    def _submit_request(self, request_data, headers=None):
+    def _submit_request(self, request_data, headers=None, compact=False):
+        remaining = self._remaining()
+        token = getattr(self._thread_state, 'token', None)
         conn = self._create_connection()
+        if remaining is not None:
+            conn.timeout = remaining
         body = request_data
+        headers = dict(headers or {})
+        if self.compression:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+        if token is not None:
+            token._register(conn)
+        reply_body = None
         try:
-            conn.request("POST", self.__ENDPOINT, body)
-            reply = conn.getresponse()
-            reply_data = reply.read()
-            LOG.debug("<< %s", reply_data)
-        except socket.error, e:
-            raise UcsmFatalError('Error during connecting: %s' % e)
+            try:
+                conn.request("POST", self.__ENDPOINT, body, headers)
+                # reply keeps reading from socket after connection closes it
+                conn.event_socket = sock = conn.sock
+                reply = conn.getresponse()
+                reply_body = _ReplyBody(reply.getheader('content-encoding'),
+                                        self.spill_threshold)
+                while True:
+                    remaining = self._remaining()
+                    if remaining is not None:
+                        sock.settimeout(remaining)
+                    chunk = reply.read(64 * 1024)
+                    if not chunk:
+                        break
+                    reply_body.write(chunk)
+                reply_body.finish()
+                if token is not None:
+                    token.check()
+                self._thread_state.reply_size = reply_body.size
+                if LOG.isEnabledFor(logging.DEBUG):
+                    if reply_body.spilled:
+                        LOG.debug("<< %d bytes kept on disk", reply_body.size)
+                    else:
+                        LOG.debug("<< %s", reply_body.data())
+            except socket.timeout:
+                raise UcsmTimeoutError('Request deadline has passed')
+            except (socket.error, httplib.HTTPException, zlib.error), e:
+                if token is not None:
+                    token.check()
+                raise UcsmFatalError('Error during connecting: %s' % e)
+            finally:
+                if token is not None:
+                    token._unregister(conn)
+            if compact and self.parse_pool is not None and \
+                    reply_body.size >= self.parse_pool_threshold:
+                reply_xml = self._parse_in_pool(reply_body.read())
+            else:
+                try:
+                    reply_xml = reply_body.parse()
+                except:
+                    raise UcsmFatalError("Error during XML parsing.")
+        finally:
+            if reply_body is not None:
+                reply_body.close()
+        return reply_xml, conn
+
+    def _parse_in_pool(self, data):
+        """Parses reply in parse pool into _CompactReply, waiting within
+deadline and cancellation token of current thread."""
+        result = self.parse_pool.apply_async(_compact_xml, (data,))
+        while not result.ready():
+            timeout = self._remaining()
+            if getattr(self._thread_state, 'token', None) is not None:
+                # wake up to notice cancellation
+                timeout = min(timeout or 0.1, 0.1)
+            result.wait(timeout)
         try:
-            reply_xml = minidom.parseString(reply_data)
+            return _CompactReply(result.get())
         except:
             raise UcsmFatalError("Error during XML parsing.")
-        return reply_xml, conn
 
     def _instantiate_query(self, method, child_data=None, **kwargs):
         """Formats query with some child nodes. Child data can be XML node or
@@ -802,6 +2282,28 @@ iterable of XML nodes."""
         return query.toxml()
 
 
+def collect_classes(connections, class_ids, hierarchy=False, parallelism=8):
+    """Resolves classes on several logged in connections at once. Returns
+dictionary of (connection, class_id):objects and dictionary of
+(connection, class_id):exception for failed queries. Connections sharing one
+parse_pool parse big replies in its processes."""
+    queries = [(connection, class_id) for connection in connections
+               for class_id in class_ids]
+    resolvers = dict((connection, connection._bind(connection.resolve_class))
+                     for connection in connections)
+    results = _run_in_threads(
+        lambda query: resolvers[query[0]](query[1], hierarchy=hierarchy),
+        queries, parallelism)
+    collected = {}
+    failed = {}
+    for query, (objects, error) in zip(queries, results):
+        if error is None:
+            collected[query] = objects
+        else:
+            failed[query] = error
+    return collected, failed
+
+
 class UcsmAttribute(object):
     """Describes class attribute. You can use >, >=, <, <=, ==, != operators
 to create UCSM property filters. Also wildcard matching, all bits and any bits
@@ -903,70 +2405,471 @@ class UcsmComposeFilter(UcsmFilterToken):
         return visitor.visit_compose(self)
 
 
+def _as_dn(value):
+    if isinstance(value, basestring):
+        return Dn(value)
+    return value
+
+
+class _UcsmAttributes(dict):
+    """Attributes dictionary of UcsmObject, notifies owner about changes.
+    """
+
+    def __init__(self, owner, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._owner = owner
+        if 'dn' in self:
+            dict.__setitem__(self, 'dn', _as_dn(self['dn']))
+
+    def _changing(self):
+        self._owner._changing(attributes=True)
+
+    def __setitem__(self, key, value):
+        self._changing()
+        if key == 'dn':
+            value = _as_dn(value)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._changing()
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        self._changing()
+        dict.clear(self)
+
+    def pop(self, *args):
+        self._changing()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._changing()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self._changing()
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        self._changing()
+        dict.update(self, *args, **kwargs)
+        if 'dn' in self:
+            dict.__setitem__(self, 'dn', _as_dn(self['dn']))
+
+
+class _UcsmChildren(list):
+    """Children list of UcsmObject, notifies owner about changes. Appended
+objects without parent become children of owner.
+    """
+
+    def __init__(self, owner, iterable=()):
+        list.__init__(self, iterable)
+        self._owner = owner
+        self._adopt(self)
+
+    def _adopt(self, children):
+        for child in children:
+            if isinstance(child, UcsmObject) and child.parent is None:
+                child.parent = self._owner
+
+    def _changing(self):
+        self._owner._changing(children=True)
+
+    def append(self, child):
+        self._changing()
+        list.append(self, child)
+        self._adopt([child])
+
+    def extend(self, children):
+        children = list(children)
+        self._changing()
+        list.extend(self, children)
+        self._adopt(children)
+
+    def __iadd__(self, children):
+        self.extend(children)
+        return self
+
+    def insert(self, index, child):
+        self._changing()
+        list.insert(self, index, child)
+        self._adopt([child])
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+        self._changing()
+        list.__setitem__(self, index, value)
+        self._adopt(isinstance(index, slice) and value or [value])
+
+    def __setslice__(self, i, j, children):
+        children = list(children)
+        self._changing()
+        list.__setslice__(self, i, j, children)
+        self._adopt(children)
+
+    def __delitem__(self, index):
+        self._changing()
+        list.__delitem__(self, index)
+
+    def __delslice__(self, i, j):
+        self._changing()
+        list.__delslice__(self, i, j)
+
+    def remove(self, child):
+        self._changing()
+        list.remove(self, child)
+
+    def pop(self, *args):
+        self._changing()
+        return list.pop(self, *args)
+
+    def sort(self, *args, **kwargs):
+        self._changing()
+        list.sort(self, *args, **kwargs)
+
+    def reverse(self):
+        self._changing()
+        list.reverse(self)
+
+
+class _UcsmAttributesView(collections.MutableMapping):
+    """Attributes of UcsmObject copy, read from its source until first
+change, which copies them."""
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def __getitem__(self, key):
+        return self._owner._attrs()[key]
+
+    def __contains__(self, key):
+        return key in self._owner._attrs()
+
+    def __iter__(self):
+        return iter(self._owner._attrs())
+
+    def __len__(self):
+        return len(self._owner._attrs())
+
+    def __setitem__(self, key, value):
+        self._owner._own_attributes()[key] = value
+
+    def __delitem__(self, key):
+        del self._owner._own_attributes()[key]
+
+    def __eq__(self, other):
+        return self._owner._attrs() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self._owner._attrs())
+
+    def has_key(self, key):
+        return key in self
+
+    def copy(self):
+        return dict(self._owner._attrs())
+
+    def clear(self):
+        self._owner._own_attributes().clear()
+
+    def update(self, *args, **kwargs):
+        self._owner._own_attributes().update(*args, **kwargs)
+
+
+class _UcsmChildrenView(collections.MutableSequence):
+    """Children of UcsmObject copy, read from its source until first change,
+which copies the list. Children are given out as copies too."""
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def __getitem__(self, index):
+        kids = self._owner._kids()
+        if isinstance(index, slice):
+            return [child._copy_for(self._owner) for child in kids[index]]
+        return kids[index]._copy_for(self._owner)
+
+    def __iter__(self):
+        owner = self._owner
+        for child in owner._kids():
+            yield child._copy_for(owner)
+
+    def __len__(self):
+        return len(self._owner._kids())
+
+    def __nonzero__(self):
+        return bool(len(self))
+
+    def __setitem__(self, index, value):
+        self._owner._own_children()[index] = value
+
+    def __delitem__(self, index):
+        del self._owner._own_children()[index]
+
+    def insert(self, index, child):
+        self._owner._own_children().insert(index, child)
+
+    def append(self, child):
+        self._owner._own_children().append(child)
+
+    def extend(self, children):
+        self._owner._own_children().extend(children)
+
+    def sort(self, *args, **kwargs):
+        self._owner._own_children().sort(*args, **kwargs)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class UcsmObject(object):
     __slots__ = ['__init__', '__getattr__', '__setattr__', '__repr__', 'xml',
                  'xml_node', 'pretty_xml',
                  'children', 'attributes', 'parent', 'ucs_class',
-                 'find_children', 'set_creation_status']
-
-    def __init__(self, node_or_class=None, parent=None):
-        self.children = []
-        self.attributes = {}
-        self.parent = parent
+                 'find_children', 'set_creation_status', '_hash',
+                 '_cow_source', '_cow_clones', '__weakref__']
+    # names of attributes which can be set, None means any
+    _known_attributes = None
+
+    def __new__(cls, node_or_class=None, parent=None, index=None):
+        if cls is UcsmObject and MO_CLASSES and node_or_class is not None:
+            if isinstance(node_or_class, basestring):
+                class_id = node_or_class
+            elif isinstance(node_or_class, UcsmObject):
+                class_id = node_or_class.ucs_class
+            else:
+                class_id = node_or_class.nodeName
+            cls = MO_CLASSES.get(class_id, cls)
+        return super(UcsmObject, cls).__new__(cls)
+
+    def __init__(self, node_or_class=None, parent=None, index=None):
+        _set = super(UcsmObject, self).__setattr__
+        _set('_hash', None)
+        _set('_cow_source', None)
+        _set('_cow_clones', None)
+        _set('parent', parent)
+        _set('ucs_class', None)
+        _set('attributes', _UcsmAttributes(self))
+        _set('children', _UcsmChildren(self))
         if node_or_class is None:
-            self.ucs_class = None
+            pass
         elif isinstance(node_or_class, basestring):
-            self.ucs_class = node_or_class
+            _set('ucs_class', node_or_class)
         elif isinstance(node_or_class, UcsmObject):
             self._fill_copy(node_or_class)
         else:
             if node_or_class.nodeType != dom.Node.ELEMENT_NODE:
                 raise TypeError(
                     'UcsmObjects can be created only from XML element nodes.')
-            self.children = []
-            self.attributes = {}
-            self.ucs_class = node_or_class.nodeName.encode('utf8')
-            for attr, val in node_or_class.attributes.items():
-                self.attributes[attr.encode('utf8')] = val.encode('utf8')
+            _set('ucs_class', node_or_class.nodeName.encode('utf8'))
+            attributes = dict(
+                (attr.encode('utf8'), val.encode('utf8'))
+                for attr, val in node_or_class.attributes.items())
             if parent is not None\
-               and'dn' not in self.attributes\
-               and 'rn' in self.attributes\
-            and 'dn' in parent.attributes:
-                self.dn = os.path.join(parent.dn, self.rn)
-            if node_or_class is not None:
-                for child_node in node_or_class.childNodes:
-                    if child_node.nodeType == dom.Node.ELEMENT_NODE:
-                        child = UcsmObject(child_node, self)
-                        self.children.append(child)
+               and'dn' not in attributes\
+               and 'rn' in attributes\
+            and 'dn' in parent._attrs():
+                attributes['dn'] = Dn(parent.dn).child(attributes['rn'])
+            _set('attributes', _UcsmAttributes(self, attributes))
+            if index is not None:
+                index.add(self)
+            _set('children', _UcsmChildren(self, [
+                UcsmObject(child_node, self, index)
+                for child_node in node_or_class.childNodes
+                if child_node.nodeType == dom.Node.ELEMENT_NODE]))
 
     def copy(self, parent=None):
-        cpy = UcsmObject(str(self.ucs_class), parent=parent)
-        cpy._fill_copy(self)
+        """Returns copy of object with all its children. Copy shares
+attributes and children with this object until one of them is changed, then
+only changed objects and their ancestors are copied."""
+        cpy = object.__new__(type(self))
+        _set = super(UcsmObject, cpy).__setattr__
+        _set('_hash', self._hash)
+        _set('_cow_source', self)
+        _set('_cow_clones', None)
+        _set('parent', parent)
+        _set('ucs_class', self.ucs_class)
+        if self._cow_clones is None:
+            super(UcsmObject, self).__setattr__('_cow_clones', {})
+        _cow_register(self._cow_clones, cpy)
         return cpy
 
     def _fill_copy(self, src):
-        for k, v in src.attributes.items():
-            setattr(self, k, type(v)(v))
-        for child in src.children:
-            self.children.append(child.copy(self))
+        self.ucs_class = src.ucs_class
+        self.attributes = src._attrs()
+        self.children = [child.copy(self) for child in src._kids()]
+
+    def _attrs(self):
+        """Returns attributes for reading without copying them."""
+        node = self
+        while True:
+            try:
+                return _ATTRIBUTES_SLOT.__get__(node)
+            except AttributeError:
+                node = node._cow_source
+
+    def _kids(self):
+        """Returns children for reading without copying them."""
+        node = self
+        while True:
+            try:
+                return _CHILDREN_SLOT.__get__(node)
+            except AttributeError:
+                node = node._cow_source
+
+    def _own_attributes(self):
+        try:
+            return _ATTRIBUTES_SLOT.__get__(self)
+        except AttributeError:
+            return self._cow_copy_attributes()
+
+    def _own_children(self):
+        try:
+            return _CHILDREN_SLOT.__get__(self)
+        except AttributeError:
+            return self._cow_copy_children()
+
+    def _copy_for(self, parent):
+        """Returns copy of this object with given parent, reusing the one
+given out before if it is still alive."""
+        if self._cow_clones:
+            ref = self._cow_clones.get(id(parent))
+            clone = ref and ref()
+            if clone is not None and clone.parent is parent \
+                    and clone._cow_source is self:
+                return clone
+        return self.copy(parent)
+
+    def _cow_copy_attributes(self):
+        attrs = _UcsmAttributes(self, self._cow_source._attrs())
+        super(UcsmObject, self).__setattr__('attributes', attrs)
+        self._cow_release()
+        return attrs
+
+    def _cow_copy_children(self):
+        kids = _UcsmChildren.__new__(_UcsmChildren)
+        list.__init__(kids, [child._copy_for(self)
+                             for child in self._cow_source._kids()])
+        kids._owner = self
+        super(UcsmObject, self).__setattr__('children', kids)
+        self._cow_release()
+        return kids
+
+    def _cow_release(self):
+        try:
+            _ATTRIBUTES_SLOT.__get__(self)
+            _CHILDREN_SLOT.__get__(self)
+        except AttributeError:
+            return
+        source = self._cow_source
+        super(UcsmObject, self).__setattr__('_cow_source', None)
+        if source._cow_clones:
+            for key in (id(self.parent), id(self)):
+                ref = source._cow_clones.get(key)
+                if ref is not None and ref() is self:
+                    del source._cow_clones[key]
+
+    def _cow_detach(self, attributes=False, children=False):
+        """Makes pending copies of this object independent before change."""
+        for ref in self._cow_clones.values():
+            clone = ref()
+            if clone is None or clone._cow_source is not self:
+                continue
+            if attributes:
+                try:
+                    _ATTRIBUTES_SLOT.__get__(clone)
+                except AttributeError:
+                    clone._cow_copy_attributes()
+            if children:
+                try:
+                    _CHILDREN_SLOT.__get__(clone)
+                except AttributeError:
+                    clone._cow_copy_children()
+        for key, ref in self._cow_clones.items():
+            clone = ref()
+            if clone is None or clone._cow_source is not self:
+                self._cow_clones.pop(key, None)
+
+    def _changing(self, attributes=False, children=False):
+        """Called before object is changed. Detaches copies, which share data
+with this object or its ancestors, and drops cached hashes."""
+        chain = []
+        node = self
+        while node is not None:
+            chain.append(node)
+            node = node.parent
+        # children given out by views of copies become real children
+        for node in chain[1:]:
+            node._own_children()
+        for node in reversed(chain[1:]):
+            if node._cow_clones:
+                node._cow_detach(children=True)
+        if self._cow_clones:
+            self._cow_detach(attributes, children)
+        for node in chain:
+            super(UcsmObject, node).__setattr__('_hash', None)
 
     def __getattr__(self, item):
+        if item == 'attributes':
+            return _UcsmAttributesView(self)
+        if item == 'children':
+            return _UcsmChildrenView(self)
         try:
-            return self.attributes[item]
+            return self._attrs()[item]
         except KeyError:
             raise AttributeError('UcsmObject has no attribute \'%s\'' % item)
 
     def __setattr__(self, key, value):
         if key in UcsmObject.__slots__:
+            if key == 'attributes':
+                self._changing(attributes=True)
+                value = _UcsmAttributes(self, value)
+            elif key == 'children':
+                self._changing(children=True)
+                value = _UcsmChildren(self, value)
+            elif key == 'ucs_class':
+                self._changing()
             super(UcsmObject, self).__setattr__(key, value)
+        elif self._known_attributes is not None \
+                and key not in self._known_attributes:
+            raise AttributeError('%s has no attribute \'%s\'' %
+                                 (self.ucs_class, key))
         else:
             self.attributes[key] = value
 
+    def _invalidate(self):
+        self._changing()
+
+    def tree_hash(self):
+        """Returns digest of class, attributes and children hashes, which
+does not depend on children order. Digest is cached until object or any of its
+descendants is changed."""
+        if self._hash is None:
+            digest = hashlib.sha1(self.ucs_class or '')
+            for name, value in sorted(self._attrs().items()):
+                digest.update('\0%s=%s' % (name, value))
+            for child_hash in sorted(child.tree_hash()
+                                     for child in self._kids()):
+                digest.update('\1' + child_hash)
+            super(UcsmObject, self).__setattr__('_hash', digest.digest())
+        return self._hash
+
     def __repr__(self):
         repr = self.ucs_class
-        if len(self.attributes):
+        attributes = self._attrs()
+        if len(attributes):
             repr = repr + '; ' + ' '.join(
-                '%s=%s' % (n, v) for n, v in self.attributes.items())
+                '%s=%s' % (n, v) for n, v in attributes.items())
         return '<UcsmObject instance at %x with class %s>' % (id(self), repr)
 
     def xml(self, hierarchy=False):
@@ -974,16 +2877,16 @@ class UcsmObject(object):
 
     def xml_node(self, hierarchy=False):
         node = minidom.Element(self.ucs_class)
-        for n, v in self.attributes.items():
+        for n, v in self._attrs().items():
             node.setAttribute(n, str(v))
         if hierarchy:
-            for child in self.children:
+            for child in self._kids():
                 node.appendChild(child.xml_node(True))
         return node
 
     def pretty_str(self):
         str = self.ucs_class
-        for name, val in self.attributes.items():
+        for name, val in self._attrs().items():
             str += '\n%s: %s' % (name, val)
         return str
 
@@ -1002,13 +2905,522 @@ class UcsmObject(object):
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.attributes == other.attributes\
+            return self._attrs() == other._attrs()\
                 and self.ucs_class == other.ucs_class\
-                and self.children == other.children
+                and self._kids() == other._kids()
         else:
             return False
 
 
+def _cow_register(clones, clone):
+    """Adds weak reference to copy to clones of its source, keyed by id of
+copy's parent so that copy for parent is found at once. Copies without
+parent, or next to other copy with the same parent, are keyed by own id."""
+    key = id(clone.parent)
+    current = clones.get(key)
+    if clone.parent is None or current is not None and current() is not None:
+        key = id(clone)
+
+    def forget(ref):
+        if clones.get(key) is ref:
+            del clones[key]
+    clones[key] = weakref.ref(clone, forget)
+
+
+_ATTRIBUTES_SLOT = UcsmObject.__dict__['attributes']
+_CHILDREN_SLOT = UcsmObject.__dict__['children']
+
+
+def _object_from_compact(node, parent=None, index=None):
+    """Builds UcsmObject from node made by _compact_xml."""
+    class_id, attributes, children = node
+    obj = UcsmObject(class_id, parent)
+    if parent is not None\
+       and 'dn' not in attributes\
+       and 'rn' in attributes\
+       and 'dn' in parent._attrs():
+        attributes['dn'] = Dn(parent.dn).child(attributes['rn'])
+    _set = super(UcsmObject, obj).__setattr__
+    _set('attributes', _UcsmAttributes(obj, attributes))
+    if index is not None:
+        index.add(obj)
+    _set('children', _UcsmChildren(obj, [
+        _object_from_compact(child, obj, index) for child in children]))
+    return obj
+
+# registry of generated classes, class id: UcsmObject subclass
+MO_CLASSES = {}
+
+_COMMON_ATTRIBUTES = frozenset(['dn', 'rn', 'status', 'childAction'])
+
+
+def _to_bool(value):
+    if isinstance(value, basestring):
+        return value.lower() in ('yes', 'true', 'on', 'enabled', '1')
+    return bool(value)
+
+
+_CONVERTERS = {
+    'int': int,
+    'uint': int,
+    'long': int,
+    'float': float,
+    'double': float,
+    'bool': _to_bool,
+    'boolean': _to_bool,
+}
+
+
+def _converter(type_name):
+    if callable(type_name):
+        return type_name
+    type_name = type_name.lower()
+    for prefix, convert in _CONVERTERS.items():
+        if type_name.startswith(prefix):
+            return convert
+    return None
+
+
+def _typed_property(name, convert):
+    def getter(self):
+        try:
+            raw = self._attrs()[name]
+        except KeyError:
+            raise AttributeError('%s has no attribute \'%s\'' %
+                                 (self.ucs_class, name))
+        try:
+            decoded = self._decoded
+        except AttributeError:
+            decoded = {}
+            super(UcsmObject, self).__setattr__('_decoded', decoded)
+        cached = decoded.get(name)
+        if cached is not None and cached[0] is raw:
+            return cached[1]
+        try:
+            value = convert(raw)
+        except (TypeError, ValueError):
+            # values like 'not-applicable' are returned as is
+            value = raw
+        decoded[name] = (raw, value)
+        return value
+    return property(getter, doc='%s attribute converted by %s' %
+                                (name, getattr(convert, '__name__', convert)))
+
+
+def define_mo_class(class_id, attributes, strict=False):
+    """Generates UcsmObject subclass for UCSM class and registers it, so
+objects of this class are created by response decoders and UcsmObject
+constructor. Attributes is dictionary of attribute name: type name, where type
+is one of 'string', 'int', 'uint32', 'float', 'boolean' and so on, or callable
+converter. Typed attributes are converted on first access and conversion is
+cached until attribute is changed. If strict is set, setting unknown
+attributes raises AttributeError."""
+    namespace = {'__slots__': ['_decoded']}
+    for name, type_name in attributes.items():
+        convert = _converter(type_name)
+        if convert is not None and name not in _COMMON_ATTRIBUTES:
+            namespace[name] = _typed_property(name, convert)
+    if strict:
+        namespace['_known_attributes'] = \
+            frozenset(attributes) | _COMMON_ATTRIBUTES
+    name = str(class_id[:1].upper() + class_id[1:])
+    cls = type(name, (UcsmObject,), namespace)
+    MO_CLASSES[class_id] = cls
+    return cls
+
+
+def define_mo_classes(metadata, strict=False):
+    """Generates classes for every class id of metadata, which is dictionary
+of class id: attributes dictionary, or name of JSON file with such dictionary.
+Returns dictionary of generated classes."""
+    if isinstance(metadata, basestring):
+        with open(metadata) as f:
+            metadata = json.load(f)
+    return dict((str(class_id), define_mo_class(str(class_id), dict(
+                    (str(name), type_name)
+                    for name, type_name in attributes.items()), strict))
+                for class_id, attributes in metadata.items())
+
+
+_DIFF_IGNORED = frozenset(['dn', 'rn', 'status'])
+
+
+def _child_key(obj):
+    if 'rn' in obj.attributes:
+        return obj.rn
+    if 'dn' in obj.attributes:
+        return Dn(obj.dn).rn
+    raise UcsmError('Object %r has neither rn nor dn.' % obj)
+
+
+def diff_objects(desired, current, delete_missing=False):
+    """Computes minimal list of configs which turn current object tree into
+desired one. Only attributes given in desired objects are compared, modified
+configs contain only differing attributes. Children are matched by rn. Current
+children absent in desired tree are deleted only if delete_missing is set.
+Configs are ordered parents first and have status attribute set."""
+    if 'dn' not in desired.attributes:
+        raise UcsmError('Desired object %r has no dn.' % desired)
+    changes = []
+    if current is None:
+        created = desired.copy()
+        created.set_creation_status('created')
+        changes.append(created)
+        return changes
+    modified = UcsmObject(desired.ucs_class)
+    for name, value in desired.attributes.items():
+        if name in _DIFF_IGNORED:
+            continue
+        if current.attributes.get(name) != str(value):
+            setattr(modified, name, value)
+    if modified.attributes:
+        modified.dn = desired.dn
+        modified.status = 'modified'
+        changes.append(modified)
+
+    current_children = dict((_child_key(child), child)
+                            for child in current.children)
+    for child in desired.children:
+        key = _child_key(child)
+        if 'dn' not in child.attributes:
+            child = child.copy()
+            child.dn = Dn(desired.dn).child(key)
+        changes.extend(diff_objects(child, current_children.pop(key, None),
+                                    delete_missing))
+    if delete_missing:
+        for key, child in sorted(current_children.items()):
+            deleted = UcsmObject(child.ucs_class)
+            deleted.dn = Dn(desired.dn).child(key)
+            deleted.status = 'deleted'
+            changes.append(deleted)
+    return changes
+
+
+def _tree_key(obj):
+    try:
+        return _child_key(obj)
+    except UcsmError:
+        return obj.ucs_class, obj.tree_hash()
+
+
+def diff_trees(first, second):
+    """Yields pairs of differing objects of two trees, descending only into
+subtrees with different tree_hash. Children are matched by rn, object missing
+in one of trees is paired with None."""
+    if first is None or second is None:
+        yield first, second
+        return
+    if first.tree_hash() == second.tree_hash():
+        return
+    if first.ucs_class != second.ucs_class \
+            or first.attributes != second.attributes:
+        yield first, second
+    first_children = dict((_tree_key(c), c) for c in first.children)
+    second_children = dict((_tree_key(c), c) for c in second.children)
+    for key in sorted(set(first_children) | set(second_children)):
+        for pair in diff_trees(first_children.get(key),
+                               second_children.get(key)):
+            yield pair
+
+
+def _merge_events(first, second):
+    """Returns net change of two successive events of one dn, None if they
+cancel out."""
+    first_status = first.attributes.get('status', '')
+    second_status = second.attributes.get('status', '')
+    if 'deleted' in second_status:
+        if 'created' in first_status:
+            return None
+        return second
+    if 'deleted' in first_status:
+        merged = second.copy()
+        merged.attributes['status'] = 'created'
+        return merged
+    merged = first.copy()
+    merged.attributes.update(second.attributes)
+    merged.attributes['status'] = 'created' if 'created' in first_status \
+        else second_status
+    return merged
+
+
+def coalesce_events(events, window=1.0, max_delay=5.0, queue_size=10000):
+    """Merges successive events of one dn arrived within window seconds into
+single net change, creation followed by deletion is dropped. Events are
+yielded in order of first arrival of their dn, each not later than max_delay
+seconds after it. events is iterable of (event_id, config) like iter_events
+output, it is read in separate thread, which waits when queue_size events are
+not taken yet. Source is closed when iteration stops."""
+    events = iter(events)
+    queue = Queue.Queue(queue_size)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for event in events:
+                if not put(event):
+                    return
+            put((end, None))
+        except Exception, e:
+            put((end, e))
+        finally:
+            close = getattr(events, 'close', None)
+            if close is not None:
+                close()
+    reader = threading.Thread(target=read, name='pyucsm-coalesce')
+    reader.daemon = True
+    reader.start()
+    try:
+        for event in _coalesce(queue, end, window, max_delay):
+            yield event
+    finally:
+        stop.set()
+        close = getattr(events, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except ValueError:
+                # still read by reader, which closes it after next event
+                pass
+
+
+def _coalesce(queue, end, window, max_delay):
+    # dn -> [first arrival, last arrival, event id, net change]
+    pending = collections.OrderedDict()
+    while True:
+        now = time.time()
+        while pending:
+            dn, (first, last, event_id, config) = next(pending.iteritems())
+            if now - last < window and now - first < max_delay:
+                break
+            del pending[dn]
+            if config is not None:
+                yield event_id, config
+        timeout = None
+        if pending:
+            first, last = next(pending.itervalues())[:2]
+            timeout = max(0, min(last + window, first + max_delay) - now)
+        try:
+            event_id, config = queue.get(timeout=timeout)
+        except Queue.Empty:
+            continue
+        if event_id is end:
+            error = config
+            for entry in pending.itervalues():
+                if entry[3] is not None:
+                    yield entry[2], entry[3]
+            if error is not None:
+                raise error
+            return
+        now = time.time()
+        dn = config.attributes.get('dn')
+        entry = pending.get(dn)
+        if entry is None:
+            pending[dn] = [now, now, event_id, config]
+        elif entry[3] is None:
+            # cancelled out, later events start from scratch
+            entry[1:] = [now, event_id, config]
+        else:
+            entry[1:] = [now, event_id, _merge_events(entry[3], config)]
+
+
+class _DnTrieNode(object):
+    __slots__ = ['rn', 'parent', 'children', 'obj', 'classes']
+
+    def __init__(self, rn=None, parent=None):
+        self.rn = rn
+        self.parent = parent
+        self.children = {}
+        self.obj = None
+        self.classes = {}
+
+
+class UcsmIndex(object):
+    """Index of UcsmObjects by dn and by class. Dns are stored in trie, so
+subtree and prefix lookups take time proportional to dn depth and result size.
+Pass index to resolve_* methods to fill it while response is parsed.
+    """
+
+    def __init__(self, objects=()):
+        self.by_dn = {}
+        self.by_class = {}
+        self._root = _DnTrieNode()
+        for obj in objects:
+            self.add(obj, recursive=True)
+
+    def __len__(self):
+        return sum(len(objs) for objs in self.by_class.itervalues())
+
+    def __contains__(self, dn):
+        return dn in self.by_dn
+
+    def _node(self, dn, create=False):
+        node = self._root
+        for rn in Dn(dn).rns:
+            child = node.children.get(rn)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[rn] = _DnTrieNode(rn, node)
+            node = child
+        return node
+
+    def add(self, obj, recursive=False):
+        """Adds object to index, replacing object with the same dn."""
+        if 'dn' in obj.attributes:
+            self.remove(obj.dn)
+            self.by_dn[obj.dn] = obj
+            node = self._node(obj.dn, create=True)
+            node.obj = obj
+            while node is not None:
+                node.classes.setdefault(obj.ucs_class, {})[obj.dn] = obj
+                node = node.parent
+        self.by_class.setdefault(obj.ucs_class, {})[id(obj)] = obj
+        if recursive:
+            for child in obj.children:
+                self.add(child, True)
+
+    def remove(self, dn):
+        """Removes object with given dn, returns removed object or None."""
+        obj = self.by_dn.pop(dn, None)
+        if obj is None:
+            return None
+        node = self._node(dn)
+        node.obj = None
+        leaf = node
+        while node is not None:
+            objs = node.classes[obj.ucs_class]
+            del objs[dn]
+            if not objs:
+                del node.classes[obj.ucs_class]
+            node = node.parent
+        while leaf.parent is not None and leaf.obj is None \
+                and not leaf.children:
+            del leaf.parent.children[leaf.rn]
+            leaf = leaf.parent
+        objs = self.by_class[obj.ucs_class]
+        del objs[id(obj)]
+        if not objs:
+            del self.by_class[obj.ucs_class]
+        return obj
+
+    def get(self, dn, default=None):
+        return self.by_dn.get(dn, default)
+
+    def roots(self):
+        """Returns list of indexed objects which have no indexed ancestors."""
+        return self.children('')
+
+    def apply_event(self, obj):
+        """Applies change object, as yielded by UcsmConnection.iter_events,
+to index and to children lists of indexed objects. Returns changed object or
+None if nothing changed."""
+        dn = Dn(obj.dn)
+        status = obj.attributes.get('status', '')
+        current = self.by_dn.get(dn)
+        if 'deleted' in status:
+            if current is None:
+                return None
+            for child in self.find(under=dn):
+                self.remove(child.dn)
+            parent = self.by_dn.get(dn.parent)
+            if parent is not None:
+                # by identity, equality would compare whole sibling subtrees
+                siblings = parent.children
+                for i, child in enumerate(siblings):
+                    if child is current:
+                        del siblings[i]
+                        break
+            return current
+        if current is None:
+            current = UcsmObject(obj.ucs_class)
+            current.attributes.update((k, v)
+                                      for k, v in obj.attributes.items()
+                                      if k != 'status')
+            if 'rn' not in current.attributes:
+                current.rn = dn.rn
+            parent = self.by_dn.get(dn.parent)
+            if parent is not None:
+                parent.children.append(current)
+            self.add(current)
+            return current
+        current.attributes.update((k, v) for k, v in obj.attributes.items()
+                                  if k != 'status')
+        return current
+
+    def find(self, class_id=None, under=None):
+        """Returns list of objects of given class. If under is given, only
+objects from subtree of this dn are returned."""
+        if under is None:
+            if class_id is None:
+                return [obj for objs in self.by_class.itervalues()
+                        for obj in objs.itervalues()]
+            return self.by_class.get(class_id, {}).values()
+        node = self._node(under)
+        if node is None:
+            return []
+        if class_id is None:
+            return [obj for objs in node.classes.itervalues()
+                    for obj in objs.itervalues()]
+        return node.classes.get(class_id, {}).values()
+
+    def subtree(self, dn):
+        """Returns list of object with given dn and all indexed objects
+under it."""
+        return self.find(under=dn)
+
+    def children(self, dn):
+        """Returns list of indexed objects which are nearest descendants of
+given dn."""
+        node = self._node(dn)
+        res = []
+        stack = node and node.children.values() or []
+        while stack:
+            node = stack.pop()
+            if node.obj is not None:
+                res.append(node.obj)
+            else:
+                stack.extend(node.children.values())
+        return res
+
+    def parent(self, obj_or_dn):
+        """Returns nearest indexed ancestor of object or dn."""
+        dn = isinstance(obj_or_dn, UcsmObject) and obj_or_dn.dn or obj_or_dn
+        node = self._node(dn)
+        if node is None:
+            return None
+        node = node.parent
+        while node is not None and node.obj is None:
+            node = node.parent
+        return node and node.obj
+
+    def startswith(self, prefix):
+        """Returns objects which dn starts with given string, for example
+'sys/chassis-1/blade-'."""
+        rns = Dn(prefix).rns
+        if not rns:
+            return self.find()
+        if prefix.endswith('/'):
+            return [obj for obj in self.find(under=prefix)
+                    if obj.dn != prefix.rstrip('/')]
+        node = self._node(Dn(prefix).parent or '')
+        if node is None:
+            return []
+        return [obj for rn, child in node.children.iteritems()
+                if rn.startswith(rns[-1])
+                for objs in child.classes.itervalues()
+                for obj in objs.itervalues()]
+
+
 class UcsmFilterVisitor(object):
     """Base class for recursive operations with filter hierarchy."""
 
@@ -1022,6 +3434,81 @@ class UcsmFilterVisitor(object):
         raise NotImplementedError()
 
 
+class MatchVisitor(UcsmFilterVisitor):
+    """Evaluates filter for object on client side."""
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def visit_op(self, node):
+        return True
+
+    def visit_property(self, node):
+        try:
+            value = self.obj._attrs()[node.attribute.name]
+        except KeyError:
+            return False
+        expected = node.value
+        op = node.operator
+        if op == UcsmPropertyFilter.WILDCARD:
+            return re.search(str(expected), str(value)) is not None
+        if op in (UcsmPropertyFilter.ANY_BIT, UcsmPropertyFilter.ALL_BIT):
+            bits = set(str(value).split(','))
+            wanted = set(str(expected).split(','))
+            if op == UcsmPropertyFilter.ANY_BIT:
+                return bool(bits & wanted)
+            return wanted <= bits
+        try:
+            value, expected = float(value), float(expected)
+        except (TypeError, ValueError):
+            value, expected = str(value), str(expected)
+        return {UcsmPropertyFilter.EQUALS: value == expected,
+                UcsmPropertyFilter.NOT_EQUALS: value != expected,
+                UcsmPropertyFilter.GREATER: value > expected,
+                UcsmPropertyFilter.GREATER_OR_EQUAL: value >= expected,
+                UcsmPropertyFilter.LESS_THAN: value < expected,
+                UcsmPropertyFilter.LESS_OR_EQUAL: value <= expected}[op]
+
+    def visit_compose(self, node):
+        if node.operator == UcsmComposeFilter.AND:
+            return all(arg.visit(self) for arg in node.arguments)
+        if node.operator == UcsmComposeFilter.OR:
+            return any(arg.visit(self) for arg in node.arguments)
+        return not node.arguments[0].visit(self)
+
+
+_PROPERTY_OPERATORS = frozenset([UcsmPropertyFilter.EQUALS,
+                                 UcsmPropertyFilter.NOT_EQUALS,
+                                 UcsmPropertyFilter.GREATER,
+                                 UcsmPropertyFilter.GREATER_OR_EQUAL,
+                                 UcsmPropertyFilter.LESS_THAN,
+                                 UcsmPropertyFilter.LESS_OR_EQUAL,
+                                 UcsmPropertyFilter.WILDCARD,
+                                 UcsmPropertyFilter.ANY_BIT,
+                                 UcsmPropertyFilter.ALL_BIT])
+
+
+def parse_filter(node):
+    """Builds filter from inFilter XML node or filter operation node, reverse
+to UcsmFilterOp.final_xml_node."""
+    if node is None:
+        return UcsmFilterOp()
+    args = [child for child in node.childNodes
+            if child.nodeType == dom.Node.ELEMENT_NODE]
+    operator = node.tagName
+    if operator == 'inFilter':
+        return args and parse_filter(args[0]) or UcsmFilterOp()
+    if operator in (UcsmComposeFilter.AND, UcsmComposeFilter.OR,
+                    UcsmComposeFilter.NOT):
+        return UcsmComposeFilter(operator, *map(parse_filter, args))
+    if operator in _PROPERTY_OPERATORS:
+        attribute = UcsmAttribute(node.getAttribute('class'),
+                                  node.getAttribute('property'))
+        return UcsmPropertyFilter(attribute, operator,
+                                  node.getAttribute('value'))
+    raise UcsmError('Unsupported filter operation: %s' % operator)
+
+
 class XmlGeneratorVisitor(UcsmFilterVisitor):
     """"Xmlizer through visitors."""
 
@@ -21,7 +21,8 @@ setup(
     license = 'Apache',
     author = 'Nikolay Sokolov',
     author_email = 'nsokolov@griddynamics.com',
-    py_modules = ['pyucsm', 'ucsmquery'],
+    py_modules = ['pyucsm', 'ucsmquery', 'ucsmstore', 'ucsmmonitor',
+                  'ucsmsession', 'ucsmproxy', 'ucsmcrawler'],
     classifiers = [
         'Development Status :: 3 - Alpha',
         'Environment :: Console',
@@ -37,6 +38,7 @@ setup(
     test_suite = "",
 
     entry_points = {
-        'console_scripts': ['ucsmquery = ucsmquery:main']
+        'console_scripts': ['ucsmquery = ucsmquery:main',
+                            'ucsmproxy = ucsmproxy:main']
     }
 )
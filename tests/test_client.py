@@ -29,7 +29,16 @@ import os
 sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__),
                                                  os.path.pardir)))
 
+import BaseHTTPServer
+import SocketServer
+import threading
+import time
 import unittest
+import gc
+import gzip
+import multiprocessing
+import StringIO
+import zlib
 import pyucsm
 import httplib
 from xml.dom import minidom
@@ -642,5 +651,1249 @@ class TestUcsmObject(MyBaseTest):
         self.assertEqual(obja, objb)
 
 
+class RecordingConnection(pyucsm.UcsmConnection):
+    """Connection which does not touch network and records conf_mos calls."""
+
+    def __init__(self, fail_dns=()):
+        super(RecordingConnection, self).__init__('host', 80)
+        self.fail_dns = set(fail_dns)
+        self.batches = []
+
+    def conf_mos(self, configs, hierarchy=False):
+        configs = list(configs)
+        self.batches.append([dn for dn, _ in configs])
+        for dn, _ in configs:
+            if dn in self.fail_dns:
+                raise pyucsm.UcsmResponseError(103, 'failed %s' % dn)
+        return dict((dn, conf.copy()) for dn, conf in configs)
+
+
+class TestBulkWrite(MyBaseTest):
+
+    def _configs(self, *dns):
+        res = []
+        for dn in dns:
+            obj = pyucsm.UcsmObject('orgOrg')
+            obj.dn = dn
+            res.append(obj)
+        return res
+
+    def test_parents_first(self):
+        c = RecordingConnection()
+        res = c.conf_mos_bulk(self._configs('org-root/org-a/org-b',
+                                            'org-root/org-a',
+                                            'org-root/org-c'),
+                              parallelism=1)
+        self.assertTrue(res.ok)
+        self.assertEqual(3, len(res.changed))
+        self.assertEqual([['org-root/org-a', 'org-root/org-c'],
+                          ['org-root/org-a/org-b']], c.batches)
+
+    def test_batch_bounds(self):
+        c = RecordingConnection()
+        dns = ['fabric/lan/net-%d' % i for i in range(25)]
+        res = c.conf_mos_bulk(self._configs(*dns), batch_size=10)
+        self.assertEqual(25, len(res.changed))
+        self.assertEqual([10, 10, 5], sorted(map(len, c.batches),
+                                             reverse=True))
+        c = RecordingConnection()
+        size = len(self._configs(dns[0])[0].xml())
+        c.conf_mos_bulk(self._configs(*dns), batch_bytes=size * 2)
+        self.assertTrue(all(len(b) <= 2 for b in c.batches))
+
+    def test_failures(self):
+        c = RecordingConnection(fail_dns=['org-root/org-a'])
+        res = c.conf_mos_bulk(self._configs('org-root/org-a',
+                                            'org-root/org-a/org-b',
+                                            'org-root/org-c'),
+                              isolate_failures=True)
+        self.assertFalse(res.ok)
+        self.assertEqual(['org-root/org-c'], res.changed.keys())
+        self.assertEqual(['org-root/org-a', 'org-root/org-a/org-b'],
+                         sorted(res.failed))
+        self.assertIsInstance(res.failed['org-root/org-a'],
+                              pyucsm.UcsmResponseError)
+
+
+class TestReconcile(MyBaseTest):
+
+    def _obj(self, cls, dn=None, rn=None, **attrs):
+        obj = pyucsm.UcsmObject(cls)
+        if dn:
+            obj.dn = dn
+        if rn:
+            obj.rn = rn
+        for name, value in attrs.items():
+            setattr(obj, name, value)
+        return obj
+
+    def test_diff(self):
+        current = self._obj('orgOrg', dn='org-root/org-a', name='a',
+                            descr='old', fltAggr='0')
+        current.children.append(self._obj('lsServer', rn='ls-x',
+                                          dn='org-root/org-a/ls-x',
+                                          name='x', descr=''))
+        current.children.append(self._obj('lsServer', rn='ls-y',
+                                          dn='org-root/org-a/ls-y'))
+        desired = self._obj('orgOrg', dn='org-root/org-a', name='a',
+                            descr='new')
+        desired.children.append(self._obj('lsServer', rn='ls-x', name='x'))
+        desired.children.append(self._obj('lsServer', rn='ls-z', name='z'))
+
+        changes = pyucsm.diff_objects(desired, current)
+        self.assertEqual(2, len(changes))
+        self.assertEqual({'dn': 'org-root/org-a', 'status': 'modified',
+                          'descr': 'new'}, changes[0].attributes)
+        self.assertEqual('org-root/org-a/ls-z', changes[1].dn)
+        self.assertEqual('created', changes[1].status)
+
+        changes = pyucsm.diff_objects(desired, current, delete_missing=True)
+        self.assertEqual(['modified', 'created', 'deleted'],
+                         [c.status for c in changes])
+        self.assertEqual('org-root/org-a/ls-y', changes[2].dn)
+
+    def test_reconcile_unchanged(self):
+        c = RecordingConnection()
+        current = self._obj('orgOrg', dn='org-root/org-a', name='a')
+        desired = self._obj('orgOrg', dn='org-root/org-a', name='a')
+        self.assertEqual({}, c.reconcile(desired, current))
+        self.assertEqual([], c.batches)
+        desired.descr = 'changed'
+        c.reconcile(desired, current)
+        self.assertEqual([['org-root/org-a']], c.batches)
+
+
+class TestTreeHash(MyBaseTest):
+
+    def _tree(self, order=(1, 2, 3)):
+        root = pyucsm.UcsmObject('equipmentChassis')
+        root.dn = 'sys/chassis-1'
+        for i in order:
+            blade = pyucsm.UcsmObject('computeBlade')
+            blade.rn = 'blade-%d' % i
+            blade.dn = 'sys/chassis-1/blade-%d' % i
+            blade.totalMemory = '8192'
+            root.children.append(blade)
+        return root
+
+    def test_order_independent(self):
+        first = self._tree()
+        second = self._tree((3, 1, 2))
+        self.assertEqual(first.tree_hash(), second.tree_hash())
+        self.assertEqual([], list(pyucsm.diff_trees(first, second)))
+
+    def test_invalidation(self):
+        tree = self._tree()
+        initial = tree.tree_hash()
+        tree.children[1].totalMemory = '16384'
+        self.assertNotEqual(initial, tree.tree_hash())
+        tree.children[1].attributes['totalMemory'] = '8192'
+        self.assertEqual(initial, tree.tree_hash())
+        tree.children.append(pyucsm.UcsmObject('computeBlade'))
+        self.assertNotEqual(initial, tree.tree_hash())
+        tree.children.pop()
+        self.assertEqual(initial, tree.tree_hash())
+        tree.ucs_class = 'equipmentRackUnit'
+        self.assertNotEqual(initial, tree.tree_hash())
+
+    def test_diff_trees(self):
+        first = self._tree()
+        second = self._tree((1, 2, 4))
+        second.children[0].totalMemory = '16384'
+        diff = list(pyucsm.diff_trees(first, second))
+        self.assertEqual(3, len(diff))
+        self.assertEqual((first.children[0], second.children[0]), diff[0])
+        self.assertEqual((first.children[2], None), diff[1])
+        self.assertEqual((None, second.children[2]), diff[2])
+
+
+class CannedConnection(pyucsm.UcsmConnection):
+    """Connection which replies to every request with given XML strings."""
+
+    def __init__(self, *replies):
+        super(CannedConnection, self).__init__('host', 80)
+        self.replies = list(replies)
+        self.requests = []
+
+    def _submit_request(self, request_data, headers=None, compact=False):
+        self.requests.append(request_data)
+        return minidom.parseString(self.replies.pop(0)), None
+
+
+HIERARCHY_REPLY = """<configResolveClass response="yes" classId="equipmentChassis">
+<outConfigs>
+  <equipmentChassis dn="sys/chassis-1" id="1">
+    <computeBlade rn="blade-1" slotId="1">
+      <adaptorUnit rn="adaptor-1"/>
+    </computeBlade>
+    <computeBlade rn="blade-2" slotId="2"/>
+  </equipmentChassis>
+  <equipmentChassis dn="sys/chassis-2" id="2">
+    <computeBlade rn="blade-1" slotId="1"/>
+  </equipmentChassis>
+</outConfigs>
+</configResolveClass>"""
+
+
+class TestResolveClassValues(MyBaseTest):
+
+    def test_values(self):
+        conn = CannedConnection("""<configResolveClass response="yes">
+<outConfigs>
+  <adaptorEthPortStats dn="sys/port-1/stats" bytesRx="10" packetsRx="2"/>
+  <adaptorEthPortStats dn="sys/port-2/stats" bytesRx="20"/>
+</outConfigs></configResolveClass>""")
+        res = conn.resolve_class_values('adaptorEthPortStats',
+                                        ['bytesRx', 'packetsRx'])
+        self.assertEqual(res, [('sys/port-1/stats', ['10', '2']),
+                               ('sys/port-2/stats', ['20', None])])
+
+
+class TestFaults(MyBaseTest):
+
+    def test_ack_faults(self):
+        conn = CannedConnection('<faultAckFaults response="yes"/>')
+        conn.ack_faults([10, 11])
+        self.assertTrue('<inIds><id value="10"/><id value="11"/></inIds>'
+                        in conn.requests[0])
+
+    def test_resolve_fault(self):
+        conn = CannedConnection("""<faultResolveFault response="yes">
+<outFault><faultInst dn="sys/chassis-1/fault-F0156" id="10" code="F0156"/>
+</outFault></faultResolveFault>""")
+        fault = conn.resolve_fault(10)
+        self.assertTrue('inId="10"' in conn.requests[0])
+        self.assertEqual((fault.ucs_class, fault.code),
+                         ('faultInst', 'F0156'))
+
+
+class TestParseFilter(MyBaseTest):
+
+    def test_roundtrip(self):
+        slot = pyucsm.UcsmAttribute('computeBlade', 'slotId')
+        name = pyucsm.UcsmAttribute('computeBlade', 'name')
+        filter = (slot > 2) & ~name.wildcard_match('^web') | (slot == 1)
+        parsed = pyucsm.parse_filter(filter.final_xml_node())
+        self.assertEqual(parsed.final_xml(), filter.final_xml())
+        empty = pyucsm.parse_filter(pyucsm.UcsmFilterOp().final_xml_node())
+        self.assertEqual(type(empty), pyucsm.UcsmFilterOp)
+
+
+class TestUcsmIndex(MyBaseTest):
+
+    def _index(self):
+        c = CannedConnection(HIERARCHY_REPLY)
+        index = pyucsm.UcsmIndex()
+        res = c.resolve_class('equipmentChassis', hierarchy=True, index=index)
+        self.assertEqual(2, len(res))
+        return index
+
+    def test_lookup(self):
+        index = self._index()
+        self.assertEqual(6, len(index))
+        blade = index.get('sys/chassis-1/blade-2')
+        self.assertEqual('2', blade.slotId)
+        self.assertEqual('sys/chassis-1', index.parent(blade).dn)
+        self.assertEqual(3, len(index.find('computeBlade')))
+        self.assertEqual(['sys/chassis-1/blade-1', 'sys/chassis-1/blade-2'],
+                         sorted(o.dn for o in index.find('computeBlade',
+                                                         'sys/chassis-1')))
+        self.assertEqual(4, len(index.subtree('sys/chassis-1')))
+        self.assertEqual(['sys/chassis-1', 'sys/chassis-2'],
+                         sorted(o.dn for o in index.children('sys')))
+        self.assertEqual(['sys/chassis-1/blade-1',
+                          'sys/chassis-1/blade-1/adaptor-1',
+                          'sys/chassis-1/blade-2'],
+                         sorted(o.dn for o in
+                                index.startswith('sys/chassis-1/blade-')))
+        self.assertEqual([], index.find('computeBlade', 'sys/chassis-3'))
+
+    def test_remove(self):
+        index = self._index()
+        index.remove('sys/chassis-1/blade-1')
+        self.assertNotIn('sys/chassis-1/blade-1', index)
+        self.assertEqual(2, len(index.find('computeBlade')))
+        self.assertEqual('sys/chassis-1',
+                         index.parent('sys/chassis-1/blade-1/adaptor-1').dn)
+
+
+class TestDn(MyBaseTest):
+
+    def test_components(self):
+        dn = pyucsm.Dn('sys/chassis-1/blade-2/adaptor-1/ip-[10.0.0.1/24]')
+        self.assertEqual(('sys', 'chassis-1', 'blade-2', 'adaptor-1',
+                          'ip-[10.0.0.1/24]'), dn.rns)
+        self.assertEqual('ip-[10.0.0.1/24]', dn.rn)
+        self.assertEqual('sys/chassis-1/blade-2/adaptor-1', dn.parent)
+        self.assertEqual(5, dn.depth)
+        self.assertIs(dn, pyucsm.Dn(str(dn)))
+        self.assertIs(dn.parent, pyucsm.Dn('sys/chassis-1/blade-2/adaptor-1'))
+        self.assertEqual('sys/chassis-1/blade-2',
+                         pyucsm.Dn('/sys/chassis-1//blade-2/'))
+        self.assertIsNone(pyucsm.Dn('sys').parent)
+        self.assertEqual('sys/chassis-1', pyucsm.Dn('sys').child('chassis-1'))
+
+    def test_ancestry(self):
+        dn = pyucsm.Dn('sys/chassis-1/blade-2')
+        self.assertTrue(pyucsm.Dn('sys/chassis-1').is_ancestor_of(dn))
+        self.assertFalse(pyucsm.Dn('sys/chassis-1/blade-2').is_ancestor_of(dn))
+        self.assertFalse(pyucsm.Dn('sys/chassis-1/blade').is_ancestor_of(dn))
+        self.assertTrue(dn.in_subtree('sys/chassis-1/blade-2'))
+        self.assertTrue(dn.in_subtree('sys'))
+        self.assertEqual(['sys/chassis-1', 'sys'], dn.ancestors())
+
+    def test_objects_use_dn(self):
+        obj = pyucsm.UcsmObject(minidom.parseString(
+            '<equipmentChassis dn="sys/chassis-1">'
+            '<computeBlade rn="blade-1"/></equipmentChassis>').firstChild)
+        self.assertIsInstance(obj.dn, pyucsm.Dn)
+        self.assertIs(obj.dn, obj.children[0].dn.parent)
+        obj.dn = 'sys/chassis-2'
+        self.assertIsInstance(obj.dn, pyucsm.Dn)
+
+
+class TestCopyOnWrite(MyBaseTest):
+
+    def _tree(self):
+        return pyucsm.UcsmObject(minidom.parseString(
+            '<lsServer dn="org-root/ls-tmpl" name="tmpl">'
+            '<vnicEther rn="ether-eth0" mtu="1500">'
+            '<vnicEtherIf rn="if-default" name="default"/>'
+            '</vnicEther>'
+            '<vnicEther rn="ether-eth1" mtu="1500"/>'
+            '</lsServer>').firstChild)
+
+    def test_shares_until_write(self):
+        src = self._tree()
+        cpy = src.copy()
+        self.assertEqual('tmpl', cpy.name)
+        self.assertIs(src.attributes, cpy._attrs())
+        self.assertIs(src.children, cpy._kids())
+        self.assertEqual(src, cpy)
+        self.assertEqual(src.tree_hash(), cpy.tree_hash())
+        cpy.name = 'profile'
+        self.assertEqual('tmpl', src.name)
+        self.assertIs(src.children, cpy._kids())
+
+    def test_write_to_copy(self):
+        src = self._tree()
+        cpy = src.copy()
+        cpy.children[0].children[0].name = 'changed'
+        cpy.children[1].children.append(pyucsm.UcsmObject('vnicEtherIf'))
+        self.assertEqual('default', src.children[0].children[0].name)
+        self.assertEqual(0, len(src.children[1].children))
+        self.assertEqual('org-root/ls-tmpl/ether-eth0/if-default',
+                         cpy.children[0].children[0].dn)
+        self.assertIs(cpy.children[0], cpy.children[0].children[0].parent)
+        self.assertNotEqual(src.tree_hash(), cpy.tree_hash())
+
+    def test_write_to_source(self):
+        src = self._tree()
+        initial = src.tree_hash()
+        cpy = src.copy()
+        second = cpy.copy()
+        src.children[0].children[0].name = 'changed'
+        src.children[1].mtu = '9000'
+        del src.children[0]
+        for obj in (cpy, second):
+            self.assertEqual(2, len(obj.children))
+            self.assertEqual('default', obj.children[0].children[0].name)
+            self.assertEqual('1500', obj.children[1].mtu)
+            self.assertEqual(initial, obj.tree_hash())
+        self.assertEqual(cpy, second)
+
+    def test_reads_do_not_copy(self):
+        src = self._tree()
+        cpy = src.copy()
+        self.assertTrue('dn' in cpy.attributes)
+        self.assertEqual('tmpl', cpy.attributes.get('name'))
+        self.assertEqual(2, len(cpy.children))
+        self.assertEqual(['vnicEther', 'vnicEther'],
+                         [c.ucs_class for c in cpy.find_children()])
+        self.assertEqual('default', cpy.children[0].children[0].name)
+        self.assertEqual(dict(src.attributes), dict(cpy.attributes))
+        pyucsm.UcsmIndex().add(cpy)
+        for obj in (cpy, cpy.children[0], cpy.children[0].children[0]):
+            self.assertRaises(AttributeError, pyucsm._ATTRIBUTES_SLOT.__get__,
+                              obj)
+            self.assertRaises(AttributeError, pyucsm._CHILDREN_SLOT.__get__,
+                              obj)
+        child = cpy.children[0]
+        child.mtu = '9000'
+        self.assertIs(child, cpy.children[0])
+        self.assertEqual('9000', cpy.children[0].mtu)
+        self.assertEqual('1500', src.children[0].mtu)
+        self.assertRaises(AttributeError, pyucsm._ATTRIBUTES_SLOT.__get__,
+                          cpy)
+
+    def test_many_copies(self):
+        src = self._tree()
+        copies = [src.copy() for _ in range(50)]
+        children = [cpy.children[0] for cpy in copies]
+        clones = src.children[0]._cow_clones
+        self.assertEqual(sorted(clones), sorted(id(cpy) for cpy in copies))
+        for cpy, child in zip(copies, children):
+            self.assertIs(child, cpy.children[0])
+        parent = copies[0]
+        first, second = src.children[1].copy(parent), \
+            src.children[1].copy(parent)
+        src.children[1].mtu = '9000'
+        self.assertEqual('1500', first.mtu)
+        self.assertEqual('1500', second.mtu)
+        del copies, children, cpy, child, parent, first, second
+        gc.collect()
+        self.assertEqual({}, clones)
+
+
+
+class TestMoClasses(MyBaseTest):
+
+    def tearDown(self):
+        pyucsm.MO_CLASSES.clear()
+
+    def test_typed_attributes(self):
+        classes = pyucsm.define_mo_classes({
+            'computeBlade': {'totalMemory': 'uint32', 'numOfCpus': 'uint8',
+                             'memorySpeed': 'uint32', 'serial': 'string',
+                             'lowVoltageMemory': 'boolean'}})
+        c = CannedConnection("""<configResolveClass response="yes">
+<outConfigs>
+  <computeBlade dn="sys/chassis-1/blade-1" totalMemory="8192" numOfCpus="2"
+   memorySpeed="not-applicable" serial="577" lowVoltageMemory="yes"/>
+</outConfigs></configResolveClass>""")
+        blade = c.resolve_class('computeBlade')[0]
+        self.assertIsInstance(blade, classes['computeBlade'])
+        self.assertEqual('ComputeBlade', type(blade).__name__)
+        self.assertEqual(8192, blade.totalMemory)
+        self.assertIs(blade.totalMemory, blade.totalMemory)
+        self.assertEqual(2, blade.numOfCpus)
+        self.assertEqual('not-applicable', blade.memorySpeed)
+        self.assertEqual('577', blade.serial)
+        self.assertTrue(blade.lowVoltageMemory)
+        self.assertEqual('8192', blade.attributes['totalMemory'])
+        blade.totalMemory = '16384'
+        self.assertEqual(16384, blade.totalMemory)
+        self.assertEqual(16384, blade.copy().totalMemory)
+        self.assertIsInstance(pyucsm.UcsmObject('computeBlade'),
+                              classes['computeBlade'])
+        self.assertEqual(type(pyucsm.UcsmObject('orgOrg')), pyucsm.UcsmObject)
+
+    def test_strict(self):
+        pyucsm.define_mo_class('orgOrg', {'name': 'string'}, strict=True)
+        org = pyucsm.UcsmObject('orgOrg')
+        org.name = 'test'
+        org.dn = 'org-root/org-test'
+        with self.assertRaises(AttributeError):
+            org.nmae = 'typo'
+
+
+class FakeEventConnection(object):
+    sock = None
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+class StreamingConnection(pyucsm.UcsmConnection):
+    """Connection which streams given event frames and waits for abort."""
+
+    def __init__(self, *frames):
+        super(StreamingConnection, self).__init__('host', 80)
+        self.frames = frames
+        self.subscriptions = []
+        self.streaming = threading.Event()
+
+    def _iter_xml_events(self, filter=None, subscribed=None):
+        conn = FakeEventConnection()
+        self.subscriptions.append(conn)
+        self.streaming.wait(5)
+        if subscribed is not None:
+            subscribed()
+        for frame in self.frames:
+            yield minidom.parseString(frame), conn
+        conn.closed.wait(5)
+
+
+def event_frame(eid, class_id, dn, **attrs):
+    attrs = ''.join(' %s="%s"' % item for item in attrs.items())
+    return ('<configMoChangeEvent inEid="%d"><inConfig>'
+            '<%s dn="%s" status="modified"%s/>'
+            '</inConfig></configMoChangeEvent>' % (eid, class_id, dn, attrs))
+
+
+class TestWatch(MyBaseTest):
+
+    def _collect(self, conn, count, **kwargs):
+        got = []
+        done = threading.Event()
+
+        def callback(event_id, obj):
+            got.append((event_id, obj.dn))
+            if len(got) == count:
+                done.set()
+        watch = conn.watch(callback=callback, **kwargs)
+        return watch, got, done
+
+    def test_dispatch(self):
+        conn = StreamingConnection(
+            event_frame(1, 'computeBlade', 'sys/chassis-1/blade-1',
+                        operPower='on'),
+            event_frame(2, 'computeBlade', 'sys/chassis-2/blade-1',
+                        operPower='off'),
+            event_frame(3, 'faultInst', 'sys/chassis-1/fault-1'))
+        by_class = self._collect(conn, 2, class_ids='computeBlade')
+        by_prefix = self._collect(conn, 2, dn_prefix='sys/chassis-1')
+        power = pyucsm.UcsmAttribute('computeBlade', 'operPower')
+        filtered = self._collect(conn, 1, filter=power == 'off')
+        everything = self._collect(conn, 3)
+        conn.streaming.set()
+        for watch, got, done in (by_class, by_prefix, filtered, everything):
+            self.assertTrue(done.wait(5))
+        self.assertEqual(by_class[1], [(1, 'sys/chassis-1/blade-1'),
+                                       (2, 'sys/chassis-2/blade-1')])
+        self.assertEqual(by_prefix[1], [(1, 'sys/chassis-1/blade-1'),
+                                        (3, 'sys/chassis-1/fault-1')])
+        self.assertEqual(filtered[1], [(2, 'sys/chassis-2/blade-1')])
+        self.assertEqual(len(everything[1]), 3)
+        self.assertEqual(len(conn.subscriptions), 1)
+        for watch, got, done in (by_class, by_prefix, filtered):
+            watch.cancel()
+        self.assertFalse(conn.subscriptions[0].closed.is_set())
+        everything[0].cancel()
+        self.assertTrue(conn.subscriptions[0].closed.is_set())
+        conn._UcsmConnection__watch_dispatcher._thread.join(5)
+
+    def test_stopped_dispatcher(self):
+        conn = StreamingConnection()
+        callback = lambda event_id, obj: None
+        first = conn.watch(callback=callback)
+        dispatcher = first._dispatcher
+        first.cancel()
+        conn.streaming.set()
+        dispatcher._thread.join(5)
+        # watch() racing with last cancel must not restart stopped thread
+        self.assertEqual(dispatcher.add(None, None, None, callback), None)
+        second = conn.watch(callback=callback)
+        self.assertTrue(second._dispatcher is not dispatcher)
+        second.cancel()
+        second._dispatcher._thread.join(5)
+
+    def test_client_side_filter(self):
+        obj = pyucsm.UcsmObject('computeBlade')
+        obj.attributes.update({'slotId': '10', 'name': 'web-3',
+                               'flags': 'a,b'})
+        slot = pyucsm.UcsmAttribute('computeBlade', 'slotId')
+        name = pyucsm.UcsmAttribute('computeBlade', 'name')
+        flags = pyucsm.UcsmAttribute('computeBlade', 'flags')
+        self.assertTrue((slot > 9).matches(obj))
+        self.assertFalse((slot < '9').matches(obj))
+        self.assertTrue(name.wildcard_match('^web-').matches(obj))
+        self.assertTrue((flags.any_bit('b,c') & ~(flags.all_bit('b,c')))
+                        .matches(obj))
+        self.assertFalse((pyucsm.UcsmAttribute('computeBlade', 'x') == 1)
+                         .matches(obj))
+
+
+def change(dn, status, **attrs):
+    obj = pyucsm.UcsmObject('computeBlade')
+    obj.attributes.update(attrs, dn=dn, status=status)
+    return obj
+
+
+class TestCoalesceEvents(MyBaseTest):
+
+    def test_merge(self):
+        events = [(1, change('a', 'created', x='1')),
+                  (2, change('b', 'modified', y='1')),
+                  (3, change('a', 'modified', x='2', z='1')),
+                  (4, change('c', 'created')),
+                  (5, change('d', 'modified')),
+                  (6, change('c', 'deleted')),
+                  (7, change('d', 'deleted')),
+                  (8, change('b', 'modified', y='2'))]
+        res = list(pyucsm.coalesce_events(iter(events), window=10))
+        self.assertEqual([(eid, obj.dn, obj.status) for eid, obj in res],
+                         [(3, 'a', 'created'), (8, 'b', 'modified'),
+                          (7, 'd', 'deleted')])
+        self.assertEqual(res[0][1].attributes['x'], '2')
+        self.assertEqual(res[0][1].attributes['z'], '1')
+        self.assertEqual(events[0][1].attributes['x'], '1')
+
+    def test_max_delay(self):
+        def slow_events():
+            for eid in xrange(30):
+                time.sleep(0.01)
+                yield eid, change('a', 'modified', n=str(eid))
+        res = list(pyucsm.coalesce_events(slow_events(), window=1,
+                                          max_delay=0.1))
+        self.assertTrue(1 < len(res) < 30)
+        self.assertEqual(res[-1][1].attributes['n'], '29')
+
+    def test_error(self):
+        def failing():
+            yield 1, change('a', 'modified')
+            raise pyucsm.UcsmFatalError('stream closed')
+        res = pyucsm.coalesce_events(failing())
+        self.assertEqual(next(res)[0], 1)
+        self.assertRaises(pyucsm.UcsmFatalError, next, res)
+
+    def test_stop(self):
+        state = {'read': 0, 'closed': threading.Event()}
+
+        def endless():
+            try:
+                while True:
+                    state['read'] += 1
+                    yield state['read'], change(str(state['read']),
+                                                'modified')
+            finally:
+                state['closed'].set()
+        res = pyucsm.coalesce_events(endless(), window=0, max_delay=0,
+                                     queue_size=10)
+        self.assertEqual(next(res)[0], 1)
+        time.sleep(0.1)
+        self.assertTrue(state['read'] <= 13)
+        res.close()
+        self.assertTrue(state['closed'].wait(1))
+
+
+class SlowConnection(pyucsm.UcsmConnection):
+    """Connection which holds requests until released."""
+
+    def __init__(self, reply, **kwargs):
+        super(SlowConnection, self).__init__('host', 80, **kwargs)
+        self.reply = reply
+        self.release = threading.Event()
+        self.requests = []
+
+    def _submit_request(self, request_data, headers=None, compact=False):
+        self.requests.append(request_data)
+        self.release.wait(5)
+        return minidom.parseString(self.reply), None
+
+
+class TestSingleflight(MyBaseTest):
+
+    def _concurrent(self, conn, call, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(call()))
+                   for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        conn.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_shared_reads(self):
+        conn = SlowConnection(HIERARCHY_REPLY)
+        results = self._concurrent(
+            conn, lambda: conn.resolve_class('equipmentChassis'))
+        self.assertEqual(len(conn.requests), 1)
+        self.assertEqual([len(res) for res in results], [2] * 5)
+        self.assertEqual(len(set(id(res[0]) for res in results)), 5)
+        conn.resolve_class('equipmentChassis')
+        self.assertEqual(len(conn.requests), 2)
+
+    def test_writes_and_disabled(self):
+        conn = SlowConnection('<configConfMo response="yes"><outConfig/>'
+                              '</configConfMo>')
+        config = pyucsm.UcsmObject('lsServer')
+        self._concurrent(conn, lambda: conn.conf_mo(config, dn='org-root'))
+        self.assertEqual(len(conn.requests), 5)
+        conn = SlowConnection(HIERARCHY_REPLY, singleflight=False)
+        self._concurrent(conn, lambda: conn.resolve_class('equipmentChassis'))
+        self.assertEqual(len(conn.requests), 5)
+
+
+class FaultsConnection(pyucsm.UcsmConnection):
+    """Connection serving faultInst objects, evaluating filters locally."""
+
+    def __init__(self, count):
+        super(FaultsConnection, self).__init__('host', 80)
+        self.faults = []
+        for i in range(count):
+            fault = pyucsm.UcsmObject('faultInst')
+            fault.attributes.update(id=str(i), dn='sys/chassis-%d/fault-%d' %
+                                    (i % 3, i))
+            self.faults.append(fault)
+        self.requests = []
+        self.reply_sizes = []
+
+    def _submit_request(self, request_data, headers=None, compact=False):
+        query = minidom.parseString(request_data).documentElement
+        self.requests.append(query)
+        filter = pyucsm.parse_filter(
+            (query.getElementsByTagName('inFilter') or [None])[0])
+        if query.tagName == 'configFindDnsByClassId':
+            reply = '<outDns>%s</outDns>' % ''.join(
+                '<dn value="%s"/>' % fault.dn for fault in self.faults
+                if filter.matches(fault))
+        else:
+            if query.tagName == 'configResolveDns':
+                dns = set(dn.getAttribute('value') for dn in
+                          query.getElementsByTagName('dn'))
+                found = [f for f in self.faults if f.dn in dns]
+            else:
+                found = [f for f in self.faults if filter.matches(f)]
+            reply = '<outConfigs>%s</outConfigs><outUnresolved/>' % ''.join(
+                f.xml_node().toxml() for f in found)
+        reply = '<%s response="yes">%s</%s>' % (query.tagName, reply,
+                                                query.tagName)
+        self._thread_state.reply_size = len(reply)
+        self.reply_sizes.append(len(reply))
+        return minidom.parseString(reply), None
+
+
+class TestPartitionedQuery(MyBaseTest):
+
+    def _ids(self, objects):
+        return [int(obj.id) for obj in objects]
+
+    def test_dns(self):
+        conn = FaultsConnection(50)
+        res = list(conn.iter_class_partitioned('faultInst', chunk_size=7))
+        self.assertEqual(self._ids(res), range(50))
+        self.assertEqual(len(conn.requests), 1 + 8)
+
+    def test_dns_budget(self):
+        conn = FaultsConnection(200)
+        res = list(conn.iter_class_partitioned('faultInst', chunk_size=100,
+                                               max_bytes=2000,
+                                               parallelism=1))
+        self.assertEqual(self._ids(res), range(200))
+        self.assertTrue(max(conn.reply_sizes[2:]) <= 2000)
+
+    def test_range(self):
+        conn = FaultsConnection(50)
+        slot = pyucsm.UcsmAttribute('faultInst', 'dn')
+        res = list(conn.iter_class_partitioned(
+            'faultInst', filter=slot.wildcard_match('chassis-1'),
+            strategy='range', partitions=(0, 50), chunk_size=10))
+        self.assertEqual(self._ids(res), range(1, 50, 3))
+        self.assertEqual(len(conn.requests), 5)
+
+    def test_scope(self):
+        conn = FaultsConnection(30)
+        res = list(conn.iter_class_partitioned(
+            'faultInst', strategy='scope',
+            partitions=['sys/chassis-2', 'sys/chassis-0']))
+        self.assertEqual(self._ids(res), range(2, 30, 3) + range(0, 30, 3))
+        res = list(conn.iter_class_partitioned(
+            'faultInst', strategy='scope',
+            partitions=['sys/chassis-2/fault-2']))
+        self.assertEqual(self._ids(res), [2])
+
+    def test_missing_partitions(self):
+        conn = FaultsConnection(3)
+        for strategy in ('scope', 'range'):
+            res = conn.iter_class_partitioned('faultInst', strategy=strategy)
+            self.assertRaises(pyucsm.UcsmError, list, res)
+        res = conn.iter_class_partitioned('faultInst', strategy='range',
+                                          partitions=[1, 2, 3])
+        self.assertRaises(pyucsm.UcsmError, list, res)
+        self.assertEqual(conn.requests, [])
+
+    def test_ordered_iteration(self):
+        def slow(i):
+            time.sleep(0.01 * (5 - i % 5))
+            if i == 7:
+                raise pyucsm.UcsmFatalError('failed')
+            return i
+        res = pyucsm._iter_in_threads(slow, xrange(10), 3)
+        self.assertEqual([next(res) for _ in range(7)], range(7))
+        self.assertRaises(pyucsm.UcsmFatalError, next, res)
+
+
+class EchoConfConnection(pyucsm.UcsmConnection):
+    """Connection which confirms configConfMos requests with sent configs."""
+
+    def __init__(self):
+        super(EchoConfConnection, self).__init__('host', 80)
+
+    def _submit_request(self, request_data, headers=None, compact=False):
+        query = minidom.parseString(request_data).documentElement
+        configs = query.getElementsByTagName('inConfigs')[0]
+        return minidom.parseString(
+            '<configConfMos response="yes"><outConfigs>%s</outConfigs>'
+            '</configConfMos>' % ''.join(
+                pair.toxml() for pair in configs.childNodes)), None
+
+
+class TestScheduler(MyBaseTest):
+
+    def _acquire_in_thread(self, scheduler, priority, order):
+        def run():
+            scheduler.acquire(priority)
+            order.append(priority)
+            scheduler.release()
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.05)
+        return thread
+
+    def test_priorities(self):
+        scheduler = pyucsm.UcsmScheduler(max_concurrent=1)
+        scheduler.acquire()
+        order = []
+        threads = [self._acquire_in_thread(scheduler, priority, order)
+                   for priority in ('bulk', 'background', 'bulk',
+                                    'interactive')]
+        self.assertEqual(scheduler.stats()['bulk']['queued'], 2)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['interactive', 'background', 'bulk',
+                                 'bulk'])
+
+    def test_rate(self):
+        scheduler = pyucsm.UcsmScheduler(rate=50, burst=1)
+        started = time.time()
+        for _ in range(6):
+            scheduler.acquire()
+            scheduler.release()
+        self.assertTrue(time.time() - started >= 0.09)
+
+    def test_queue_timeout(self):
+        scheduler = pyucsm.UcsmScheduler(max_concurrent=1,
+                                         queue_timeout={'bulk': 0.05})
+        scheduler.acquire()
+        self.assertRaises(pyucsm.UcsmQueueTimeoutError, scheduler.acquire,
+                          'bulk')
+        scheduler.release()
+        stats = scheduler.stats()
+        self.assertEqual((stats['bulk']['rejected'], stats['bulk']['queued'],
+                          stats['interactive']['admitted']), (1, 0, 1))
+
+    def test_connection_priority(self):
+        conn = CannedConnection(HIERARCHY_REPLY)
+        conn.scheduler = pyucsm.UcsmScheduler()
+        with conn.priority(pyucsm.UcsmScheduler.BULK):
+            conn.resolve_class('equipmentChassis')
+            self.assertEqual(conn.current_priority, 'bulk')
+        self.assertEqual(conn.current_priority, 'interactive')
+        self.assertEqual(conn.scheduler.stats()['bulk']['admitted'], 1)
+
+    def test_worker_priority(self):
+        conn = EchoConfConnection()
+        conn.scheduler = pyucsm.UcsmScheduler()
+        configs = []
+        for i in range(40):
+            config = pyucsm.UcsmObject('fabricVlan')
+            config.dn = 'fabric/lan/net-%d' % i
+            configs.append(config)
+        with conn.priority(pyucsm.UcsmScheduler.BULK):
+            res = conn.conf_mos_bulk(configs, batch_size=2, parallelism=4)
+        self.assertEqual(len(res.changed), 40)
+        stats = conn.scheduler.stats()
+        self.assertEqual(stats['bulk']['admitted'], 20)
+        self.assertEqual(stats['interactive']['admitted'], 0)
+
+
+class LocalUcsmHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append(body)
+        reply = self.server.respond(self, body)
+        if reply is None:
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalUcsm(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Stand-in UCSM HTTP server, replies are made by respond(handler,
+body), which returns reply body or None when it answered itself."""
+    daemon_threads = True
+
+    def __init__(self, respond):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           LocalUcsmHandler)
+        self.respond = respond
+        self.requests = []
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def connection(self, **kwargs):
+        return pyucsm.UcsmConnection('127.0.0.1', self.server_address[1],
+                                     **kwargs)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestDeadlines(MyBaseTest):
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_timeout(self):
+        def respond(handler, body):
+            time.sleep(1)
+            return HIERARCHY_REPLY
+        self.server = LocalUcsm(respond)
+        conn = self.server.connection(call_timeout=0.2)
+        started = time.time()
+        self.assertRaises(pyucsm.UcsmTimeoutError, conn.resolve_class,
+                          'equipmentChassis')
+        self.assertTrue(time.time() - started < 0.5)
+        conn = self.server.connection()
+        with conn.deadline(0.2):
+            self.assertRaises(pyucsm.UcsmTimeoutError, conn.resolve_class,
+                              'equipmentChassis')
+
+    def test_cancel(self):
+        def respond(handler, body):
+            time.sleep(1)
+            return HIERARCHY_REPLY
+        self.server = LocalUcsm(respond)
+        conn = self.server.connection()
+        token = pyucsm.UcsmCancellationToken()
+        threading.Timer(0.1, token.cancel).start()
+        started = time.time()
+        with conn.deadline(token=token):
+            self.assertRaises(pyucsm.UcsmCancelledError, conn.resolve_class,
+                              'equipmentChassis')
+            self.assertRaises(pyucsm.UcsmCancelledError, conn.resolve_class,
+                              'equipmentChassis')
+        self.assertTrue(time.time() - started < 0.5)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_retry_reads_only(self):
+        def respond(handler, body):
+            if len(self.server.requests) % 2:
+                handler.wfile.write('garbage')
+                return None
+            return HIERARCHY_REPLY
+        self.server = LocalUcsm(respond)
+        conn = self.server.connection(
+            retry_policy=pyucsm.UcsmRetryPolicy(backoff=0.01))
+        self.assertEqual(len(conn.resolve_class('equipmentChassis')), 2)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertRaises(pyucsm.UcsmFatalError, conn.conf_mo,
+                          pyucsm.UcsmObject('lsServer'), dn='org-root')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_shared_request_cancel(self):
+        def respond(handler, body):
+            time.sleep(0.3)
+            return HIERARCHY_REPLY
+        self.server = LocalUcsm(respond)
+        conn = self.server.connection()
+        token = pyucsm.UcsmCancellationToken()
+        results = {}
+
+        def resolve(name, token=None):
+            try:
+                with conn.deadline(token=token):
+                    results[name] = conn.resolve_class('equipmentChassis')
+            except pyucsm.UcsmError, e:
+                results[name] = e
+        leader = threading.Thread(target=resolve, args=('leader', token))
+        leader.start()
+        while not self.server.requests:
+            time.sleep(0.01)
+        follower = threading.Thread(target=resolve, args=('follower',))
+        follower.start()
+        time.sleep(0.05)
+        token.cancel()
+        leader.join()
+        follower.join()
+        self.assertIsInstance(results['leader'], pyucsm.UcsmCancelledError)
+        self.assertEqual(len(results['follower']), 2)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_worker_deadline(self):
+        def respond(handler, body):
+            time.sleep(1)
+            return HIERARCHY_REPLY
+        self.server = LocalUcsm(respond)
+        conn = self.server.connection(retry_policy=None)
+        started = time.time()
+        with conn.deadline(0.2):
+            collected, failed = pyucsm.collect_classes(
+                [conn], ['equipmentChassis', 'computeBlade'])
+        self.assertTrue(time.time() - started < 0.6)
+        self.assertEqual(collected, {})
+        self.assertTrue(all(isinstance(e, pyucsm.UcsmTimeoutError)
+                            for e in failed.values()))
+        token = pyucsm.UcsmCancellationToken()
+        token.cancel()
+        with conn.deadline(token=token):
+            collected, failed = pyucsm.collect_classes([conn],
+                                                       ['equipmentChassis'])
+        self.assertIsInstance(failed[conn, 'equipmentChassis'],
+                              pyucsm.UcsmCancelledError)
+
+    def test_refresh_wait(self):
+        self.server = LocalUcsm(lambda handler, body: HIERARCHY_REPLY)
+        conn = self.server.connection()
+        conn.refreshing = True
+        conn.refresh_period = 0.1
+        self.assertRaises(pyucsm.UcsmTimeoutError, conn.resolve_class,
+                          'equipmentChassis')
+        conn.refreshing = False
+        self.assertEqual(len(conn.resolve_class('equipmentChassis')), 2)
+
+
+
+class TestFailover(MyBaseTest):
+
+    def setUp(self):
+        self.servers = [LocalUcsm(self._responder(name))
+                        for name in ('a', 'b')]
+
+    def tearDown(self):
+        for server in self.servers:
+            if server.respond is not None:
+                server.close()
+
+    def _responder(self, name):
+        def respond(handler, body):
+            if body.startswith('<aaaLogin'):
+                return ('<aaaLogin response="yes" outCookie="cookie-%s" '
+                        'outRefreshPeriod="600" outPriv="admin" '
+                        'outVersion="2.0" outSessionId="session-%s"/>'
+                        % (name, name))
+            return HIERARCHY_REPLY
+        return respond
+
+    def _connection(self):
+        endpoint = '127.0.0.1:%s' % self.servers[1].server_address[1]
+        conn = self.servers[0].connection(endpoints=[endpoint],
+                                          probe_interval=0)
+        conn.login('admin', 'password', autorefresh=False)
+        return conn
+
+    def _kill(self, server):
+        server.close()
+        server.respond = None
+
+    def test_read_failover(self):
+        conn = self._connection()
+        self.assertEqual(conn.session_id, 'session-a')
+        self._kill(self.servers[0])
+        self.assertEqual(len(conn.resolve_class('equipmentChassis')), 2)
+        self.assertEqual(conn.endpoint, self.servers[1].server_address)
+        self.assertEqual(conn.session_id, 'session-b')
+        self.assertTrue(self.servers[1].requests[-1].find(
+            'cookie="cookie-b"') > 0)
+        self.assertFalse(conn.endpoint_health[
+            self.servers[0].server_address])
+
+    def test_write_failover(self):
+        conn = self._connection()
+        self._kill(self.servers[0])
+        self.assertRaises(pyucsm.UcsmFatalError, conn.conf_mo,
+                          pyucsm.UcsmObject('lsServer'), dn='org-root')
+        self.assertEqual(conn.session_id, 'session-b')
+        self.assertEqual(len(self.servers[1].requests), 1)
+
+    def test_login_failover(self):
+        self._kill(self.servers[0])
+        conn = self._connection()
+        self.assertEqual(conn.session_id, 'session-b')
+
+    def test_all_down(self):
+        conn = self._connection()
+        conn.call_timeout = 5
+        conn.retry_policy = None
+        for server in self.servers:
+            self._kill(server)
+        started = time.time()
+        self.assertRaises(pyucsm.UcsmFatalError, conn.resolve_class,
+                          'equipmentChassis')
+        conn._probe_endpoints()
+        self.assertTrue(time.time() - started < 5)
+        self.assertEqual(conn.endpoint, self.servers[0].server_address)
+        self.assertFalse(any(conn.endpoint_health.values()))
+
+    def test_probe(self):
+        conn = self._connection()
+        conn._probe_endpoints()
+        self.assertEqual(conn.endpoint, self.servers[0].server_address)
+        self._kill(self.servers[0])
+        conn._probe_endpoints()
+        self.assertEqual(conn.endpoint, self.servers[1].server_address)
+        self.assertEqual(conn.session_id, 'session-b')
+
+
+class TestReplyEncoding(MyBaseTest):
+
+    def setUp(self):
+        self.server = LocalUcsm(self._respond)
+        self.encoding = None
+
+    def tearDown(self):
+        self.server.close()
+
+    def _respond(self, handler, body):
+        self.accepted = handler.headers.get('Accept-Encoding')
+        reply = HIERARCHY_REPLY
+        if self.encoding == 'gzip':
+            buf = StringIO.StringIO()
+            gzip_file = gzip.GzipFile(fileobj=buf, mode='wb')
+            gzip_file.write(reply)
+            gzip_file.close()
+            reply = buf.getvalue()
+        elif self.encoding == 'deflate':
+            reply = zlib.compress(reply)
+        handler.send_response(200)
+        if self.encoding:
+            handler.send_header('Content-Encoding',
+                                self.encoding.replace('broken', 'gzip'))
+        handler.send_header('Content-Length', str(len(reply)))
+        handler.end_headers()
+        handler.wfile.write(reply)
+
+    def _check(self, conn):
+        self.assertEqual([o.dn for o in conn.resolve_class('equipmentChassis')],
+                         ['sys/chassis-1', 'sys/chassis-2'])
+        self.assertEqual(conn.last_reply_size, len(HIERARCHY_REPLY))
+
+    def test_encodings(self):
+        conn = self.server.connection()
+        for encoding in (None, 'gzip', 'deflate'):
+            self.encoding = encoding
+            self._check(conn)
+        self.assertEqual(self.accepted, 'gzip, deflate')
+        conn = self.server.connection(compression=False)
+        self._check(conn)
+        self.assertEqual(self.accepted, 'identity')
+
+    def test_spill(self):
+        conn = self.server.connection(spill_threshold=100)
+        for encoding in (None, 'gzip'):
+            self.encoding = encoding
+            self._check(conn)
+
+    def test_joins_once(self):
+        body = pyucsm._ReplyBody(None, None)
+        for chunk in ('<a', ' b="1"', '/>'):
+            body.write(chunk)
+        body.finish()
+        data = body.data()
+        self.assertEqual(data, '<a b="1"/>')
+        self.assertTrue(body.data() is data)
+        self.assertEqual(body.parse().documentElement.getAttribute('b'), '1')
+
+    def test_broken_encoding(self):
+        self.encoding = 'broken'
+        conn = self.server.connection()
+        self.assertRaises(pyucsm.UcsmFatalError, conn.resolve_class,
+                          'equipmentChassis')
+
+
+class TestParsePool(MyBaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = multiprocessing.Pool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.terminate()
+        cls.pool.join()
+
+    def setUp(self):
+        self.replies = {}
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def _server(self, reply=HIERARCHY_REPLY):
+        server = LocalUcsm(lambda handler, body: reply)
+        self.servers.append(server)
+        return server
+
+    def test_compact_objects(self):
+        reply = minidom.parseString(HIERARCHY_REPLY)
+        expected = pyucsm.UcsmConnection('localhost')._get_objects_from_reply(
+            reply)
+        compact = pyucsm._CompactReply(self.pool.apply(
+            pyucsm._compact_xml, (HIERARCHY_REPLY,)))
+        index = pyucsm.UcsmIndex()
+        objects = compact.objects('outConfigs', index)
+        self.assertEqual(objects, expected)
+        self.assertEqual(objects[0].children[0].dn, 'sys/chassis-1/blade-1')
+        self.assertTrue(isinstance(objects[0].dn, pyucsm.Dn))
+        self.assertEqual(index.get('sys/chassis-1/blade-1/adaptor-1').ucs_class,
+                         'adaptorUnit')
+
+    def test_lazy_objects(self):
+        compact = pyucsm._CompactReply(self.pool.apply(
+            pyucsm._compact_xml, (HIERARCHY_REPLY,)))
+        self.assertTrue(isinstance(compact.objects('outConfigs'), list))
+        objects = compact.objects('outConfigs', lazy=True)
+        self.assertEqual(len(objects), 2)
+        self.assertEqual(objects._objects, [None, None])
+        second = objects[-1]
+        self.assertEqual(second.dn, 'sys/chassis-2')
+        self.assertTrue(objects[1] is second)
+        self.assertTrue(objects._objects[0] is None)
+        self.assertEqual([o.dn for o in objects[:1]], ['sys/chassis-1'])
+        self.assertEqual(objects, list(objects))
+
+    def test_connection(self):
+        server = self._server()
+        conn = server.connection(parse_pool=self.pool, parse_pool_threshold=0)
+        objects = conn.resolve_class('equipmentChassis', hierarchy=True)
+        self.assertEqual([o.dn for o in objects],
+                         ['sys/chassis-1', 'sys/chassis-2'])
+        self.assertTrue(isinstance(objects, list))
+        self.assertEqual(len(objects[0].children), 2)
+        conn = server.connection(parse_pool=self.pool, parse_pool_threshold=0,
+                                 lazy_objects=True)
+        objects = conn.resolve_class('equipmentChassis', hierarchy=True)
+        self.assertTrue(isinstance(objects, pyucsm._CompactObjects))
+        self.assertEqual(objects[1].dn, 'sys/chassis-2')
+        server = self._server('<configResolveClass errorCode="552" '
+                              'errorDescr="denied"/>')
+        conn = server.connection(parse_pool=self.pool, parse_pool_threshold=0)
+        self.assertRaises(pyucsm.UcsmResponseError, conn.resolve_class,
+                          'equipmentChassis')
+
+    def test_deadline(self):
+        pool = multiprocessing.Pool(1)
+        try:
+            pool.apply_async(time.sleep, (2,))
+            conn = pyucsm.UcsmConnection('localhost', parse_pool=pool)
+            started = time.time()
+            with conn.deadline(0.2):
+                self.assertRaises(pyucsm.UcsmTimeoutError,
+                                  conn._parse_in_pool, HIERARCHY_REPLY)
+            self.assertTrue(time.time() - started < 1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def test_collect_classes(self):
+        good = self._server().connection(parse_pool=self.pool,
+                                         parse_pool_threshold=0)
+        bad = self._server('garbage').connection(parse_pool=self.pool,
+                                                 retry_policy=None)
+        collected, failed = pyucsm.collect_classes(
+            [good, bad], ['equipmentChassis', 'computeBlade'])
+        self.assertEqual(sorted(collected),
+                         [(good, 'computeBlade'), (good, 'equipmentChassis')])
+        self.assertEqual(len(collected[good, 'computeBlade']), 2)
+        self.assertEqual(sorted(failed),
+                         [(bad, 'computeBlade'), (bad, 'equipmentChassis')])
+
 if __name__ == '__main__':
     unittest.main()
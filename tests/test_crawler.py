@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import sys
+import os
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__),
+                                                 os.path.pardir)))
+
+import json
+import tempfile
+import threading
+import unittest
+
+import pyucsm
+import ucsmcrawler
+
+
+def build_tree():
+    index = pyucsm.UcsmIndex()
+    top = pyucsm.UcsmObject('topSystem')
+    top.dn = 'sys'
+    index.add(top)
+    for c in range(1, 4):
+        chassis = pyucsm.UcsmObject('equipmentChassis')
+        chassis.dn = 'sys/chassis-%d' % c
+        index.add(chassis)
+        for b in range(1, 5):
+            blade = pyucsm.UcsmObject('computeBlade')
+            blade.dn = '%s/blade-%d' % (chassis.dn, b)
+            index.add(blade)
+            adaptor = pyucsm.UcsmObject('adaptorUnit')
+            adaptor.dn = '%s/adaptor-1' % blade.dn
+            index.add(adaptor)
+    return index
+
+
+class TreeConnection(pyucsm.UcsmConnection):
+    """Connection serving objects of index."""
+
+    def __init__(self, index):
+        super(TreeConnection, self).__init__('host', 80)
+        self.tree = index
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _copy(self, obj, hierarchy):
+        res = pyucsm.UcsmObject(obj.ucs_class)
+        res.attributes.update(obj.attributes)
+        if hierarchy:
+            for child in self.tree.children(obj.dn):
+                res.children.append(self._copy(child, True))
+        return res
+
+    def resolve_dn(self, dn, hierarchy=False, index=None):
+        obj = self.tree.get(dn)
+        return obj and self._copy(obj, hierarchy)
+
+    def resolve_children(self, class_id='', dn='', hierarchy=False,
+                         filter=None, index=None):
+        with self.lock:
+            self.calls.append((dn, hierarchy))
+        return [self._copy(child, hierarchy)
+                for child in self.tree.children(dn)]
+
+
+class TestCrawler(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = build_tree()
+        self.conn = TreeConnection(self.tree)
+
+    def test_full_crawl(self):
+        crawler = ucsmcrawler.UcsmCrawler(self.conn, roots=('sys',))
+        crawler.run()
+        self.assertEqual(sorted(obj.dn for obj in crawler.index.find()),
+                         sorted(obj.dn for obj in self.tree.find()))
+        self.assertEqual(sorted(self.conn.calls), sorted(
+            [('sys', False)] +
+            [('sys/chassis-%d' % c, False) for c in range(1, 4)] +
+            [('sys/chassis-%d/blade-%d' % (c, b), True)
+             for c in range(1, 4) for b in range(1, 5)]))
+        self.assertEqual(crawler.estimates, {'computeBlade': 1})
+
+    def test_adaptive_split(self):
+        crawler = ucsmcrawler.UcsmCrawler(self.conn, roots=('sys',),
+                                          min_depth=1, max_objects=4,
+                                          workers=1)
+        crawler.estimates['equipmentChassis'] = 8
+        crawler.run()
+        self.assertEqual(len(crawler.index), len(self.tree))
+        self.assertFalse(('sys/chassis-1', True) in self.conn.calls)
+
+    def test_resume(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        with open(path, 'w') as f:
+            json.dump({'pending': [['sys/chassis-2', 'equipmentChassis',
+                                    1, 0]],
+                       'estimates': {}}, f)
+        seen = []
+
+        def sink(objects):
+            seen.append(os.path.exists(path))
+        crawler = ucsmcrawler.UcsmCrawler(self.conn, roots=('sys',),
+                                          sink=sink, checkpoint=path,
+                                          checkpoint_every=1)
+        crawler.run()
+        self.assertEqual(sorted(dn for dn, hierarchy in self.conn.calls),
+                         ['sys/chassis-2'] +
+                         ['sys/chassis-2/blade-%d' % b for b in range(1, 5)])
+        self.assertTrue(all(seen))
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
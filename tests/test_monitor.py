@@ -0,0 +1,306 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import sys
+import os
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__),
+                                                 os.path.pardir)))
+
+import unittest
+
+import pyucsm
+import ucsmmonitor
+
+
+def blade(dn, **attrs):
+    obj = pyucsm.UcsmObject('computeBlade')
+    obj.attributes.update(attrs, dn=dn)
+    return obj
+
+
+class PolledConnection(pyucsm.UcsmConnection):
+    """Connection which serves current list of objects."""
+
+    def __init__(self, *objects):
+        super(PolledConnection, self).__init__('host', 80)
+        self.objects = list(objects)
+        self.calls = []
+
+    def resolve_class(self, class_id, filter=None, hierarchy=False,
+                      index=None):
+        self.calls.append(('resolve_class', class_id))
+        return [obj.copy() for obj in self.objects]
+
+    def find_dns_by_class_id(self, class_id, filter=None):
+        self.calls.append(('find_dns_by_class_id', class_id))
+        return [obj.dn for obj in self.objects]
+
+    def resolve_dns(self, dns, hierarchy=False, index=None):
+        self.calls.append(('resolve_dns', len(dns)))
+        return [obj.copy() for obj in self.objects if obj.dn in dns], []
+
+
+class TestPoller(unittest.TestCase):
+
+    def _events(self, events):
+        return sorted((obj.status, obj.dn, sorted(obj.attributes.items()))
+                      for seq, obj in events)
+
+    def test_delta(self):
+        conn = PolledConnection(blade('b1', power='on'),
+                                blade('b2', power='on'))
+        poller = ucsmmonitor.UcsmPoller(conn, report_initial=False)
+        poller.add_class('computeBlade')
+        self.assertEqual(poller.poll('computeBlade'), [])
+        conn.objects = [blade('b1', power='off'), blade('b3', power='on')]
+        events = poller.poll('computeBlade')
+        self.assertEqual(self._events(events), [
+            ('created', 'b3', [('dn', 'b3'), ('power', 'on'),
+                               ('status', 'created')]),
+            ('deleted', 'b2', [('dn', 'b2'), ('status', 'deleted')]),
+            ('modified', 'b1', [('dn', 'b1'), ('power', 'off'),
+                                ('status', 'modified')])])
+        self.assertEqual(sorted(seq for seq, obj in events), [1, 2, 3])
+        self.assertEqual(poller.poll('computeBlade'), [])
+
+    def test_dns_chunks(self):
+        conn = PolledConnection(*[blade('b%d' % i) for i in xrange(5)])
+        poller = ucsmmonitor.UcsmPoller(conn, chunk_size=2)
+        poller.add_class('computeBlade', use_dns=True)
+        self.assertEqual(len(poller.poll('computeBlade')), 5)
+        self.assertEqual(conn.calls, [('find_dns_by_class_id', 'computeBlade'),
+                                      ('resolve_dns', 2), ('resolve_dns', 2),
+                                      ('resolve_dns', 1)])
+
+    def test_adaptive_interval(self):
+        conn = PolledConnection(blade('b1', n='0'))
+        poller = ucsmmonitor.UcsmPoller(conn, min_interval=1,
+                                        max_interval=4)
+        poller.add_class('computeBlade', interval=2)
+        polled = poller.classes['computeBlade']
+        poller._reschedule(polled, [], 0)
+        self.assertEqual(polled.interval, 3)
+        poller._reschedule(polled, [], 0)
+        self.assertEqual(polled.interval, 4)
+        poller._reschedule(polled, [None], 10)
+        self.assertEqual((polled.interval, polled.due), (2, 12))
+
+    def test_iter_events(self):
+        conn = PolledConnection(blade('b1'))
+        poller = ucsmmonitor.UcsmPoller(conn, min_interval=0.01)
+        poller.add_class('computeBlade')
+        events = poller.iter_events()
+        seq, obj = next(events)
+        self.assertEqual((obj.dn, obj.status), ('b1', 'created'))
+        conn.objects = []
+        seq, obj = next(events)
+        self.assertEqual((obj.dn, obj.status), ('b1', 'deleted'))
+        poller.stop()
+        self.assertEqual(list(events), [])
+
+
+class StatsConnection(pyucsm.UcsmConnection):
+    """Connection which serves rows of attribute values."""
+
+    def __init__(self):
+        super(StatsConnection, self).__init__('host', 80)
+        self.rows = []
+
+    def resolve_class_values(self, class_id, attributes, filter=None):
+        return [(dn, [values.get(name) for name in attributes])
+                for dn, values in self.rows]
+
+
+class TestStatsCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = StatsConnection()
+        self.stats = ucsmmonitor.UcsmStatsCollector(self.conn, capacity=4,
+                                                    expire_after=2)
+        self.stats.add_class('adaptorEthPortStats',
+                             ['bytesRx', 'packetsRx'])
+
+    def _collect(self, timestamp, **rows):
+        self.conn.rows = [(dn, dict(zip(('bytesRx', 'packetsRx'), values)))
+                          for dn, values in rows.items()]
+        return self.stats.collect(timestamp)
+
+    def test_ring_buffer(self):
+        for i in xrange(6):
+            self._collect(10 * i, p1=(str(100 * i), 'n/a'))
+        self.assertEqual(self.stats.samples('p1', 'bytesRx'),
+                         [(20, 200), (30, 300), (40, 400), (50, 500)])
+        self.assertEqual(self.stats.samples('p1', 'bytesRx', window=15,
+                                            now=50),
+                         [(40, 400), (50, 500)])
+        packets = self.stats.aggregate('p1', 'packetsRx')
+        self.assertEqual(packets['count'], 0)
+
+    def test_rates(self):
+        for timestamp, value in ((0, 0), (10, 100), (20, 300), (30, 50),
+                                 (40, 150)):
+            self._collect(timestamp, p1=(str(value), '1'))
+        self.assertEqual(self.stats.rates('p1', 'bytesRx'),
+                         [(20, 20.0), (40, 10.0)])
+        self.assertEqual(self.stats.deltas('p1', 'bytesRx', window=25,
+                                           now=40),
+                         [(40, 100.0)])
+        agg = self.stats.aggregate('p1', 'bytesRx', rate=True)
+        self.assertEqual((agg['count'], agg['min'], agg['max'], agg['mean'],
+                          agg['last']), (2, 10.0, 20.0, 15.0, 10.0))
+
+    def test_expire(self):
+        self._collect(0, p1=('1', '1'), p2=('1', '1'))
+        self._collect(10, p1=('2', '1'))
+        self.assertTrue('p2' in self.stats.series)
+        self._collect(20, p1=('3', '1'))
+        self.assertFalse('p2' in self.stats.series)
+
+
+class FaultConnection(StatsConnection):
+
+    def __init__(self, faults, fail_ids=()):
+        super(FaultConnection, self).__init__()
+        self.rows = faults
+        self.fail_ids = fail_ids
+        self.acked = []
+
+    def ack_faults(self, fault_ids):
+        if set(fault_ids) & set(self.fail_ids):
+            raise pyucsm.UcsmResponseError(1, 'failed')
+        self.acked.append(list(fault_ids))
+
+    def resolve_dn(self, dn, hierarchy=False):
+        for row_dn, values in self.rows:
+            if row_dn == dn:
+                obj = pyucsm.UcsmObject('faultInst')
+                obj.attributes.update(values, dn=dn)
+                return obj
+        return None
+
+    def resolve_class_values(self, class_id, attributes, filter=None):
+        return [(dn, [values.get(name) for name in attributes])
+                for dn, values in self.rows if filter is None or
+                filter.matches(self.resolve_dn(dn))]
+
+
+def fault(dn, fault_id, code='F0156', severity='major', ack='no'):
+    return (dn, {'id': fault_id, 'code': code, 'severity': severity,
+                 'ack': ack})
+
+
+class TestFaultPipeline(unittest.TestCase):
+
+    def setUp(self):
+        faults = [fault('sys/chassis-1/blade-%d/fault-F0156' % i, str(i))
+                  for i in xrange(5)]
+        faults += [fault('sys/chassis-1/blade-1/fault-F0283', '20',
+                         code='F0283'),
+                   fault('sys/chassis-1/blade-1/fault-F0284', '21',
+                         code='F0284', ack='yes')]
+        self.conn = FaultConnection(faults)
+        self.pipeline = ucsmmonitor.UcsmFaultPipeline(self.conn,
+                                                      batch_size=2)
+        self.pipeline.load()
+
+    def test_groups(self):
+        summary = self.pipeline.summary()
+        self.assertEqual(len(summary), 7)
+        key = ('F0283', 'major', 'sys/chassis-1/blade-1')
+        self.assertEqual(self.pipeline.groups[key],
+                         set(['sys/chassis-1/blade-1/fault-F0283']))
+
+    def test_events(self):
+        dn = 'sys/chassis-1/blade-1/fault-F0283'
+        update = pyucsm.UcsmObject('faultInst')
+        update.attributes.update(dn=dn, severity='cleared',
+                                 status='modified')
+        self.pipeline.apply_event(1, update)
+        self.assertTrue(('F0283', 'cleared', 'sys/chassis-1/blade-1')
+                        in self.pipeline.groups)
+        self.assertFalse(('F0283', 'major', 'sys/chassis-1/blade-1')
+                         in self.pipeline.groups)
+        self.assertEqual(self.pipeline.faults[dn]['id'], '20')
+        update.attributes['status'] = 'deleted'
+        self.pipeline.apply_event(2, update)
+        self.assertFalse(dn in self.pipeline.faults)
+
+    def test_unknown_fault(self):
+        dn = 'sys/chassis-2/blade-1/fault-F0156'
+        self.conn.rows.append(fault(dn, '30', severity='critical'))
+        update = pyucsm.UcsmObject('faultInst')
+        update.attributes.update(dn=dn, severity='critical',
+                                 status='modified')
+        self.pipeline.apply_event(1, update)
+        self.assertEqual(self.pipeline.faults[dn]['id'], '30')
+        self.assertTrue(('F0156', 'critical', 'sys/chassis-2/blade-1')
+                        in self.pipeline.groups)
+        update.attributes['dn'] = 'sys/chassis-3/blade-1/fault-F0156'
+        self.pipeline.apply_event(2, update)
+        self.assertFalse(update.dn in self.pipeline.faults)
+
+    def test_watch_filter(self):
+        severity = pyucsm.UcsmAttribute('faultInst', 'severity')
+        pipeline = ucsmmonitor.UcsmFaultPipeline(
+            self.conn, filter=severity == 'major')
+        pipeline.load()
+        minor = pyucsm.UcsmObject('faultInst')
+        minor.attributes.update(dn='sys/chassis-2/fault-F0001', id='40',
+                                severity='minor', status='created')
+        self.assertFalse(pipeline._wanted(minor))
+        deleted = pyucsm.UcsmObject('faultInst')
+        deleted.attributes.update(dn='sys/chassis-1/blade-1/fault-F0283',
+                                  status='deleted')
+        self.assertTrue(pipeline._wanted(deleted))
+
+    def test_acknowledge_partial(self):
+        dn = 'sys/chassis-1/blade-1/fault-F0283'
+        del self.pipeline.faults[dn]['id']
+        result = self.pipeline.acknowledge(
+            keys=[('F0283', 'major', 'sys/chassis-1/blade-1'),
+                  ('F0156', 'major', 'sys/chassis-1/blade-1')])
+        self.assertEqual(result.failed, {})
+        self.assertEqual(result.changed.keys(),
+                         ['sys/chassis-1/blade-1/fault-F0156'])
+
+    def test_acknowledge(self):
+        self.conn.fail_ids = ['3']
+        result = self.pipeline.acknowledge(
+            predicate=lambda dn, fault: fault['code'] == 'F0156')
+        self.assertEqual(sorted(result.failed),
+                         ['sys/chassis-1/blade-2/fault-F0156',
+                          'sys/chassis-1/blade-3/fault-F0156'])
+        self.assertEqual(sorted(sum(self.conn.acked, [])), ['0', '1', '4'])
+        self.assertEqual(len(result.changed), 3)
+        self.conn.fail_ids = []
+        result = self.pipeline.acknowledge()
+        self.assertEqual(sorted(sum(self.conn.acked[-2:], [])),
+                         ['2', '20', '3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
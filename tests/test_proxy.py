@@ -0,0 +1,239 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import sys
+import os
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__),
+                                                 os.path.pardir)))
+
+import Queue
+import threading
+import unittest
+from xml.dom import minidom
+
+import pyucsm
+import ucsmproxy
+
+
+MIRROR_REPLY = """<configResolveDn dn="sys" response="yes">
+<outConfig>
+  <topSystem dn="sys" name="ucs">
+    <equipmentChassis rn="chassis-1" id="1">
+      <computeBlade rn="blade-1" slotId="1" operPower="on"/>
+      <computeBlade rn="blade-2" slotId="2" operPower="off"/>
+    </equipmentChassis>
+  </topSystem>
+</outConfig>
+</configResolveDn>"""
+
+
+class FakeEventConnection(object):
+    sock = None
+
+    def close(self):
+        pass
+
+
+class UpstreamConnection(pyucsm.UcsmConnection):
+    """Upstream UCSM serving one mirrored tree and queued event frames."""
+
+    def __init__(self):
+        super(UpstreamConnection, self).__init__('upstream', 80)
+        self.frames = Queue.Queue()
+        self.forwarded = []
+        self.subscriptions = 0
+        self.loading = None
+        self.failures = 0
+
+    def login(self, login, password, **kwargs):
+        self.set_auth('upstream-cookie', login, password)
+        self.privileges = ['admin']
+        return self.cookie
+
+    def _submit_request(self, request_data, headers=None, compact=False):
+        query = minidom.parseString(request_data).documentElement
+        if query.tagName == 'configResolveDn':
+            if self.loading is not None:
+                self.loading()
+            return minidom.parseString(MIRROR_REPLY), None
+        self.forwarded.append(request_data)
+        if self.failures:
+            self.failures -= 1
+            raise pyucsm.UcsmFatalError('Error during connecting: reset')
+        return minidom.parseString(
+            '<%s cookie="%s" response="yes"><outConfig>'
+            '<lsServer dn="org-root/ls-web" status="created"/>'
+            '</outConfig></%s>' % (query.tagName, query.getAttribute('cookie'),
+                                   query.tagName)), None
+
+    def _iter_xml_events(self, filter=None, subscribed=None):
+        conn = FakeEventConnection()
+        self.subscriptions += 1
+        if subscribed is not None:
+            subscribed()
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                return
+            if frame == 'drop':
+                raise pyucsm.UcsmFatalError('stream lost')
+            frame_xml = minidom.parseString(frame)
+            if self.journal is not None:
+                self.journal.append(frame, frame_xml)
+            yield frame_xml, conn
+
+
+def blade_event(eid, slot, power):
+    return ('<configMoChangeEvent inEid="%d"><inConfig>'
+            '<computeBlade dn="sys/chassis-1/blade-%d" operPower="%s" '
+            'status="modified"/></inConfig></configMoChangeEvent>'
+            % (eid, slot, power))
+
+
+class TestProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.upstream = UpstreamConnection()
+        self.proxy = ucsmproxy.UcsmProxy(self.upstream, 'admin', 'secret',
+                                         roots=('sys',))
+        self.proxy.start()
+        self.server = ucsmproxy.UcsmProxyServer(self.proxy, ('127.0.0.1', 0))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = pyucsm.UcsmConnection('127.0.0.1',
+                                            self.server.server_address[1])
+        self.client.login('admin', 'secret', autorefresh=False)
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.upstream.frames.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_login(self):
+        client = pyucsm.UcsmConnection('127.0.0.1',
+                                       self.server.server_address[1])
+        self.assertRaises(pyucsm.UcsmResponseError, client.login, 'admin',
+                          'wrong', autorefresh=False)
+        client.set_auth('forged')
+        self.assertRaises(pyucsm.UcsmResponseError, client.resolve_dn, 'sys')
+
+    def test_mirrored_reads(self):
+        blades = self.client.resolve_class('computeBlade')
+        self.assertEqual(sorted(blade.dn for blade in blades),
+                         ['sys/chassis-1/blade-1', 'sys/chassis-1/blade-2'])
+        power = pyucsm.UcsmAttribute('computeBlade', 'operPower')
+        blades = self.client.resolve_class('computeBlade',
+                                           filter=power == 'off')
+        self.assertEqual([blade.slotId for blade in blades], ['2'])
+        chassis = self.client.resolve_dn('sys/chassis-1', hierarchy=True)
+        self.assertEqual(len(chassis.children), 2)
+        resolved, unresolved = self.client.resolve_dns(
+            ['sys/chassis-1/blade-1', 'sys/chassis-9'])
+        self.assertEqual(unresolved, ['sys/chassis-9'])
+        self.assertEqual(len(self.client.resolve_children(
+            dn='sys/chassis-1')), 2)
+        self.assertEqual(self.client.find_dns_by_class_id('equipmentChassis'),
+                         ['sys/chassis-1'])
+        self.assertEqual(self.upstream.forwarded, [])
+
+    def test_forward_retry(self):
+        self.upstream.retry_policy = pyucsm.UcsmRetryPolicy(backoff=0.01)
+        self.upstream.failures = 1
+        parent = self.client.resolve_parent('sys/chassis-1')
+        self.assertEqual(parent.dn, 'org-root/ls-web')
+        self.assertEqual(len(self.upstream.forwarded), 2)
+
+    def test_forward_and_events(self):
+        config = pyucsm.UcsmObject('lsServer')
+        config.status = 'created'
+        self.client.conf_mo(config, dn='org-root/ls-web')
+        self.assertEqual(len(self.upstream.forwarded), 1)
+        self.assertTrue('upstream-cookie' in self.upstream.forwarded[0])
+
+        power = pyucsm.UcsmAttribute('computeBlade', 'operPower')
+        events = self.client.iter_events(filter=power == 'on')
+        received = Queue.Queue()
+        reader = threading.Thread(
+            target=lambda: received.put(next(events)))
+        reader.daemon = True
+        reader.start()
+        while not self.proxy._subscribers:
+            threading.Event().wait(0.01)
+        self.upstream.frames.put(blade_event(1, 2, 'off'))
+        self.upstream.frames.put(blade_event(2, 1, 'on'))
+        event_id, obj = received.get(timeout=5)
+        self.assertEqual((event_id, obj.dn), (2, 'sys/chassis-1/blade-1'))
+        blade = self.client.resolve_dn('sys/chassis-1/blade-2')
+        self.assertEqual(blade.operPower, 'off')
+
+
+    def _wait(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            threading.Event().wait(0.01)
+        self.fail('Condition is not met')
+
+    def _event_during_load(self, proxy, upstream, eid):
+        def loading():
+            upstream.loading = None
+            upstream.frames.put(blade_event(eid, 1, 'off'))
+            self._wait(lambda: proxy._pending)
+        upstream.loading = loading
+
+    def test_events_during_load(self):
+        upstream = UpstreamConnection()
+        proxy = ucsmproxy.UcsmProxy(upstream, 'admin', 'secret',
+                                    roots=('sys',))
+        self._event_during_load(proxy, upstream, 1)
+        proxy.start()
+        try:
+            self.assertTrue(proxy.synced)
+            self.assertEqual(
+                proxy.index.get('sys/chassis-1/blade-1').operPower, 'off')
+        finally:
+            proxy.stop()
+            upstream.frames.put(None)
+
+    def test_resync_after_lost_subscription(self):
+        retry_delay = pyucsm._UcsmWatchDispatcher.retry_delay
+        pyucsm._UcsmWatchDispatcher.retry_delay = 0.01
+        try:
+            self._event_during_load(self.proxy, self.upstream, 1)
+            self.upstream.frames.put('drop')
+            self._wait(lambda: self.upstream.subscriptions == 2
+                       and self.proxy.synced)
+        finally:
+            pyucsm._UcsmWatchDispatcher.retry_delay = retry_delay
+        blade = self.client.resolve_dn('sys/chassis-1/blade-1')
+        self.assertEqual(blade.operPower, 'off')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import sys
+import os
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__),
+                                                 os.path.pardir)))
+
+import StringIO
+import threading
+import unittest
+
+import pyucsm
+import ucsmquery
+
+
+class BatchConnection(pyucsm.UcsmConnection):
+    """Connection which logs session calls and answers resolve_dn."""
+    calls = []
+    lock = threading.Lock()
+
+    def login(self, login, password, *args, **kwargs):
+        self.calls.append('login')
+
+    def logout(self):
+        self.calls.append('logout')
+
+    def resolve_dn(self, dn, hierarchy=False):
+        with self.lock:
+            self.calls.append(dn)
+        if dn == 'missing':
+            raise pyucsm.UcsmResponseError(103, 'not found')
+        obj = pyucsm.UcsmObject('computeBlade')
+        obj.dn = dn
+        return obj
+
+    def resolve_children(self, dn, class_id=None, hierarchy=False,
+                         filter=None, index=None):
+        return len(dn) + None
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.conn_cls = ucsmquery.CONN_CLS
+        ucsmquery.CONN_CLS = BatchConnection
+        ucsmquery.ONLY_DN = True
+        BatchConnection.calls = []
+
+    def tearDown(self):
+        ucsmquery.CONN_CLS = self.conn_cls
+        ucsmquery.ONLY_DN = False
+
+    def test_parse_line(self):
+        self.assertEqual(ucsmquery.parse_batch_line(
+            'resolve_dn --dn="sys/chassis 1" # comment'),
+            ('resolve_dn', [], {'dn': 'sys/chassis 1'}))
+        self.assertEqual(ucsmquery.parse_batch_line('  # comment'), None)
+
+    def test_batch(self):
+        lines = ['resolve_dn --dn=sys/chassis-%d\n' % i for i in range(20)]
+        lines[5:5] = ['\n', 'resolve_dn --dn=missing\n', 'no_such\n',
+                      'resolve_children --dn=sys\n']
+        out = StringIO.StringIO()
+        failed = ucsmquery.perform_batch('host', 'admin', 'password', lines,
+                                         workers=4, out=out)
+        self.assertEqual(failed, 3)
+        calls = BatchConnection.calls
+        self.assertEqual((calls[0], calls[-1]), ('login', 'logout'))
+        self.assertEqual(calls.count('login'), 1)
+        expected = []
+        for line in lines:
+            if not line.strip():
+                continue
+            expected.append('# %s' % line.strip())
+            if 'missing' in line:
+                expected.append('Error: not found')
+            elif 'no_such' in line:
+                expected.append('Command not found or incorrect arguments.')
+            elif 'resolve_children' in line:
+                expected.append("Error: TypeError: unsupported operand "
+                                "type(s) for +: 'int' and 'NoneType'")
+            else:
+                expected.append('computeBlade: %s' % line.split('=')[1].strip())
+        self.assertEqual(out.getvalue().splitlines(), expected)
+
+    def test_wrong_arguments(self):
+        conn = BatchConnection('host')
+        out = StringIO.StringIO()
+        self.assertFalse(ucsmquery.run_command(conn, 'resolve_dn', [],
+                                               {'no_such': '1'}, out))
+        self.assertFalse(ucsmquery.run_command(conn, 'host', [], {}, out))
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['Command not found or incorrect arguments.'] * 2)
+        self.assertRaises(TypeError, ucsmquery.run_command, conn,
+                          'resolve_children', [], {'dn': 'sys'}, out)
+
+
+if __name__ == '__main__':
+    unittest.main()
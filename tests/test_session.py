@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import sys
+import os
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__),
+                                                 os.path.pardir)))
+
+import stat
+import tempfile
+import time
+import unittest
+from xml.dom import minidom
+
+import pyucsm
+import ucsmsession
+
+
+class AuthConnection(pyucsm.UcsmConnection):
+    """Connection which answers login and refresh requests."""
+    issued = 0
+
+    def __init__(self):
+        super(AuthConnection, self).__init__('host', 80)
+        self.methods = []
+
+    def _submit_request(self, request_data, headers=None, compact=False):
+        method = minidom.parseString(request_data).documentElement.tagName
+        self.methods.append(method)
+        AuthConnection.issued += 1
+        return minidom.parseString(
+            '<%s response="yes" outCookie="cookie-%d" outRefreshPeriod="600" '
+            'outPriv="admin" outVersion="2.0" outSessionId="s" '
+            'outStatus="success"/>' % (method, AuthConnection.issued)), None
+
+
+class TestSessionBroker(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_shared_between_processes(self):
+        first = AuthConnection()
+        lease = ucsmsession.UcsmSessionBroker(self.path).lease(
+            first, 'admin', 'secret')
+        self.assertEqual(first.methods, ['aaaLogin'])
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+        self.assertFalse('secret' in open(self.path).read())
+        second = AuthConnection()
+        other = ucsmsession.UcsmSessionBroker(self.path).lease(
+            second, 'admin', 'secret')
+        self.assertEqual(second.methods, [])
+        self.assertEqual(other.cookie, lease.cookie)
+        self.assertTrue(second.is_logged_in())
+
+    def test_refresh_and_invalidate(self):
+        broker = ucsmsession.UcsmSessionBroker(self.path)
+        conn = AuthConnection()
+        lease = broker.lease(conn, 'admin', 'secret')
+        with broker._open() as data:
+            data.values()[0][0]['refreshed'] = time.time() - 400
+        other = AuthConnection()
+        other_lease = broker.lease(other, 'admin', 'secret')
+        self.assertEqual(other.methods, ['aaaRefresh'])
+        lease.renew()
+        self.assertEqual(conn.methods, ['aaaLogin'])
+        self.assertEqual(lease.cookie, other_lease.cookie)
+        lease.invalidate()
+        self.assertEqual(conn.methods, ['aaaLogin', 'aaaLogin'])
+        self.assertNotEqual(lease.cookie, other_lease.cookie)
+        other_lease.renew()
+        self.assertEqual(lease.cookie, other_lease.cookie)
+
+    def test_pool(self):
+        broker = ucsmsession.UcsmSessionBroker(self.path, sessions=2)
+        cookies = [broker.lease(AuthConnection(), 'admin', 'secret').cookie
+                   for _ in range(4)]
+        self.assertEqual(len(set(cookies)), 2)
+
+    def test_login_outside_lock(self):
+        broker = ucsmsession.UcsmSessionBroker(self.path)
+        other = AuthConnection()
+        leases = []
+
+        class RacingConnection(AuthConnection):
+            def login(self, *args, **kwargs):
+                # other process logs in while this one waits for server
+                leases.append(broker.lease(other, 'admin', 'secret'))
+                return AuthConnection.login(self, *args, **kwargs)
+        conn = RacingConnection()
+        lease = broker.lease(conn, 'admin', 'secret')
+        self.assertEqual(conn.methods, ['aaaLogin', 'aaaLogout'])
+        self.assertEqual(lease.cookie, leases[0].cookie)
+        self.assertEqual(conn.cookie, lease.cookie)
+
+    def test_release_during_renew(self):
+        lease = ucsmsession.UcsmSessionBroker(self.path).lease(
+            AuthConnection(), 'admin', 'secret')
+        lease.start_autorenew(60)
+        lease.renew = lease.release
+        lease._autorenew()
+        self.assertEqual(lease._UcsmLease__timer, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
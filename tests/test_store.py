@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import sys
+import os
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__),
+                                                 os.path.pardir)))
+
+import shutil
+import tempfile
+import unittest
+from xml.dom import minidom
+
+import pyucsm
+import ucsmstore
+
+
+TREE = """<outConfigs>
+  <equipmentChassis dn="sys/chassis-1" id="1">
+    <computeBlade rn="blade-1" slotId="1" totalMemory="8192">
+      <adaptorUnit rn="adaptor-1" model="N20-AC0002"/>
+    </computeBlade>
+    <computeBlade rn="blade-2" slotId="2" totalMemory="16384"/>
+  </equipmentChassis>
+  <equipmentChassis dn="sys/chassis-2" id="2">
+    <computeBlade rn="blade-1" slotId="1" totalMemory="8192"/>
+  </equipmentChassis>
+</outConfigs>"""
+
+
+def load_tree():
+    return [pyucsm.UcsmObject(node) for node in
+            minidom.parseString(TREE).firstChild.childNodes
+            if node.nodeType == node.ELEMENT_NODE]
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'domain.snap')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        roots = load_tree()
+        ucsmstore.write_snapshot(self.path, roots, last_event_id=42)
+        with ucsmstore.UcsmSnapshot(self.path) as snap:
+            self.assertEqual(42, snap.last_event_id)
+            self.assertEqual(6, len(snap))
+            self.assertEqual(roots, list(snap.roots(hierarchy=True)))
+            blade = snap.get('sys/chassis-1/blade-2')
+            self.assertEqual('16384', blade.totalMemory)
+            self.assertIsInstance(blade.dn, pyucsm.Dn)
+            self.assertEqual([], blade.children)
+            self.assertEqual(roots[0].children[0],
+                             snap.get('sys/chassis-1/blade-1', True))
+            self.assertIsNone(snap.get('sys/chassis-3'))
+            self.assertIn('sys/chassis-2/blade-1', snap)
+            self.assertEqual(['sys/chassis-1/blade-1', 'sys/chassis-1/blade-2',
+                              'sys/chassis-2/blade-1'],
+                             sorted(o.dn for o in snap.find('computeBlade')))
+
+    def test_replace_and_catch_up(self):
+        ucsmstore.write_snapshot(self.path, load_tree())
+        index = pyucsm.UcsmIndex(load_tree())
+        event = pyucsm.UcsmObject('computeBlade')
+        event.dn = 'sys/chassis-2/blade-2'
+        event.status = 'created'
+        event.slotId = '2'
+        index.apply_event(event)
+        event = pyucsm.UcsmObject('computeBlade')
+        event.dn = 'sys/chassis-1/blade-1'
+        event.status = 'deleted'
+        index.apply_event(event)
+        ucsmstore.write_snapshot(self.path, index, last_event_id=7)
+        self.assertEqual(['domain.snap'], os.listdir(self.dir))
+        with ucsmstore.UcsmSnapshot(self.path) as snap:
+            self.assertIsNone(snap.get('sys/chassis-1/blade-1/adaptor-1'))
+            self.assertEqual('2', snap.get('sys/chassis-2/blade-2').slotId)
+            loaded = snap.load_index()
+            self.assertEqual(5, len(loaded))
+            self.assertEqual(2, len(loaded.get('sys/chassis-2').children))
+
+    def test_not_snapshot(self):
+        with open(self.path, 'w') as f:
+            f.write('garbage')
+        self.assertRaises(ucsmstore.UcsmStoreError,
+                          ucsmstore.UcsmSnapshot, self.path)
+
+    def test_truncated(self):
+        open(self.path, 'w').close()
+        self.assertRaises(ucsmstore.UcsmStoreError,
+                          ucsmstore.UcsmSnapshot, self.path)
+        ucsmstore.write_snapshot(self.path, load_tree())
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size // 2)
+        self.assertRaises(ucsmstore.UcsmStoreError,
+                          ucsmstore.UcsmSnapshot, self.path)
+
+
+def event_frame(eid, dn, status='modified', **attrs):
+    attrs = ''.join(' %s="%s"' % item for item in attrs.items())
+    return ('<configMoChangeEvent inEid="%d"><inConfig>'
+            '<computeBlade dn="%s" status="%s"%s/>'
+            '</inConfig></configMoChangeEvent>' % (eid, dn, status, attrs))
+
+
+class TestEventJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _fill(self, journal, count=30):
+        for i in range(count):
+            journal.append(event_frame(i + 1, 'sys/chassis-%d/blade-%d'
+                                       % (i % 3 + 1, i), operState='ok'),
+                           timestamp=1000.0 + i)
+
+    def test_replay(self):
+        journal = ucsmstore.UcsmEventJournal(self.dir, segment_bytes=1024)
+        self._fill(journal)
+        self.assertEqual(range(1, 31),
+                         [eid for eid, _, _ in journal.replay_frames()])
+        self.assertEqual(range(11, 16),
+                         [eid for eid, _, _ in
+                          journal.replay_frames(start=1010.0, end=1015.0)])
+        self.assertEqual(range(26, 31),
+                         [eid for eid, _, _ in
+                          journal.replay_frames(since_eid=25)])
+        events = list(journal.replay(dn_prefix='sys/chassis-2'))
+        self.assertEqual(range(2, 31, 3), [eid for eid, _ in events])
+        self.assertEqual('ok', events[0][1].operState)
+        self.assertEqual([], list(journal.replay(dn_prefix='sys/chassis-4')))
+        journal.close()
+        self.assertTrue(len(os.listdir(self.dir)) > 3)
+
+        journal = ucsmstore.UcsmEventJournal(self.dir, segment_bytes=1024)
+        journal.append(event_frame(31, 'sys/chassis-4/blade-1'))
+        self.assertEqual([31], [eid for eid, _ in
+                                journal.replay(dn_prefix='sys/chassis-4')])
+        self.assertEqual(31, len(list(journal.replay_frames())))
+        journal.close()
+
+    def test_truncated_record(self):
+        journal = ucsmstore.UcsmEventJournal(self.dir)
+        self._fill(journal, 3)
+        journal.close()
+        with open(os.path.join(self.dir, '0000000000.log'), 'ab') as f:
+            f.write('\x10\x00')
+        journal = ucsmstore.UcsmEventJournal(self.dir)
+        journal.append(event_frame(4, 'sys/chassis-1/blade-4'))
+        self.assertEqual([1, 2, 3, 4],
+                         [eid for eid, _, _ in journal.replay_frames()])
+        journal.close()
+
+    def test_retention(self):
+        journal = ucsmstore.UcsmEventJournal(self.dir, segment_bytes=1024,
+                                             max_bytes=2048)
+        self._fill(journal, 60)
+        size = sum(os.path.getsize(os.path.join(self.dir, name))
+                   for name in os.listdir(self.dir) if name.endswith('.log'))
+        self.assertTrue(size <= 2048 + 1024)
+        eids = [eid for eid, _, _ in journal.replay_frames()]
+        self.assertEqual(60, eids[-1])
+        self.assertTrue(eids[0] > 1)
+        journal.close()
+        journal = ucsmstore.UcsmEventJournal(self.dir, segment_bytes=1024,
+                                             max_age=60)
+        journal.enforce_retention()
+        self.assertEqual(1, len([name for name in os.listdir(self.dir)
+                                 if name.endswith('.log')]))
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
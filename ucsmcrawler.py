@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import json
+import logging
+import os
+import Queue
+import threading
+
+from pyucsm import UcsmIndex, Dn
+from ucsmstore import _atomic_write
+
+
+LOG = logging.getLogger('pyucsm.crawler')
+
+
+def _count(objects):
+    count = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        count += 1
+        stack.extend(obj.children)
+    return count
+
+
+class UcsmCrawler(object):
+    """Walks object tree from roots breadth-first with resolve_children
+calls made by pool of workers. Subtree of object is fetched with single
+hierarchical request when objects of its class have been observed to have
+at most max_objects descendants (or, for unobserved class, when it is at
+least min_depth levels below root); otherwise only its children are fetched
+and crawled further. Fetched objects are passed to sink as lists, by default
+they are added to index. If checkpoint path is given, pending part of crawl
+is saved there every checkpoint_every requests and crawl is resumed from it;
+sink must be persistent and tolerate repeated objects to make resumed crawl
+complete.
+    """
+
+    def __init__(self, connection, roots=('sys', 'org-root'), sink=None,
+                 workers=4, max_objects=5000, min_depth=2, retries=2,
+                 checkpoint=None, checkpoint_every=100):
+        self.connection = connection
+        self.roots = roots
+        self.index = UcsmIndex()
+        self.sink = sink or self._index_sink
+        self.workers = workers
+        self.max_objects = max_objects
+        self.min_depth = min_depth
+        self.retries = retries
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.estimates = {}
+        self.failed = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._sink_lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._pending = set()
+
+    def _index_sink(self, objects):
+        for obj in objects:
+            self.index.add(obj, recursive=True)
+
+    def _emit(self, objects):
+        if objects:
+            with self._sink_lock:
+                self.sink(objects)
+
+    def _put(self, task):
+        with self._lock:
+            self._pending.add(task)
+        self._queue.put(task)
+
+    def run(self):
+        """Crawls until all reachable objects are fetched."""
+        state = self._load_checkpoint()
+        if state is None:
+            for root in self.roots:
+                self._put((root, None, 0, 0))
+        else:
+            self.estimates.update(state['estimates'])
+            for task in state['pending']:
+                self._put(tuple(task))
+        threads = [threading.Thread(target=self.connection._bind(self._work),
+                                    name='pyucsm-crawler-%d' % i)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self._queue.join()
+        for thread in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            try:
+                self._crawl(task)
+            except Exception, e:
+                dn, class_id, depth, attempts = task
+                if attempts < self.retries:
+                    LOG.warning('Crawling %s failed, retrying: %s', dn, e)
+                    self._put((dn, class_id, depth, attempts + 1))
+                else:
+                    LOG.warning('Crawling %s failed: %s', dn, e)
+                    self.failed[dn] = e
+            finally:
+                with self._lock:
+                    self._pending.discard(task)
+                    self.requests += 1
+                    save = self.checkpoint and \
+                        not self.requests % self.checkpoint_every
+                if save:
+                    self._save_checkpoint()
+                self._queue.task_done()
+
+    def _hierarchical(self, class_id, depth):
+        estimate = self.estimates.get(class_id)
+        if estimate is None:
+            return depth >= self.min_depth
+        return estimate <= self.max_objects
+
+    def _crawl(self, task):
+        dn, class_id, depth, attempts = task
+        if class_id is None:
+            root = self.connection.resolve_dn(dn)
+            if root is None:
+                return
+            self._emit([root])
+            class_id = root.ucs_class
+        if self._hierarchical(class_id, depth):
+            children = self.connection.resolve_children(dn=dn,
+                                                        hierarchy=True)
+            size = _count(children)
+            with self._lock:
+                self.estimates[class_id] = max(
+                    self.estimates.get(class_id, 0), size)
+            self._emit(children)
+            return
+        children = self.connection.resolve_children(dn=dn)
+        self._emit(children)
+        for child in children:
+            self._put((Dn(child.dn), child.ucs_class, depth + 1, 0))
+
+    def _load_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint) as f:
+            return json.load(f)
+
+    def _save_checkpoint(self):
+        with self._lock:
+            state = {'pending': list(self._pending),
+                     'estimates': self.estimates}
+            data = json.dumps(state)
+        _atomic_write(self.checkpoint, lambda f: f.write(data))
@@ -0,0 +1,473 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+from array import array
+import bisect
+import itertools
+import logging
+import operator
+import threading
+import time
+
+from pyucsm import UcsmError, UcsmFilterOp, UcsmObject, UcsmBulkResult, Dn
+from pyucsm import _run_in_threads
+
+
+LOG = logging.getLogger('pyucsm.monitor')
+
+
+class _PolledClass(object):
+    def __init__(self, class_id, filter, interval, use_dns):
+        self.class_id = class_id
+        self.filter = filter
+        self.interval = interval
+        self.use_dns = use_dns
+        self.due = 0
+        self.state = None
+
+
+class UcsmPoller(object):
+    """Periodically polls classes and reports difference between polls as
+events of the same shape as UcsmConnection.iter_events yields: (sequence
+number, object with status). Created objects are reported completely,
+modified only with changed attributes, deleted only with dn. Interval of class
+is halved after poll with changes and grows 1.5 times after poll without them,
+staying within min_interval and max_interval.
+    """
+
+    def __init__(self, connection, min_interval=5, max_interval=300,
+                 chunk_size=100, report_initial=True):
+        self.connection = connection
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.chunk_size = chunk_size
+        self.report_initial = report_initial
+        self.classes = {}
+        self._seq = itertools.count(1)
+        self._stop = threading.Event()
+
+    def add_class(self, class_id, filter=UcsmFilterOp(), interval=None,
+                  use_dns=False):
+        """Starts polling class. With use_dns objects are found with
+find_dns_by_class_id and resolved by dns in chunks of chunk_size, otherwise
+with single resolve_class."""
+        if interval is None:
+            interval = self.min_interval
+        self.classes[class_id] = _PolledClass(class_id, filter, interval,
+                                              use_dns)
+
+    def remove_class(self, class_id):
+        del self.classes[class_id]
+
+    def _fetch(self, polled):
+        if not polled.use_dns:
+            return self.connection.resolve_class(polled.class_id,
+                                                 filter=polled.filter)
+        dns = self.connection.find_dns_by_class_id(polled.class_id,
+                                                   filter=polled.filter)
+        res = []
+        for start in xrange(0, len(dns), self.chunk_size):
+            resolved, unresolved = self.connection.resolve_dns(
+                dns[start:start + self.chunk_size])
+            res.extend(resolved)
+        return res
+
+    def _change(self, class_id, dn, status, attributes=None):
+        obj = UcsmObject(class_id)
+        if attributes:
+            obj.attributes.update(attributes)
+        obj.attributes['dn'] = Dn(dn)
+        obj.attributes['status'] = status
+        return next(self._seq), obj
+
+    def poll(self, class_id):
+        """Polls class once, returns list of changes since previous poll."""
+        polled = self.classes[class_id]
+        objects = self._fetch(polled)
+        current = dict((obj.dn, obj) for obj in objects)
+        previous = polled.state
+        polled.state = current
+        if previous is None:
+            if not self.report_initial:
+                return []
+            previous = {}
+        events = []
+        for dn, obj in current.iteritems():
+            old = previous.get(dn)
+            if old is None:
+                events.append(self._change(obj.ucs_class, dn, 'created',
+                                           obj.attributes))
+            elif old.tree_hash() != obj.tree_hash():
+                old_attrs = old.attributes
+                changed = dict((key, value) for key, value in
+                               obj.attributes.iteritems()
+                               if old_attrs.get(key) != value)
+                events.append(self._change(obj.ucs_class, dn, 'modified',
+                                           changed))
+        for dn, old in previous.iteritems():
+            if dn not in current:
+                events.append(self._change(old.ucs_class, dn, 'deleted'))
+        return events
+
+    def _reschedule(self, polled, changed, now):
+        if changed:
+            polled.interval = max(self.min_interval, polled.interval / 2.0)
+        else:
+            polled.interval = min(self.max_interval, polled.interval * 1.5)
+        polled.due = now + polled.interval
+
+    def iter_events(self):
+        """Polls classes when they are due, iterating through changes until
+stop is called."""
+        while not self._stop.is_set():
+            if not self.classes:
+                self._stop.wait(self.min_interval)
+                continue
+            polled = min(self.classes.itervalues(), key=lambda p: p.due)
+            delay = polled.due - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+                continue
+            try:
+                events = self.poll(polled.class_id)
+            except UcsmError, e:
+                LOG.warning('Polling of %s failed: %s', polled.class_id, e)
+                events = []
+            self._reschedule(polled, events, time.time())
+            for event in events:
+                yield event
+
+    def stop(self):
+        self._stop.set()
+
+
+_NAN = float('nan')
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _NAN
+
+
+class _StatsSeries(object):
+    """Samples of one dn, kept in fixed-size ring buffers."""
+
+    def __init__(self, class_id, metrics, capacity):
+        self.class_id = class_id
+        self.capacity = capacity
+        self.times = array('d', [_NAN]) * capacity
+        self.values = dict((metric, array('d', [_NAN]) * capacity)
+                           for metric in metrics)
+        self.count = 0
+        self.missed = 0
+
+    def append(self, timestamp, metrics, values):
+        pos = self.count % self.capacity
+        self.times[pos] = timestamp
+        for metric, value in itertools.izip(metrics, values):
+            self.values[metric][pos] = _to_float(value)
+        self.count += 1
+        self.missed = 0
+
+    def _ordered(self, buf):
+        """Returns contents of ring buffer, oldest first."""
+        if self.count <= self.capacity:
+            return buf[:self.count]
+        pos = self.count % self.capacity
+        return buf[pos:] + buf[:pos]
+
+    def window(self, metric, since):
+        """Returns arrays of times and values of samples not older than
+since, oldest first."""
+        times = self._ordered(self.times)
+        values = self._ordered(self.values[metric])
+        if since is not None:
+            start = bisect.bisect_left(times, since)
+            times, values = times[start:], values[start:]
+        return times, values
+
+
+class UcsmStatsCollector(object):
+    """Collects numeric attributes of statistics classes into ring buffers of
+capacity samples per dn and metric, so memory is bounded regardless of uptime.
+Series of dn which is missing in expire_after successive polls is dropped.
+    """
+
+    def __init__(self, connection, capacity=720, expire_after=3):
+        self.connection = connection
+        self.capacity = capacity
+        self.expire_after = expire_after
+        self.classes = {}
+        self.series = {}
+        self._stop = threading.Event()
+
+    def add_class(self, class_id, metrics, filter=UcsmFilterOp()):
+        """Starts collecting metrics, which are names of numeric attributes,
+of objects of class matching filter."""
+        self.classes[class_id] = (list(metrics), filter)
+
+    def collect(self, timestamp=None):
+        """Polls all classes once, returns number of collected samples."""
+        if timestamp is None:
+            timestamp = time.time()
+        collected = 0
+        for class_id, (metrics, filter) in self.classes.iteritems():
+            rows = self.connection.resolve_class_values(class_id, metrics,
+                                                        filter=filter)
+            seen = set()
+            for dn, values in rows:
+                series = self.series.get(dn)
+                if series is None:
+                    series = self.series[dn] = _StatsSeries(
+                        class_id, metrics, self.capacity)
+                series.append(timestamp, metrics, values)
+                seen.add(dn)
+            collected += len(seen)
+            self._expire(class_id, seen)
+        return collected
+
+    def _expire(self, class_id, seen):
+        for dn, series in self.series.items():
+            if dn in seen or series.class_id != class_id:
+                continue
+            series.missed += 1
+            if series.missed >= self.expire_after:
+                del self.series[dn]
+
+    def samples(self, dn, metric, window=None, now=None):
+        """Returns list of (timestamp, value) pairs of last window seconds."""
+        times, values = self.series[dn].window(metric,
+                                               self._since(window, now))
+        return zip(times, values)
+
+    def _changes(self, dn, metric, window, now):
+        """Returns end times, time and value changes of intervals where
+counter did not decrease (was not reset), computed over whole buffers."""
+        times, values = self.series[dn].window(metric,
+                                               self._since(window, now))
+        elapsed = map(operator.sub, times[1:], times[:-1])
+        changes = map(operator.sub, values[1:], values[:-1])
+        valid = map(operator.and_,
+                    itertools.imap(operator.gt, elapsed, itertools.repeat(0)),
+                    itertools.imap(operator.ge, changes, itertools.repeat(0)))
+        return (list(itertools.compress(times[1:], valid)),
+                list(itertools.compress(elapsed, valid)),
+                list(itertools.compress(changes, valid)))
+
+    def deltas(self, dn, metric, window=None, now=None):
+        """Returns list of (timestamp, change since previous sample) pairs for
+counter metric. Intervals where counter decreased (was reset) are skipped."""
+        times, elapsed, changes = self._changes(dn, metric, window, now)
+        return zip(times, changes)
+
+    def rates(self, dn, metric, window=None, now=None):
+        """Returns list of (timestamp, change per second) pairs for counter
+metric. Intervals where counter decreased (was reset) are skipped."""
+        times, elapsed, changes = self._changes(dn, metric, window, now)
+        return zip(times, map(operator.truediv, changes, elapsed))
+
+    def aggregate(self, dn, metric, window=None, now=None, rate=False):
+        """Returns dict with count, min, max, mean and last value of metric
+(or its rate) over last window seconds."""
+        if rate:
+            samples = self.rates(dn, metric, window, now)
+        else:
+            samples = self.samples(dn, metric, window, now)
+        values = [value for timestamp, value in samples if value == value]
+        if not values:
+            return {'count': 0, 'min': None, 'max': None, 'mean': None,
+                    'last': None}
+        return {'count': len(values), 'min': min(values), 'max': max(values),
+                'mean': sum(values) / len(values), 'last': values[-1]}
+
+    def _since(self, window, now):
+        if window is None:
+            return None
+        if now is None:
+            now = time.time()
+        return now - window
+
+    def run(self, interval):
+        """Collects samples every interval seconds until stop is called."""
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.collect(started)
+            except UcsmError, e:
+                LOG.warning('Statistics collection failed: %s', e)
+            self._stop.wait(max(0, started + interval - time.time()))
+
+    def stop(self):
+        self._stop.set()
+
+
+class UcsmFaultPipeline(object):
+    """Live view of faultInst objects grouped by code, severity and affected
+dn. Faults are loaded with single filtered request reading only needed
+attributes, then kept up to date by events when watch is called.
+Acknowledgement is done with faultAckFaults requests of at most batch_size
+ids, parallelism of them at once.
+    """
+    attributes = ['id', 'code', 'severity', 'ack', 'cause', 'descr',
+                  'lastTransition', 'occur']
+
+    def __init__(self, connection, filter=UcsmFilterOp(), batch_size=1000,
+                 parallelism=4):
+        self.connection = connection
+        self.filter = filter
+        self.batch_size = batch_size
+        self.parallelism = parallelism
+        self.faults = {}
+        self.groups = {}
+        self._lock = threading.RLock()
+        self._watch = None
+
+    @staticmethod
+    def group_key(dn, fault):
+        """Returns (code, severity, affected dn) of fault."""
+        return fault.get('code'), fault.get('severity'), Dn(dn).parent
+
+    def load(self):
+        """Replaces view with current faults from server."""
+        rows = self.connection.resolve_class_values('faultInst',
+                                                    self.attributes,
+                                                    filter=self.filter)
+        with self._lock:
+            self.faults = {}
+            self.groups = {}
+            for dn, values in rows:
+                self._add(dn, dict((name, value) for name, value in
+                                   zip(self.attributes, values)
+                                   if value is not None))
+
+    def _add(self, dn, fault):
+        self.faults[dn] = fault
+        self.groups.setdefault(self.group_key(dn, fault), set()).add(dn)
+
+    def _remove(self, dn):
+        fault = self.faults.pop(dn, None)
+        if fault is None:
+            return None
+        key = self.group_key(dn, fault)
+        group = self.groups[key]
+        group.discard(dn)
+        if not group:
+            del self.groups[key]
+        return fault
+
+    def apply_event(self, event_id, obj):
+        """Updates view with faultInst change event. Fault which is not in
+view yet is read from server unless event carries its id."""
+        dn = obj.attributes.get('dn')
+        status = obj.attributes.get('status', '')
+        attributes = obj.attributes
+        if 'deleted' not in status and 'id' not in attributes:
+            with self._lock:
+                known = dn in self.faults
+            if not known:
+                attributes = self._resolve(dn)
+                if attributes is None:
+                    return
+                attributes.update(obj.attributes)
+        with self._lock:
+            fault = self._remove(dn)
+            if 'deleted' in status:
+                return
+            if fault is None:
+                fault = {}
+            for name in self.attributes:
+                if name in attributes:
+                    fault[name] = attributes[name]
+            self._add(dn, fault)
+
+    def _resolve(self, dn):
+        try:
+            obj = self.connection.resolve_dn(dn)
+        except UcsmError, e:
+            LOG.warning('Could not read fault %s: %s', dn, e)
+            return None
+        if obj is None:
+            return None
+        return dict(obj.attributes)
+
+    def _wanted(self, obj):
+        # deletions and partial modifications of faults in view do not carry
+        # attributes filter may check
+        with self._lock:
+            if obj.attributes.get('dn') in self.faults:
+                return True
+        return self.filter.matches(obj)
+
+    def watch(self):
+        """Starts updating view from events matching filter."""
+        if self._watch is None:
+            self._watch = self.connection.watch(class_ids='faultInst',
+                                                filter=self._wanted,
+                                                callback=self.apply_event)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.cancel()
+            self._watch = None
+
+    def summary(self):
+        """Returns list of (code, severity, affected dn, count), largest
+groups first."""
+        with self._lock:
+            res = [key + (len(dns),) for key, dns in self.groups.iteritems()]
+        res.sort(key=lambda item: -item[3])
+        return res
+
+    def acknowledge(self, keys=None, predicate=None):
+        """Acknowledges not yet acknowledged faults of given group keys (all
+by default) for which predicate(dn, fault) is true. Returns UcsmBulkResult
+with fault dicts by dn in changed and exceptions by dn in failed."""
+        with self._lock:
+            if keys is None:
+                keys = self.groups.keys()
+            dns = [dn for key in keys for dn in self.groups.get(key, ())]
+            todo = [(dn, self.faults[dn]) for dn in sorted(dns)
+                    if 'id' in self.faults[dn]
+                    and self.faults[dn].get('ack') != 'yes'
+                    and (predicate is None or
+                         predicate(dn, self.faults[dn]))]
+        batches = [todo[start:start + self.batch_size]
+                   for start in xrange(0, len(todo), self.batch_size)]
+
+        def send(batch):
+            self.connection.ack_faults([fault['id'] for dn, fault in batch])
+        result = UcsmBulkResult()
+        for batch, (res, exc) in zip(batches, _run_in_threads(
+                self.connection._bind(send), batches, self.parallelism)):
+            for dn, fault in batch:
+                if exc is None:
+                    fault['ack'] = 'yes'
+                    result.changed[dn] = fault
+                else:
+                    result.failed[dn] = exc
+        return result
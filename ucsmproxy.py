@@ -0,0 +1,522 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import BaseHTTPServer
+import getopt
+import logging
+import Queue
+import SocketServer
+import socket
+import sys
+import threading
+import time
+import uuid
+from xml.dom import minidom
+import xml.dom as dom
+
+from pyucsm import UcsmConnection, UcsmError, UcsmFilterOp, UcsmIndex, \
+    parse_filter, set_debug
+
+
+LOG = logging.getLogger('pyucsm.proxy')
+
+ENDPOINT = '/nuova'
+
+# methods served from mirror
+MIRRORED_METHODS = frozenset(['configResolveDn', 'configResolveDns',
+                              'configResolveClass', 'configResolveClasses',
+                              'configResolveChildren',
+                              'configFindDnsByClassId'])
+
+
+def _elements(node, tag=None):
+    return [child for child in node.childNodes
+            if child.nodeType == dom.Node.ELEMENT_NODE
+            and (tag is None or child.tagName == tag)]
+
+
+def _child(node, tag):
+    children = _elements(node, tag)
+    return children and children[0] or None
+
+
+def _reply(method, cookie='', **attributes):
+    node = minidom.Element(method)
+    node.setAttribute('cookie', cookie)
+    node.setAttribute('response', 'yes')
+    for name, value in attributes.items():
+        node.setAttribute(name, str(value))
+    return node
+
+
+def _error_reply(method, code, description):
+    return _reply(method, errorCode=code,
+                  invocationResult='unidentified-fail',
+                  errorDescr=description)
+
+
+class _Subscriber(object):
+    def __init__(self, filter, queue_size):
+        self.filter = filter
+        self.queue = Queue.Queue(queue_size)
+        self.dropped = False
+
+
+class UcsmProxy(object):
+    """Local UCSM endpoint serving reads from in-memory mirror of subtrees of
+roots, which is kept in sync by events of upstream connection. Other methods
+are forwarded upstream with proxy's session, event subscriptions share
+upstream one. Clients log in with credentials from users dictionary, or with
+upstream credentials if it is not given. Mirror is loaded every time event
+subscription is established, events arriving during load are applied after
+it, reads are forwarded upstream until then.
+    """
+    refresh_period = 600
+    subscribe_timeout = 60
+
+    def __init__(self, connection, login, password, roots=('sys', 'org-root'),
+                 users=None, broker=None, queue_size=1000):
+        self.connection = connection
+        self.login = login
+        self.password = password
+        self.roots = roots
+        self.users = users if users is not None else {login: password}
+        self.broker = broker
+        self.queue_size = queue_size
+        self.index = UcsmIndex()
+        self.synced = False
+        self.sessions = {}
+        self._lock = threading.RLock()
+        self._subscribers = []
+        self._journal = None
+        self._watch = None
+        self._lease = None
+        # events received while mirror loads, None when it is not loading
+        self._pending = None
+        # increased when subscription is lost
+        self._generation = 0
+        self._subscribed = threading.Event()
+
+    def start(self):
+        """Logs in upstream, subscribes for events and loads mirror."""
+        if self.broker is not None:
+            self._lease = self.broker.lease(self.connection, self.login,
+                                            self.password)
+            self._lease.start_autorenew()
+        else:
+            self.connection.login(self.login, self.password)
+        self._journal = self.connection.journal
+        self.connection.journal = self
+        self._watch = self.connection.watch(callback=self._apply_event,
+                                            on_subscribe=self._on_subscribe,
+                                            on_lost=self._on_lost)
+        if not self._subscribed.wait(self.subscribe_timeout):
+            raise UcsmError('Event subscription is not established.')
+        self._load()
+
+    def _on_subscribe(self):
+        with self._lock:
+            self._pending = []
+        if not self._subscribed.is_set():
+            self._subscribed.set()
+            return
+        loader = threading.Thread(target=self._reload, name='ucsmproxy-load')
+        loader.daemon = True
+        loader.start()
+
+    def _on_lost(self):
+        LOG.warning('Event subscription lost, forwarding reads upstream')
+        with self._lock:
+            self._generation += 1
+            self._pending = None
+            self.synced = False
+
+    def _reload(self):
+        try:
+            self._load()
+        except UcsmError, e:
+            LOG.warning('Mirror reload failed: %s', e)
+
+    def _load(self):
+        """Loads mirror, then applies events received meanwhile. Returns
+False if subscription was lost during load."""
+        with self._lock:
+            generation = self._generation
+        index = UcsmIndex()
+        for root in self.roots:
+            self.connection.resolve_dn(root, hierarchy=True, index=index)
+        with self._lock:
+            if generation != self._generation or self._pending is None:
+                return False
+            for event_id, obj in self._pending:
+                index.apply_event(obj)
+            self._pending = None
+            self.index = index
+            self.synced = True
+            return True
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.cancel()
+            self._watch = None
+        self.connection.journal = self._journal
+        with self._lock:
+            for subscriber in self._subscribers:
+                subscriber.dropped = True
+        if self._lease is not None:
+            self._lease.release()
+
+    def _mirrored(self, dn):
+        return any(dn == root or dn.startswith(root + '/')
+                   for root in self.roots)
+
+    def _apply_event(self, event_id, obj):
+        if self._mirrored(obj.attributes.get('dn', '')):
+            with self._lock:
+                if self._pending is not None:
+                    self._pending.append((event_id, obj))
+                elif self.synced:
+                    self.index.apply_event(obj)
+
+    def append(self, frame, frame_xml):
+        """Receives event frames of upstream connection."""
+        if self._journal is not None:
+            self._journal.append(frame, frame_xml)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        events = None
+        for subscriber in subscribers:
+            if type(subscriber.filter) is not UcsmFilterOp:
+                if events is None:
+                    events = list(
+                        self.connection._get_events_from_xml(frame_xml))
+                if not any(subscriber.filter.matches(obj)
+                           for event_id, obj in events):
+                    continue
+            try:
+                subscriber.queue.put_nowait(frame)
+            except Queue.Full:
+                LOG.warning('Dropping slow event subscriber')
+                subscriber.dropped = True
+
+    def subscribe(self, filter):
+        subscriber = _Subscriber(filter, self.queue_size)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def _check_cookie(self, cookie):
+        with self._lock:
+            expires = self.sessions.get(cookie)
+            if expires is None:
+                return False
+            if expires < time.time():
+                del self.sessions[cookie]
+                return False
+            return True
+
+    def _new_session(self):
+        cookie = uuid.uuid4().hex
+        with self._lock:
+            self.sessions[cookie] = time.time() + 2 * self.refresh_period
+        return cookie
+
+    def handle(self, query):
+        """Returns reply XML node for query XML node."""
+        method = query.tagName
+        if method in ('aaaLogin', 'aaaRefresh'):
+            name = query.getAttribute('inName')
+            if self.users.get(name) != query.getAttribute('inPassword') \
+                    or method == 'aaaRefresh' \
+                    and not self._check_cookie(query.getAttribute('inCookie')):
+                return _error_reply(method, 551, 'Authentication failed')
+            if method == 'aaaRefresh':
+                with self._lock:
+                    self.sessions.pop(query.getAttribute('inCookie'), None)
+            return _reply(method, outCookie=self._new_session(),
+                          outRefreshPeriod=self.refresh_period,
+                          outPriv=','.join(getattr(self.connection,
+                                                   'privileges', [])),
+                          outVersion=self.connection.version or '',
+                          outSessionId='')
+        if method == 'aaaLogout':
+            with self._lock:
+                self.sessions.pop(query.getAttribute('inCookie'), None)
+            return _reply(method, outStatus='success')
+        cookie = query.getAttribute('cookie')
+        if not self._check_cookie(cookie):
+            return _error_reply(method, 552, 'Authorization required')
+        build = None
+        if method in MIRRORED_METHODS and self.synced:
+            # reply is built outside of lock from copies of mirrored objects
+            with self._lock:
+                if self.synced:
+                    build = getattr(self, '_' + method)(query)
+        if build is not None:
+            reply = build()
+        else:
+            reply = self.connection._forward_query(query).documentElement
+        reply.setAttribute('cookie', cookie)
+        return reply
+
+    def _hierarchy(self, query):
+        return query.getAttribute('inHierarchical') in ('true', 'yes')
+
+    def _filter(self, query):
+        return parse_filter(_child(query, 'inFilter'))
+
+    def _configs_reply(self, query, objects, **attributes):
+        """Returns function building reply with copies of objects."""
+        objects = [obj.copy() for obj in objects]
+        hierarchy = self._hierarchy(query)
+
+        def build():
+            reply = _reply(query.tagName, **attributes)
+            configs = minidom.Element('outConfigs')
+            for obj in objects:
+                configs.appendChild(obj.xml_node(hierarchy))
+            reply.appendChild(configs)
+            return reply
+        return build
+
+    def _configResolveDn(self, query):
+        dn = query.getAttribute('dn')
+        obj = self.index.get(dn)
+        if obj is None and not self._mirrored(dn):
+            return None
+        obj = obj and obj.copy()
+        hierarchy = self._hierarchy(query)
+
+        def build():
+            reply = _reply(query.tagName, dn=dn)
+            config = minidom.Element('outConfig')
+            if obj is not None:
+                config.appendChild(obj.xml_node(hierarchy))
+            reply.appendChild(config)
+            return reply
+        return build
+
+    def _configResolveDns(self, query):
+        dns = [node.getAttribute('value')
+               for node in _elements(_child(query, 'inDns'), 'dn')]
+        found = [self.index.get(dn) for dn in dns]
+        configs = self._configs_reply(query, [obj for obj in found if obj])
+        unresolved = [dn for dn, obj in zip(dns, found) if obj is None]
+
+        def build():
+            reply = configs()
+            node = minidom.Element('outUnresolved')
+            for dn in unresolved:
+                child = minidom.Element('dn')
+                child.setAttribute('value', dn)
+                node.appendChild(child)
+            reply.appendChild(node)
+            return reply
+        return build
+
+    def _find(self, class_ids, filter):
+        res = []
+        for class_id in class_ids:
+            objects = self.index.find(class_id)
+            if not objects:
+                # class may be abstract or out of mirrored roots
+                return None
+            res.extend(obj for obj in objects if filter.matches(obj))
+        return res
+
+    def _configResolveClass(self, query):
+        class_id = query.getAttribute('classId')
+        objects = self._find([class_id], self._filter(query))
+        if objects is None:
+            return None
+        return self._configs_reply(query, objects, classId=class_id)
+
+    def _configResolveClasses(self, query):
+        class_ids = [node.getAttribute('value')
+                     for node in _elements(_child(query, 'inIds'), 'id')]
+        objects = self._find(class_ids, UcsmFilterOp())
+        if objects is None:
+            return None
+        return self._configs_reply(query, objects)
+
+    def _configResolveChildren(self, query):
+        dn = query.getAttribute('inDn')
+        class_id = query.getAttribute('classId')
+        if dn not in self.index:
+            return None
+        filter = self._filter(query)
+        objects = [obj for obj in self.index.children(dn)
+                   if (not class_id or obj.ucs_class == class_id)
+                   and filter.matches(obj)]
+        return self._configs_reply(query, objects, inDn=dn)
+
+    def _configFindDnsByClassId(self, query):
+        class_id = query.getAttribute('classId')
+        objects = self._find([class_id], self._filter(query))
+        if objects is None:
+            return None
+        found = [obj.dn for obj in objects]
+
+        def build():
+            reply = _reply(query.tagName, classId=class_id)
+            dns = minidom.Element('outDns')
+            for dn in found:
+                node = minidom.Element('dn')
+                node.setAttribute('value', dn)
+                dns.appendChild(node)
+            reply.appendChild(dns)
+            return reply
+        return build
+
+
+class _ProxyRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if self.path != ENDPOINT:
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            query = minidom.parseString(body).documentElement
+        except Exception:
+            self.send_error(400)
+            return
+        proxy = self.server.proxy
+        if query.tagName == 'eventSubscribe' \
+                and proxy._check_cookie(query.getAttribute('cookie')):
+            self._stream(proxy, query)
+            return
+        try:
+            reply = proxy.handle(query).toxml()
+        except UcsmError, e:
+            LOG.warning('Failed to handle %s: %s', query.tagName, e)
+            reply = _error_reply(query.tagName, 1, str(e)).toxml()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def _stream(self, proxy, query):
+        subscriber = proxy.subscribe(parse_filter(_child(query, 'inFilter')))
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.end_headers()
+            self.wfile.flush()
+            while not subscriber.dropped:
+                try:
+                    frame = subscriber.queue.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                self.wfile.write('%d\n%s' % (len(frame), frame))
+                self.wfile.flush()
+        except socket.error:
+            pass
+        finally:
+            proxy.unsubscribe(subscriber)
+
+    def log_message(self, format, *args):
+        LOG.debug(format, *args)
+
+
+class UcsmProxyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server of UcsmProxy, each client is handled in own thread."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, proxy, address=('127.0.0.1', 8080)):
+        BaseHTTPServer.HTTPServer.__init__(self, address,
+                                           _ProxyRequestHandler)
+        self.proxy = proxy
+
+
+def usage():
+    print """Usage:
+    ucsmproxy [-l login] [-p password] [-s] [-b [address:]port]
+              [-r root]... [-u user:password]... [-d] host[:port]
+
+Serves UCSM XML API on local address (127.0.0.1:8080 by default), answering
+reads from mirror of root subtrees (sys and org-root by default)."""
+
+
+def main():
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], 'l:p:sb:r:u:d')
+    except getopt.GetoptError, e:
+        usage()
+        print e
+        exit()
+    if len(args) != 1:
+        usage()
+        exit()
+    login = 'admin'
+    password = 'nbv12345'
+    secure = False
+    address = ('127.0.0.1', 8080)
+    roots = []
+    users = None
+    for opt, val in opts:
+        if opt == '-l':
+            login = val
+        elif opt == '-p':
+            password = val
+        elif opt == '-s':
+            secure = True
+        elif opt == '-b':
+            host, colon, port = val.rpartition(':')
+            address = (host or '127.0.0.1', int(port))
+        elif opt == '-r':
+            roots.append(val)
+        elif opt == '-u':
+            if users is None:
+                users = {}
+            user, colon, user_password = val.partition(':')
+            users[user] = user_password
+        elif opt == '-d':
+            set_debug(True)
+    host, colon, port = args[0].partition(':')
+    connection = UcsmConnection(host, port and int(port) or None,
+                                secure=secure)
+    proxy = UcsmProxy(connection, login, password,
+                      roots=roots or ('sys', 'org-root'), users=users)
+    proxy.start()
+    server = UcsmProxyServer(proxy, address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.stop()
+        connection.logout()
+
+if __name__ == '__main__':
+    main()
@@ -25,12 +25,17 @@
 
 
 from pyucsm import *
+import pyucsm
 import getopt
-from inspect import getargspec
+from inspect import getargspec, getcallargs
+import shlex
+import StringIO
 import sys
 
 
-IGNORE = ['set_auth', 'login', 'logout', 'refresh']
+IGNORE = ['set_auth', 'login', 'logout', 'refresh', 'is_logged_in',
+          'deadline', 'priority', 'watch', 'iter_events',
+          'iter_class_partitioned']
 CONN_CLS = UcsmConnection
 ONLY_DN = False
 HIERARCHY = False
@@ -80,6 +85,8 @@ def usage():
 Options:
     -l login -- UCSM login
     -p pass  -- password
+    -b file  -- run commands from file, one per line, "-" for stdin
+    -j N     -- number of commands run at once in batch mode
 
 Commands:
 
@@ -89,55 +96,61 @@ Arguments for UCSM query must be used as long options. Sample:
 
 ucsmquery.py 192.168.0.1 -l admin -p 12345  resolve_dn \
 --dn=sys/chassis-2/blade-5
+
+Batch file contains commands with their arguments, lines starting with # are
+skipped:
+
+resolve_dn --dn=sys/chassis-2/blade-5
+resolve_class --class_id=computeBlade
 """ % create_doc(UcsmConnection)
 
 
-def wrong_command(command=None):
-    print """Command not found or incorrect arguments."""
+def wrong_command(command=None, out=None):
+    print >>out, """Command not found or incorrect arguments."""
 
 
-def print_objects(objects, only_dn=False, hierarchy=False):
+def print_objects(objects, only_dn=False, hierarchy=False, out=None):
     if only_dn:
         for obj in objects:
             try:
-                print '%s: %s' % (obj.ucs_class, obj.dn)
+                print >>out, '%s: %s' % (obj.ucs_class, obj.dn)
             except AttributeError:
-                print '%s object has no DN' % obj.ucs_class
+                print >>out, '%s object has no DN' % obj.ucs_class
             if hierarchy:
-                print
-                print_objects(obj.children, only_dn, hierarchy)
+                print >>out
+                print_objects(obj.children, only_dn, hierarchy, out)
     else:
         newline = False
         for obj in objects:
             if newline:
-                print
-            print obj.pretty_str()
+                print >>out
+            print >>out, obj.pretty_str()
             if hierarchy:
                 if len(obj.children):
-                    print
-                print_objects(obj.children, only_dn, hierarchy)
+                    print >>out
+                print_objects(obj.children, only_dn, hierarchy, out)
             newline = True
 
 
-def print_objects_glob(objects):
-    print_objects(objects, ONLY_DN, HIERARCHY)
+def print_objects_glob(objects, out=None):
+    print_objects(objects, ONLY_DN, HIERARCHY, out)
 
 
-def serialize_print(data):
+def serialize_print(data, out=None):
     if isinstance(data, list):
         if len(data) and isinstance(data[0], UcsmObject):
-            print_objects_glob(data)
+            print_objects_glob(data, out)
         else:
             for elem in data:
-                serialize_print(elem)
+                serialize_print(elem, out)
     if isinstance(data, UcsmObject):
-        print_objects_glob([data])
+        print_objects_glob([data], out)
     if isinstance(data, dict):
         for key, val in data.items():
-            print '%s:'
-            serialize_print(val)
+            print >>out, '%s:'
+            serialize_print(val, out)
     if isinstance(data, basestring):
-        print data
+        print >>out, data
 
 
 def kwargs_to_ucsm_object(cls_, **kwargs):
@@ -165,21 +178,103 @@ def kwargs_from_opts(opts):
     return kwargs
 
 
+def run_command(client, command, args=list(), opts=dict(), out=None):
+    """Runs command on logged in client, printing reply to out. Returns
+False if command failed."""
+    try:
+        method = getattr(client, command)
+        kwargs = kwargs_from_opts(opts)
+        # only arguments that do not fit the command mean wrong command,
+        # TypeError raised by the command itself is a bug to report
+        getcallargs(method, *args, **kwargs)
+    except (AttributeError, TypeError):
+        wrong_command(out=out)
+        return False
+    try:
+        reply = method(*args, **kwargs)
+        serialize_print(reply, out)
+        return True
+    except KeyError:
+        wrong_command(out=out)
+    except UcsmError, e:
+        print >>out, "Error: %s" % e
+    return False
+
+
 def perform(host, login, password, command, args=list(), opts=dict(), port=80):
     client = CONN_CLS(host, port)
     try:
         global quiet
         client.login(login, password)
-        reply = getattr(client, command)(*args, **kwargs_from_opts(opts))
-        serialize_print(reply)
-    except (KeyError, AttributeError):
-        wrong_command()
-    except UcsmError, e:
-        print "Error: %s" % e
+        run_command(client, command, args, opts)
     finally:
         client.logout()
 
 
+def parse_batch_line(line):
+    """Parses batch line into command, arguments and options. Returns None
+for empty lines and comments."""
+    words = shlex.split(line, comments=True)
+    if not words:
+        return None
+    opts, args = getopt.gnu_getopt(words, '', get_possible_opts(CONN_CLS))
+    if not args:
+        raise getopt.GetoptError('command is missing')
+    return args[0], args[1:], dict((opt[2:], val) for opt, val in opts)
+
+
+def perform_batch(host, login, password, lines, port=80, workers=1,
+                  out=None):
+    """Runs commands from lines over one session, workers of them at once.
+Output of every command follows line with the command and is written as soon
+as preceding commands are done. Returns number of failed commands."""
+    def run(line):
+        buf = StringIO.StringIO()
+        try:
+            parsed = parse_batch_line(line)
+        except (ValueError, getopt.GetoptError), e:
+            print >>buf, "Error: %s" % e
+            return line, buf.getvalue(), False
+        if parsed is None:
+            return line, None, True
+        command, args, opts = parsed
+        try:
+            ok = run_command(client, command, args, opts, buf)
+        except Exception, e:
+            # one broken command must not abort the rest of batch
+            print >>buf, "Error: %s: %s" % (e.__class__.__name__, e)
+            ok = False
+        return line, buf.getvalue(), ok
+
+    if out is None:
+        out = sys.stdout
+    client = CONN_CLS(host, port)
+    failed = 0
+    try:
+        client.login(login, password)
+        results = pyucsm._iter_in_threads(client._bind(run), lines, workers)
+        for line, output, ok in results:
+            if output is None:
+                continue
+            print >>out, '# %s' % line.strip()
+            out.write(output)
+            out.flush()
+            failed += not ok
+    finally:
+        client.logout()
+    return failed
+
+
+def parse_host(address):
+    port = 80
+    host = address
+    colon = address.find(':')
+    if colon >= 0:
+        host = address[:colon]
+        port = int(address[colon + 1:])
+    return host, port
+
+
 def import_class(path):
     mod, cls = path.rsplit('.', 1)
     return getattr(__import__(mod, fromlist=[cls]), cls)
@@ -191,7 +286,7 @@ def main():
     global HIERARCHY
     try:
         argv = sys.argv[1:]
-        opts, args = getopt.gnu_getopt(argv, 'l:p:P:dqcr',
+        opts, args = getopt.gnu_getopt(argv, 'l:p:P:dqcrb:j:',
                                        get_possible_opts(CONN_CLS))
     except getopt.GetoptError, e:
         usage()
@@ -200,6 +295,8 @@ def main():
     login = 'admin'
     password = 'nbv12345'
     comm_opts = {}
+    batch = None
+    workers = 1
     global quiet
     quiet = False
     for opt, val in opts:
@@ -218,16 +315,31 @@ def main():
             HIERARCHY = True
         elif opt == '-c':
             CONN_CLS = import_class(val)
+        elif opt == '-b':
+            batch = val
+        elif opt == '-j':
+            try:
+                workers = int(val)
+            except ValueError:
+                workers = 0
+            if workers < 1:
+                usage()
+                print 'option -j requires positive number of workers'
+                exit()
+    if batch is not None and len(args) == 1:
+        host, port = parse_host(args[0])
+        if batch == '-':
+            lines = sys.stdin
+        else:
+            lines = open(batch)
+        failed = perform_batch(host, login, password, lines, port=port,
+                               workers=workers)
+        exit(failed and 1 or 0)
     if len(args) >= 2:
         if args[0] == 'help':
             print_help(args[1])
             exit(0)
-        port = 80
-        host = args[0]
-        colon = args[0].find(':')
-        if colon >= 0:
-            host = args[0][:colon]
-            port = int(args[0][colon + 1:])
+        host, port = parse_host(args[0])
         perform(host, login, password, args[1], args=args[2:],
                 opts=comm_opts, port=port)
     else:
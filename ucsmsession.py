@@ -0,0 +1,246 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import json
+import logging
+import os
+import threading
+import time
+from threading import Timer
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from pyucsm import UcsmError
+
+
+LOG = logging.getLogger('pyucsm.session')
+
+
+class UcsmSessionError(UcsmError):
+    """Session store is unavailable.
+    """
+    pass
+
+
+class _LockedStore(object):
+    """Context manager giving exclusive access to JSON file, readable and
+writable only by owner. Content is returned by entering and written back
+on exit without exception."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            os.fchmod(self.fd, 0600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(self.fd), 'rb') as f:
+                raw = f.read()
+            try:
+                self.data = json.loads(raw) if raw else {}
+            except ValueError:
+                LOG.warning('Session store %s is corrupted, resetting',
+                            self.path)
+                self.data = {}
+        except:
+            os.close(self.fd)
+            raise
+        return self.data
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                raw = json.dumps(self.data)
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                os.ftruncate(self.fd, 0)
+                os.write(self.fd, raw)
+                os.fsync(self.fd)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+
+
+class UcsmLease(object):
+    """Session leased to connection by UcsmSessionBroker. Renewal picks up
+cookie refreshed by any process; it is done automatically every
+renew_interval seconds after start_autorenew.
+    """
+
+    def __init__(self, broker, connection, login, password, slot):
+        self.broker = broker
+        self.connection = connection
+        self.login = login
+        self.password = password
+        self.slot = slot
+        self.cookie = None
+        self.__timer = None
+        self.__timer_lock = threading.Lock()
+        self.__released = False
+
+    def renew(self):
+        """Refreshes session if it is due and gives current cookie to
+connection."""
+        self.broker._renew(self)
+
+    def invalidate(self):
+        """Drops session, which server does not accept anymore, and leases
+another one."""
+        self.broker._invalidate(self)
+
+    def start_autorenew(self, renew_interval=60):
+        with self.__timer_lock:
+            if self.__released:
+                return
+            self.renew_interval = renew_interval
+            self.__timer = Timer(renew_interval, self._autorenew)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def _autorenew(self):
+        try:
+            self.renew()
+        except Exception:
+            LOG.exception('Exception during session renewal')
+        self.start_autorenew(self.renew_interval)
+
+    def release(self):
+        """Stops autorenewal, also when renewal is in progress."""
+        with self.__timer_lock:
+            self.__released = True
+            if self.__timer:
+                self.__timer.cancel()
+                self.__timer = None
+
+
+class UcsmSessionBroker(object):
+    """Shares UCSM sessions between connections of all local processes.
+Cookies are kept in JSON file at path guarded by file lock, at most sessions
+cookies per domain and login. Connections get them with lease through
+set_auth, so login is performed only when no live session exists. Session is
+refreshed by the first process which renews its lease after half of refresh
+period. Passwords are never written to the file.
+    """
+
+    def __init__(self, path, sessions=1):
+        if fcntl is None:
+            raise UcsmSessionError('File locking is not supported on %s.' %
+                                   os.name)
+        self.path = path
+        self.sessions = sessions
+        self._lock = threading.Lock()
+        self._next_slot = 0
+
+    @staticmethod
+    def _key(connection, login):
+        return '%s:%s/%s' % (connection.host, connection.port, login)
+
+    def _open(self):
+        return _LockedStore(self.path)
+
+    def _live_sessions(self, data, key, now):
+        sessions = [session for session in data.get(key, [])
+                    if session['refreshed'] + session['period'] > now]
+        data[key] = sessions
+        return sessions
+
+    def lease(self, connection, login, password):
+        """Gives connection a live shared session. Returns UcsmLease."""
+        with self._lock:
+            slot = self._next_slot
+            self._next_slot += 1
+        lease = UcsmLease(self, connection, login, password, slot)
+        self._renew(lease)
+        return lease
+
+    def _renew(self, lease, drop_cookie=None):
+        connection = lease.connection
+        key = self._key(connection, lease.login)
+        with self._open() as data:
+            now = time.time()
+            sessions = self._live_sessions(data, key, now)
+            if drop_cookie is not None:
+                sessions[:] = [session for session in sessions
+                               if session['cookie'] != drop_cookie]
+            session = None
+            if len(sessions) >= self.sessions:
+                session = dict(sessions[lease.slot % len(sessions)])
+        if session is not None \
+                and now - session['refreshed'] <= session['period'] / 2:
+            connection.set_auth(session['cookie'], lease.login,
+                                lease.password)
+            lease.cookie = session['cookie']
+            return
+        # login and refresh are done without holding file lock, so slow
+        # server does not block other processes
+        if session is None:
+            LOG.debug('Logging in to %s', key)
+            cookie = connection.login(lease.login, lease.password,
+                                      autorefresh=False)
+        else:
+            LOG.debug('Refreshing shared session of %s', key)
+            connection.set_auth(session['cookie'], lease.login,
+                                lease.password)
+            cookie = connection.refresh()
+        fresh = {'cookie': cookie, 'refreshed': time.time(),
+                 'period': connection.refresh_period}
+        with self._open() as data:
+            sessions = self._live_sessions(data, key, time.time())
+            stored = [i for i, other in enumerate(sessions)
+                      if session is not None
+                      and other['cookie'] == session['cookie']]
+            if stored:
+                sessions[stored[0]] = fresh
+            elif len(sessions) < self.sessions:
+                sessions.append(fresh)
+            else:
+                # other process stored its session meanwhile
+                fresh = sessions[lease.slot % len(sessions)]
+        if fresh['cookie'] != cookie:
+            try:
+                connection.logout()
+            except UcsmError, e:
+                LOG.warning('Logout of extra session of %s failed: %s',
+                            key, e)
+            connection.set_auth(fresh['cookie'], lease.login, lease.password)
+        lease.cookie = fresh['cookie']
+
+    def _invalidate(self, lease):
+        self._renew(lease, drop_cookie=lease.cookie)
+
+    def logout(self, connection, login):
+        """Logs out all shared sessions of domain and login."""
+        key = self._key(connection, login)
+        with self._open() as data:
+            for session in data.pop(key, []):
+                connection.set_auth(session['cookie'])
+                try:
+                    connection.logout()
+                except UcsmError, e:
+                    LOG.warning('Logout of %s failed: %s', key, e)
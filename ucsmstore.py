@@ -0,0 +1,578 @@
+#!/usr/bin/python
+
+# Copyright (c) 2011 Grid Dynamics Consulting Services, Inc, All Rights Reserved
+#  http://www.griddynamics.com
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+#  FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#  DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#  SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#  OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#  @Project:     pyucsm
+#  @Description: Python binding for CISCO UCS XML API
+
+
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from xml.dom import minidom
+
+from pyucsm import UcsmError, UcsmIndex, UcsmObject, Dn
+
+
+class UcsmStoreError(UcsmError):
+    """Corrupted or incompatible storage file.
+    """
+    pass
+
+
+def _atomic_write(path, write):
+    """Calls write with file object of temporary file, which then replaces
+file at path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                    prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Snapshot file layout, all numbers are little-endian:
+#   header
+#   string table: (n_strings + 1) uint32 offsets relative to blob, utf8 blob
+#   object table: n_objects uint64 record offsets, records
+#   dn index: n uint32, n pairs of (dn string id, object id) sorted by dn
+#   class index: n uint32, n triples of (class string id, count, start),
+#                object ids of all classes
+# Objects are stored in breadth-first order, so children of every object
+# are contiguous.
+_SNAPSHOT_MAGIC = 'UCSMSNP1'
+_HEADER = struct.Struct('<8sIqdIIQQQQ')
+_RECORD = struct.Struct('<IIiIII')
+_PAIR = struct.Struct('<II')
+_CLASS = struct.Struct('<III')
+_UINT = struct.Struct('<I')
+_UINT64 = struct.Struct('<Q')
+_NO_STRING = 0xFFFFFFFF
+
+
+def write_snapshot(path, objects, last_event_id=None):
+    """Writes object trees to snapshot file atomically. Objects is iterable
+of root objects with their children or UcsmIndex. Last event id is stored to
+continue from it using events stream."""
+    if isinstance(objects, UcsmIndex):
+        objects = objects.roots()
+    strings = {}
+    string_list = []
+
+    def sid(value):
+        if value is None:
+            return _NO_STRING
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        else:
+            value = str(value)
+        try:
+            return strings[value]
+        except KeyError:
+            strings[value] = len(string_list)
+            string_list.append(value)
+            return strings[value]
+
+    nodes = [(obj, -1) for obj in objects]
+    records = []
+    first_child = len(nodes)
+    i = 0
+    while i < len(nodes):
+        obj, parent = nodes[i]
+        attrs = obj._attrs()
+        children = obj._kids()
+        record = [_RECORD.pack(sid(obj.ucs_class),
+                               sid(attrs.get('dn')), parent,
+                               first_child, len(children),
+                               len(attrs) - ('dn' in attrs))]
+        record.extend(_PAIR.pack(sid(name), sid(value))
+                      for name, value in attrs.iteritems() if name != 'dn')
+        records.append(''.join(record))
+        nodes.extend((child, i) for child in children)
+        first_child += len(children)
+        i += 1
+
+    dn_index = sorted((string_list[dn_sid], dn_sid, idx)
+                      for idx, dn_sid in
+                      ((idx, _RECORD.unpack_from(rec)[1])
+                       for idx, rec in enumerate(records))
+                      if dn_sid != _NO_STRING)
+    classes = {}
+    for idx, (obj, _) in enumerate(nodes):
+        classes.setdefault(sid(obj.ucs_class), []).append(idx)
+
+    def write(f):
+        f.write('\0' * _HEADER.size)
+        strings_offset = f.tell()
+        offset = 0
+        for value in string_list:
+            f.write(_UINT.pack(offset))
+            offset += len(value)
+        f.write(_UINT.pack(offset))
+        if offset > 0xFFFFFFFF:
+            raise UcsmStoreError('Too many strings for snapshot.')
+        for value in string_list:
+            f.write(value)
+        objects_offset = f.tell()
+        offset = objects_offset + _UINT64.size * len(records)
+        for record in records:
+            f.write(_UINT64.pack(offset))
+            offset += len(record)
+        for record in records:
+            f.write(record)
+        dn_index_offset = f.tell()
+        f.write(_UINT.pack(len(dn_index)))
+        for _, dn_sid, idx in dn_index:
+            f.write(_PAIR.pack(dn_sid, idx))
+        class_index_offset = f.tell()
+        f.write(_UINT.pack(len(classes)))
+        start = 0
+        for class_sid, idxs in sorted(classes.items()):
+            f.write(_CLASS.pack(class_sid, len(idxs), start))
+            start += len(idxs)
+        for class_sid, idxs in sorted(classes.items()):
+            f.write(''.join(_UINT.pack(idx) for idx in idxs))
+        f.seek(0)
+        f.write(_HEADER.pack(_SNAPSHOT_MAGIC, 1,
+                             last_event_id is None and -1 or last_event_id,
+                             time.time(), len(string_list), len(records),
+                             strings_offset, objects_offset, dn_index_offset,
+                             class_index_offset))
+
+    _atomic_write(path, write)
+
+
+class UcsmSnapshot(object):
+    """Read-only snapshot file opened through mmap. Objects are decoded only
+when requested.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error), e:
+                raise UcsmStoreError('%s is not a snapshot file: %s' %
+                                     (path, e))
+        try:
+            self._read_header()
+        except struct.error:
+            self.close()
+            raise UcsmStoreError('%s is truncated or corrupted.' % self.path)
+        except:
+            self.close()
+            raise
+
+    def _read_header(self):
+        (magic, version, last_event_id, self.created, self._n_strings,
+         self._n_objects, self._strings_offset, self._objects_offset,
+         self._dn_index_offset, class_index_offset) = \
+            _HEADER.unpack_from(self._map)
+        if magic != _SNAPSHOT_MAGIC or version != 1:
+            raise UcsmStoreError('%s is not a snapshot file.' % self.path)
+        self.last_event_id = last_event_id if last_event_id >= 0 else None
+        self._blob_offset = self._strings_offset + \
+            _UINT.size * (self._n_strings + 1)
+        self._strings = {}
+        self._n_dns = _UINT.unpack_from(self._map, self._dn_index_offset)[0]
+        self._classes = {}
+        n_classes = _UINT.unpack_from(self._map, class_index_offset)[0]
+        ids_offset = class_index_offset + _UINT.size + \
+            _CLASS.size * n_classes
+        for i in range(n_classes):
+            class_sid, count, start = _CLASS.unpack_from(
+                self._map, class_index_offset + _UINT.size + _CLASS.size * i)
+            self._classes[self._string(class_sid)] = \
+                (ids_offset + _UINT.size * start, count)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._n_objects
+
+    def _string(self, sid):
+        if sid == _NO_STRING:
+            return None
+        try:
+            return self._strings[sid]
+        except KeyError:
+            start, end = struct.unpack_from(
+                '<II', self._map, self._strings_offset + _UINT.size * sid)
+            value = self._map[self._blob_offset + start:
+                              self._blob_offset + end]
+            self._strings[sid] = value
+            return value
+
+    def _object(self, idx, hierarchy=False, parent=None):
+        offset = _UINT64.unpack_from(
+            self._map, self._objects_offset + _UINT64.size * idx)[0]
+        class_sid, dn_sid, _, first_child, n_children, n_attrs = \
+            _RECORD.unpack_from(self._map, offset)
+        obj = UcsmObject(self._string(class_sid), parent)
+        attrs = {}
+        offset += _RECORD.size
+        for i in range(n_attrs):
+            name_sid, value_sid = _PAIR.unpack_from(self._map,
+                                                    offset + _PAIR.size * i)
+            attrs[self._string(name_sid)] = self._string(value_sid)
+        if dn_sid != _NO_STRING:
+            attrs['dn'] = Dn(self._string(dn_sid))
+        obj.attributes = attrs
+        if hierarchy:
+            obj.children = [self._object(child, True, obj) for child in
+                            range(first_child, first_child + n_children)]
+        return obj
+
+    def _dn_entry(self, i):
+        return _PAIR.unpack_from(self._map, self._dn_index_offset +
+                                 _UINT.size + _PAIR.size * i)
+
+    def _find_dn(self, dn):
+        lo, hi = 0, self._n_dns
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._string(self._dn_entry(mid)[0]) < dn:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n_dns:
+            dn_sid, idx = self._dn_entry(lo)
+            if self._string(dn_sid) == dn:
+                return idx
+        return None
+
+    def get(self, dn, hierarchy=False):
+        """Returns object with given dn or None."""
+        idx = self._find_dn(str(dn))
+        if idx is None:
+            return None
+        return self._object(idx, hierarchy)
+
+    def __contains__(self, dn):
+        return self._find_dn(str(dn)) is not None
+
+    def classes(self):
+        return self._classes.keys()
+
+    def find(self, class_id, hierarchy=False):
+        """Yields objects of given class."""
+        offset, count = self._classes.get(class_id, (0, 0))
+        for i in range(count):
+            yield self._object(_UINT.unpack_from(self._map,
+                                                 offset + _UINT.size * i)[0],
+                               hierarchy)
+
+    def roots(self, hierarchy=False):
+        """Yields objects which were given to write_snapshot."""
+        for idx in range(self._n_objects):
+            offset = _UINT64.unpack_from(
+                self._map, self._objects_offset + _UINT64.size * idx)[0]
+            if _RECORD.unpack_from(self._map, offset)[2] >= 0:
+                return
+            yield self._object(idx, hierarchy)
+
+    def load_index(self):
+        """Decodes all objects to UcsmIndex. Apply events received after
+last_event_id to index with UcsmIndex.apply_event to catch up."""
+        return UcsmIndex(self.roots(hierarchy=True))
+
+
+# Journal segment record: header, '\n'-joined dns of changed objects, frame.
+_JOURNAL_RECORD = struct.Struct('<IqdI')
+# Journal index entry: event id, timestamp, record offset in segment.
+_JOURNAL_ENTRY = struct.Struct('<qdQ')
+
+
+def _event_info(frame_xml):
+    """Returns greatest event id and list of changed dns of event frame."""
+    eid = -1
+    dns = []
+    for event in frame_xml.getElementsByTagName('configMoChangeEvent'):
+        try:
+            eid = max(eid, int(event.getAttribute('inEid')))
+        except ValueError:
+            pass
+        for config in event.getElementsByTagName('inConfig'):
+            for node in config.childNodes:
+                if node.nodeType == node.ELEMENT_NODE \
+                        and node.hasAttribute('dn'):
+                    dns.append(node.getAttribute('dn').encode('utf8'))
+    return eid, dns
+
+
+def _dn_matches(dn, prefix):
+    return dn == prefix or dn.startswith(prefix + '/')
+
+
+class _JournalSegment(object):
+
+    def __init__(self, directory, number):
+        self.number = number
+        self.path = os.path.join(directory, '%010d.log' % number)
+        self.index_path = os.path.join(directory, '%010d.idx' % number)
+        self.dns_path = os.path.join(directory, '%010d.dns' % number)
+        self.dns = None
+        self.entries = None
+
+    @property
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def load_entries(self):
+        if self.entries is None:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            count = len(data) // _JOURNAL_ENTRY.size
+            self.entries = [_JOURNAL_ENTRY.unpack_from(data, i *
+                                                       _JOURNAL_ENTRY.size)
+                            for i in range(count)]
+        return self.entries
+
+    def load_dns(self):
+        if self.dns is None:
+            if os.path.exists(self.dns_path):
+                with open(self.dns_path, 'rb') as f:
+                    self.dns = [dn for dn in f.read().split('\n') if dn]
+            else:
+                self.dns = sorted(set(dn for _, _, dns, _, _ in self.records()
+                                      for dn in dns))
+        return self.dns
+
+    def may_contain(self, prefix):
+        dns = self.load_dns()
+        i = bisect.bisect_left(dns, prefix)
+        return i < len(dns) and dns[i].startswith(prefix)
+
+    def records(self, start_offset=0):
+        """Yields event id, timestamp, dns, frame and end offset of
+records."""
+        if not self.size:
+            return
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = start_offset
+            while offset + _JOURNAL_RECORD.size <= len(data):
+                length, eid, ts, dns_length = \
+                    _JOURNAL_RECORD.unpack_from(data, offset)
+                offset += _JOURNAL_RECORD.size
+                end = offset + dns_length + length
+                if end > len(data):
+                    return
+                dns = data[offset:offset + dns_length].split('\n')
+                yield eid, ts, [dn for dn in dns if dn], \
+                    data[offset + dns_length:end], end
+                offset = end
+        finally:
+            data.close()
+
+    def remove(self):
+        for path in (self.path, self.index_path, self.dns_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class UcsmEventJournal(object):
+    """Append-only journal of event frames, stored in directory as segment
+files with index by event id, timestamp and dn. Pass journal to UcsmConnection
+constructor as journal keyword argument to record all frames received by
+iter_events. Segments are rotated when grow over segment_bytes, oldest ones
+are removed while journal is bigger than max_bytes or older than max_age
+seconds.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024,
+                 max_bytes=None, max_age=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        numbers = sorted(int(name[:-4]) for name in os.listdir(directory)
+                         if name.endswith('.log') and name[:-4].isdigit())
+        self._segments = [_JournalSegment(directory, n) for n in numbers]
+        if not self._segments:
+            self._segments.append(_JournalSegment(directory, 0))
+        self._open_active()
+
+    def _open_active(self):
+        segment = self._segments[-1]
+        # drop partially written records left after crash
+        good = 0
+        entries = []
+        dns = set()
+        for eid, ts, record_dns, _, end in segment.records():
+            entries.append((eid, ts, good))
+            dns.update(record_dns)
+            good = end
+        with open(segment.path, 'ab') as f:
+            f.truncate(good)
+        with open(segment.index_path, 'wb') as f:
+            for entry in entries:
+                f.write(_JOURNAL_ENTRY.pack(*entry))
+        segment.entries = entries
+        segment.dns = sorted(dns)
+        self._dns = dns
+        self._file = open(segment.path, 'ab')
+        self._index_file = open(segment.index_path, 'ab')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index_file.close()
+
+    def append(self, frame, frame_xml=None, timestamp=None):
+        """Appends raw event frame. Parsed frame can be given to avoid
+parsing it again."""
+        if frame_xml is None:
+            frame_xml = minidom.parseString(frame)
+        eid, dns = _event_info(frame_xml)
+        if timestamp is None:
+            timestamp = time.time()
+        dns_blob = '\n'.join(dns)
+        with self._lock:
+            segment = self._segments[-1]
+            offset = self._file.tell()
+            self._file.write(_JOURNAL_RECORD.pack(len(frame), eid, timestamp,
+                                                  len(dns_blob)))
+            self._file.write(dns_blob)
+            self._file.write(frame)
+            self._file.flush()
+            entry = (eid, timestamp, offset)
+            self._index_file.write(_JOURNAL_ENTRY.pack(*entry))
+            self._index_file.flush()
+            segment.entries.append(entry)
+            if not self._dns.issuperset(dns):
+                self._dns.update(dns)
+                segment.dns = None
+            if self._file.tell() >= self.segment_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        segment = self._segments[-1]
+        self._file.close()
+        self._index_file.close()
+        segment.dns = sorted(self._dns)
+        with open(segment.dns_path, 'wb') as f:
+            f.write('\n'.join(segment.dns))
+        self._segments.append(_JournalSegment(self.directory,
+                                              segment.number + 1))
+        self._open_active()
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        now = time.time()
+        total = sum(segment.size for segment in self._segments)
+        while len(self._segments) > 1:
+            oldest = self._segments[0]
+            entries = oldest.load_entries()
+            expired = self.max_age is not None and \
+                (not entries or entries[-1][1] < now - self.max_age)
+            if not expired and (self.max_bytes is None
+                                or total <= self.max_bytes):
+                break
+            total -= oldest.size
+            oldest.remove()
+            del self._segments[0]
+
+    def enforce_retention(self):
+        """Removes segments which are out of retention limits. It is done
+automatically on segment rotation."""
+        with self._lock:
+            self._enforce_retention()
+
+    def replay_frames(self, start=None, end=None, dn_prefix=None,
+                      since_eid=None):
+        """Yields event id, timestamp and raw frame of recorded events in
+time range [start, end), with event id greater than since_eid and changing
+objects under dn_prefix."""
+        with self._lock:
+            segments = list(self._segments)
+            segment = segments[-1]
+            if segment.dns is None:
+                segment.dns = sorted(self._dns)
+        for segment in segments:
+            entries = segment.load_entries()
+            if not entries:
+                continue
+            if start is not None and entries[-1][1] < start:
+                continue
+            if end is not None and entries[0][1] >= end:
+                break
+            if dn_prefix is not None and not segment.may_contain(dn_prefix):
+                continue
+            offset = 0
+            if start is not None:
+                i = bisect.bisect_left([ts for _, ts, _ in entries], start)
+                offset = entries[i][2]
+            for eid, ts, dns, frame, _ in segment.records(offset):
+                if end is not None and ts >= end:
+                    return
+                if since_eid is not None and eid <= since_eid:
+                    continue
+                if dn_prefix is not None and \
+                        not any(_dn_matches(dn, dn_prefix) for dn in dns):
+                    continue
+                yield eid, ts, frame
+
+    def replay(self, start=None, end=None, dn_prefix=None, since_eid=None):
+        """Yields event id and changed object like UcsmConnection.iter_events
+for recorded events. See replay_frames for arguments."""
+        for eid, ts, frame in self.replay_frames(start, end, dn_prefix,
+                                                 since_eid):
+            frame_xml = minidom.parseString(frame)
+            for event in frame_xml.getElementsByTagName('configMoChangeEvent'):
+                event_id = int(event.getAttribute('inEid'))
+                for config in event.getElementsByTagName('inConfig')[:1]:
+                    for node in config.childNodes:
+                        if node.nodeType != node.ELEMENT_NODE:
+                            continue
+                        obj = UcsmObject(node)
+                        if dn_prefix is None or \
+                                _dn_matches(obj.attributes.get('dn', ''),
+                                            dn_prefix):
+                            yield event_id, obj